@@ -0,0 +1,188 @@
+import os
+import sys
+import gzip
+import time
+import shutil
+import sqlite3
+import asyncio
+import hashlib
+import logging
+import tempfile
+from datetime import datetime
+
+logger = logging.getLogger("shop_bot")
+
+BACKUP_SUFFIX = ".db.gz"
+# Pages copied per backup step, and the pause between steps that lets writers in
+DEFAULT_PAGES_PER_STEP = 64
+DEFAULT_STEP_PAUSE = 0.005
+
+
+def default_backup_dir(db_path):
+    return os.getenv('BACKUP_DIR') or os.path.join(os.path.dirname(db_path) or ".", "backups")
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _integrity_check(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("PRAGMA integrity_check").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def copy_online(source_path, target_path, pages, pause):
+    """Copy a live database with SQLite's online backup API, a few pages at a time"""
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    try:
+        # Sleeping in the progress callback releases the source between
+        # steps so writers are never blocked for long
+        source.backup(target, pages=pages, progress=lambda status, remaining, total: time.sleep(pause))
+    finally:
+        target.close()
+        source.close()
+
+
+def list_backups(backup_dir):
+    """Backup files in the directory, newest first"""
+    if not os.path.isdir(backup_dir):
+        return []
+    names = [name for name in os.listdir(backup_dir) if name.endswith(BACKUP_SUFFIX)]
+    return [os.path.join(backup_dir, name) for name in sorted(names, reverse=True)]
+
+
+def rotate_backups(backup_dir, keep):
+    """Delete all but the newest ``keep`` backups"""
+    removed = []
+    for path in list_backups(backup_dir)[keep:]:
+        os.remove(path)
+        checksum = path + ".sha256"
+        if os.path.exists(checksum):
+            os.remove(checksum)
+        removed.append(path)
+    return removed
+
+
+def backup_database(db_path, backup_dir, keep=14, pages=DEFAULT_PAGES_PER_STEP, pause=DEFAULT_STEP_PAUSE):
+    """Take a verified, compressed snapshot of the database and rotate old ones
+
+    Returns the path of the new backup.
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    started = time.monotonic()
+    name = f"{os.path.splitext(os.path.basename(db_path))[0]}-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}"
+    backup_path = os.path.join(backup_dir, name + BACKUP_SUFFIX)
+
+    with tempfile.TemporaryDirectory(dir=backup_dir) as tmp:
+        snapshot = os.path.join(tmp, name + ".db")
+        copy_online(db_path, snapshot, pages, pause)
+
+        result = _integrity_check(snapshot)
+        if result != "ok":
+            raise RuntimeError(f"Backup snapshot failed integrity check: {result}")
+
+        compressed = os.path.join(tmp, name + BACKUP_SUFFIX)
+        with open(snapshot, 'rb') as src, gzip.open(compressed, 'wb', compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        checksum = _sha256(compressed)
+        os.replace(compressed, backup_path)
+
+    with open(backup_path + ".sha256", 'w') as f:
+        f.write(f"{checksum}  {os.path.basename(backup_path)}\n")
+
+    removed = rotate_backups(backup_dir, keep)
+    logger.info(
+        f"Backed up database to {backup_path} ({os.path.getsize(backup_path)} bytes) "
+        f"in {time.monotonic() - started:.1f}s, removed {len(removed)} old backups"
+    )
+    return backup_path
+
+
+def verify_backup(backup_path):
+    """Check a backup's checksum and the integrity of the database inside it"""
+    checksum_path = backup_path + ".sha256"
+    if os.path.exists(checksum_path):
+        with open(checksum_path, 'r') as f:
+            expected = f.read().split()[0]
+        if _sha256(backup_path) != expected:
+            return "checksum mismatch"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot = os.path.join(tmp, "verify.db")
+        with gzip.open(backup_path, 'rb') as src, open(snapshot, 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        return _integrity_check(snapshot)
+
+
+def restore_backup(backup_path, db_path, pages=DEFAULT_PAGES_PER_STEP, pause=DEFAULT_STEP_PAUSE):
+    """Replace the database contents with a verified backup
+
+    Restores through the online backup API, so connections that are open
+    on the live database see the restored contents.
+    """
+    result = verify_backup(backup_path)
+    if result != "ok":
+        raise RuntimeError(f"Refusing to restore {backup_path}: {result}")
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(db_path))) as tmp:
+        snapshot = os.path.join(tmp, "restore.db")
+        with gzip.open(backup_path, 'rb') as src, open(snapshot, 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        copy_online(snapshot, db_path, pages, pause)
+    logger.info(f"Restored database {db_path} from {backup_path}")
+
+
+async def run_backup(db_path, backup_dir, keep=14):
+    """Run a backup in a worker thread so the event loop keeps running"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, backup_database, db_path, backup_dir, keep)
+
+
+async def run_restore(backup_path, db_path):
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, restore_backup, backup_path, db_path)
+
+
+def main(argv=None):
+    # Only the command line needs argparse; the bot imports this module too
+    import argparse
+    parser = argparse.ArgumentParser(description="Back up or restore the shop database")
+    parser.add_argument("--db", default=os.getenv('DB_PATH', 'shop_database.db'), help="Path to the shop database")
+    parser.add_argument("--dir", help="Backup directory (default: BACKUP_DIR or <db dir>/backups)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    backup_parser = subparsers.add_parser("backup", help="Take a backup now")
+    backup_parser.add_argument("--keep", type=int, default=int(os.getenv('BACKUP_KEEP', 14)))
+    subparsers.add_parser("list", help="List backups")
+    verify_parser = subparsers.add_parser("verify", help="Verify a backup")
+    verify_parser.add_argument("backup")
+    restore_parser = subparsers.add_parser("restore", help="Restore a backup over the database")
+    restore_parser.add_argument("backup")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    backup_dir = args.dir or default_backup_dir(args.db)
+
+    if args.command == "backup":
+        print(backup_database(args.db, backup_dir, args.keep))
+    elif args.command == "list":
+        for path in list_backups(backup_dir):
+            print(f"{os.path.basename(path)}  {os.path.getsize(path)} bytes")
+    elif args.command == "verify":
+        result = verify_backup(args.backup)
+        print(result)
+        return 0 if result == "ok" else 1
+    else:
+        restore_backup(args.backup, args.db)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
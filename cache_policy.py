@@ -0,0 +1,126 @@
+import os
+import logging
+from collections import OrderedDict
+
+import discord
+
+logger = logging.getLogger("shop_bot")
+
+# Cache policies:
+#   minimal - no members intent, no member cache, no chunking (default)
+#   lazy    - members intent, members cached only as they are seen, no startup chunking
+#   full    - members intent, every guild chunked at startup (old behaviour)
+CACHE_POLICIES = ("minimal", "lazy", "full")
+DEFAULT_MAX_MESSAGES = 200
+DEFAULT_USER_CACHE_SIZE = 256
+
+
+def get_cache_policy():
+    """Read the member cache policy from the environment"""
+    policy = os.getenv('MEMBER_CACHE_POLICY', 'minimal').strip().lower()
+    if policy not in CACHE_POLICIES:
+        logger.warning(f"Unknown MEMBER_CACHE_POLICY '{policy}', falling back to 'minimal'")
+        policy = "minimal"
+    return policy
+
+
+def get_max_messages():
+    """Size of discord.py's message cache, 0 disables it"""
+    value = int(os.getenv('MAX_MESSAGES', DEFAULT_MAX_MESSAGES))
+    return value if value > 0 else None
+
+
+def build_intents(policy):
+    """Build gateway intents for the given cache policy"""
+    intents = discord.Intents.default()
+    intents.message_content = True
+    # Message payloads already carry the author's roles, so is_admin
+    # works without the privileged members intent
+    intents.members = policy in ("lazy", "full")
+    return intents
+
+
+def build_member_cache_flags(policy, intents):
+    """Build member cache flags for the given cache policy"""
+    if policy == "minimal":
+        return discord.MemberCacheFlags.none()
+    flags = discord.MemberCacheFlags.from_intents(intents)
+    if policy == "lazy":
+        # Only keep members we see join; voice state members are not needed
+        flags.voice = False
+    return flags
+
+
+def bot_cache_options(policy):
+    """Keyword arguments for commands.Bot implementing the cache policy"""
+    intents = build_intents(policy)
+    return {
+        "intents": intents,
+        "member_cache_flags": build_member_cache_flags(policy, intents),
+        "chunk_guilds_at_startup": policy == "full",
+        "max_messages": get_max_messages(),
+    }
+
+
+class UserCache:
+    """Small LRU of users fetched over HTTP when they are not in the gateway cache"""
+
+    def __init__(self, bot, maxsize=None):
+        self.bot = bot
+        self.maxsize = maxsize or int(os.getenv('USER_CACHE_SIZE', DEFAULT_USER_CACHE_SIZE))
+        self._users = OrderedDict()
+        self.hits = 0
+        self.fetches = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._users)
+
+    async def get(self, user_id):
+        """Return a user from the gateway cache, the LRU or the API
+
+        API errors are raised to the caller: discord.NotFound when the
+        account doesn't exist, any other HTTPException when the fetch failed
+        and is worth retrying.
+        """
+        user = self.bot.get_user(user_id)
+        if user:
+            return user
+
+        user = self._users.get(user_id)
+        if user:
+            self._users.move_to_end(user_id)
+            self.hits += 1
+            return user
+
+        self.fetches += 1
+        try:
+            user = await self.bot.fetch_user(user_id)
+        except discord.NotFound:
+            self.misses += 1
+            raise
+
+        self._users[user_id] = user
+        if len(self._users) > self.maxsize:
+            self._users.popitem(last=False)
+        return user
+
+    def clear(self):
+        self._users.clear()
+
+
+def cache_report(bot, policy, user_cache):
+    """Collect the sizes of discord.py's caches and our user LRU"""
+    return {
+        "policy": policy,
+        "guilds": len(bot.guilds),
+        "users": len(bot.users),
+        "members": sum(len(guild.members) for guild in bot.guilds),
+        "messages": len(bot.cached_messages),
+        "max_messages": bot._connection.max_messages,
+        "lru_size": len(user_cache),
+        "lru_max": user_cache.maxsize,
+        "lru_hits": user_cache.hits,
+        "lru_fetches": user_cache.fetches,
+        "lru_misses": user_cache.misses,
+    }
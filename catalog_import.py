@@ -0,0 +1,225 @@
+import io
+import os
+import csv
+import sys
+import json
+import sqlite3
+import asyncio
+from decimal import Decimal, InvalidOperation
+
+import money
+import query_log
+
+# Columns a catalog file may set; name identifies the item
+CATALOG_FIELDS = ("price_cents", "stock", "description", "drive_link")
+# Catalog files give prices in dollars under "price"
+FILE_FIELDS = {"price_cents": "price"}
+
+
+def whole_number(value):
+    """An integer from 3, "3", 3.0 or "3.0"; anything with a fraction is invalid"""
+    if isinstance(value, bool):
+        raise ValueError(f"not a number: {value!r}")
+    try:
+        number = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise ValueError(f"not a number: {value!r}")
+    if not number.is_finite() or number != number.to_integral_value():
+        raise ValueError(f"not a whole number: {value!r}")
+    return int(number)
+
+
+# Parser for each field's value in a catalog file
+FIELD_TYPES = {"price_cents": money.to_minor, "stock": whole_number, "description": str, "drive_link": str}
+
+
+class CatalogError(ValueError):
+    """Raised when a catalog file can't be parsed"""
+
+
+def parse_catalog(data, filename):
+    """Parse CSV or JSON catalog bytes into {name: {field: value}}
+
+    Fields that are missing or empty are left unchanged on existing items.
+    """
+    text = data.decode('utf-8-sig')
+    if filename.lower().endswith(".json"):
+        try:
+            rows = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise CatalogError(f"Invalid JSON: {e}")
+        if isinstance(rows, dict):
+            rows = rows.get("items", [])
+        if not isinstance(rows, list):
+            raise CatalogError("JSON catalog must be a list of items or an object with an \"items\" list")
+    else:
+        rows = list(csv.DictReader(io.StringIO(text)))
+
+    catalog = {}
+    for line, row in enumerate(rows, start=1):
+        if not isinstance(row, dict):
+            raise CatalogError(f"Row {line} is not an object with item fields")
+        name = str(row.get("name") or "").strip()
+        if not name:
+            raise CatalogError(f"Row {line} has no name")
+        if name in catalog:
+            raise CatalogError(f"Item '{name}' appears more than once")
+        fields = {}
+        for field in CATALOG_FIELDS:
+            label = FILE_FIELDS.get(field, field)
+            value = row.get(label)
+            if value is None or value == "":
+                continue
+            try:
+                value = FIELD_TYPES[field](value)
+            except (TypeError, ValueError):
+                raise CatalogError(f"Row {line} ('{name}') has an invalid {label}: {value!r}")
+            if field in ("price_cents", "stock") and value < 0:
+                raise CatalogError(f"Row {line} ('{name}') has a negative {label}")
+            fields[field] = value
+        catalog[name] = fields
+    return catalog
+
+
+class CatalogDiff:
+    """Changes needed to make the items table match a catalog"""
+
+    def __init__(self):
+        self.added = []      # (name, fields)
+        self.updated = []    # (item_id, name, {field: (old, new)})
+        self.removed = []    # (item_id, name)
+        self.kept = []       # (item_id, name) not in the catalog but still referenced by orders
+
+    def __bool__(self):
+        return bool(self.added or self.updated or self.removed)
+
+    def summary(self, limit=15):
+        """Human-readable preview lines for each kind of change"""
+        added = [f"+ {name} ({money.usd(fields['price_cents'])}, stock {fields.get('stock', 0)})" for name, fields in self.added]
+        updated = [
+            f"~ {name}: " + ", ".join(_describe_change(field, old, new) for field, (old, new) in changes.items())
+            for _, name, changes in self.updated
+        ]
+        removed = [f"- {name}" for _, name in self.removed]
+        kept = [f"= {name}" for _, name in self.kept]
+        sections = {}
+        for title, lines in (("Added", added), ("Updated", updated), ("Removed", removed),
+                             ("Not removed, used by orders", kept)):
+            if lines:
+                more = f"\n… and {len(lines) - limit} more" if len(lines) > limit else ""
+                sections[f"{title} ({len(lines)})"] = "\n".join(lines[:limit]) + more
+        return sections
+
+
+def _describe_change(field, old, new):
+    if field == "price_cents":
+        return f"price {money.usd(old)} → {money.usd(new)}"
+    return f"{field} {old!r} → {new!r}"
+
+
+async def compute_diff(db, catalog, prune=False):
+    """Compare a parsed catalog with the items table in one query"""
+    diff = CatalogDiff()
+    async with db.execute("SELECT id, name, price_cents, stock, description, drive_link FROM items") as cursor:
+        current = {row[1]: row for row in await cursor.fetchall()}
+
+    for name, fields in catalog.items():
+        row = current.get(name)
+        if row is None:
+            if "price_cents" not in fields:
+                raise CatalogError(f"New item '{name}' needs a price")
+            diff.added.append((name, fields))
+            continue
+        existing = dict(zip(("id", "name") + CATALOG_FIELDS, row))
+        changes = {
+            field: (existing[field], value)
+            for field, value in fields.items()
+            if existing[field] != value
+        }
+        if changes:
+            diff.updated.append((existing["id"], name, changes))
+
+    if prune:
+        # Orders keep pointing at their item, so those items are never pruned
+        async with db.execute("SELECT DISTINCT item_id FROM orders") as cursor:
+            ordered = {row[0] for row in await cursor.fetchall()}
+        for name, row in current.items():
+            if name not in catalog:
+                (diff.kept if row[0] in ordered else diff.removed).append((row[0], name))
+    return diff
+
+
+async def apply_diff(db, diff):
+    """Apply a diff with executemany in a single transaction"""
+    await db.execute("BEGIN IMMEDIATE")
+    try:
+        if diff.added:
+            await db.executemany(
+                "INSERT INTO items (name, price_cents, stock, description, drive_link) VALUES (?, ?, ?, ?, ?)",
+                [(name, fields["price_cents"], fields.get("stock", 0), fields.get("description", ""), fields.get("drive_link"))
+                 for name, fields in diff.added]
+            )
+
+        # One executemany per combination of changed columns
+        groups = {}
+        for item_id, _, changes in diff.updated:
+            columns = tuple(sorted(changes))
+            groups.setdefault(columns, []).append((*(changes[column][1] for column in columns), item_id))
+        for columns, params in groups.items():
+            assignments = ", ".join(f"{column} = ?" for column in columns)
+            await db.executemany(f"UPDATE items SET {assignments} WHERE id = ?", params)
+
+        if diff.removed:
+            # Skips items that were ordered since the diff was computed
+            await db.executemany(
+                "DELETE FROM items WHERE id = ? AND NOT EXISTS (SELECT 1 FROM orders WHERE item_id = ?)",
+                [(item_id, item_id) for item_id, _ in diff.removed]
+            )
+        await db.commit()
+    except sqlite3.IntegrityError as e:
+        # Usually an item with the same name added since the diff was computed
+        await db.rollback()
+        raise CatalogError(f"The items table changed while importing, preview the catalog again: {e}")
+    except Exception:
+        await db.rollback()
+        raise
+
+
+async def import_file(db_path, path, apply=False, prune=False):
+    with open(path, 'rb') as f:
+        catalog = parse_catalog(f.read(), path)
+    async with query_log.connect(db_path) as db:
+        # The items table may predate the integer price column
+        await money.migrate(db)
+        await db.commit()
+        diff = await compute_diff(db, catalog, prune)
+        for title, lines in diff.summary(limit=50).items():
+            print(f"{title}:\n{lines}\n")
+        if not diff:
+            print("Catalog is already up to date.")
+        elif apply:
+            await apply_diff(db, diff)
+            print("Changes applied.")
+        else:
+            print("Dry run, nothing changed. Re-run with --apply to apply these changes.")
+
+
+def main(argv=None):
+    # Only the command line needs argparse; the bot imports this module too
+    import argparse
+    parser = argparse.ArgumentParser(description="Preview or apply a CSV/JSON catalog to the items table")
+    parser.add_argument("catalog", help="CSV or JSON file with name, price, stock, description, drive_link")
+    parser.add_argument("--apply", action="store_true", help="Apply the changes (default is a dry run)")
+    parser.add_argument("--prune", action="store_true", help="Remove items that are not in the catalog and have no orders")
+    parser.add_argument("--db", default=os.getenv('DB_PATH', 'shop_database.db'), help="Path to the shop database")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(import_file(args.db, args.catalog, args.apply, args.prune))
+    except CatalogError as e:
+        print(f"Error: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
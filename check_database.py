@@ -5,8 +5,11 @@ print("Starting database check...")
 
 # Connect to the database
 try:
-    conn = sqlite3.connect('shop_database.db')
-    print("Connected to database")
+    # Read-only, so diagnostics never take write locks on the live database
+    db_path = os.path.abspath(os.getenv('DB_PATH', 'shop_database.db'))
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    conn.execute("PRAGMA query_only = 1")
+    print("Connected to database (read-only)")
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
 
@@ -26,14 +29,16 @@ try:
     # Check items table for drive links
     print("\n==== ITEMS TABLE ====")
     try:
+        # Iterate the cursor instead of fetchall() so large catalogs stream
         cursor.execute("SELECT id, name, drive_link FROM items")
-        items = cursor.fetchall()
+        item_count = 0
+        for item in cursor:
+            drive_link = item['drive_link'] if item['drive_link'] else "NO LINK FOUND"
+            print(f"ID: {item['id']} | Name: {item['name']} | Drive Link: {drive_link}")
+            item_count += 1
 
-        if items:
-            print(f"Found {len(items)} products:")
-            for item in items:
-                drive_link = item['drive_link'] if item['drive_link'] else "NO LINK FOUND"
-                print(f"ID: {item['id']} | Name: {item['name']} | Drive Link: {drive_link}")
+        if item_count:
+            print(f"Found {item_count} products")
         else:
             print("No items found in the database.")
     except sqlite3.Error as e:
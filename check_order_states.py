@@ -0,0 +1,161 @@
+import os
+import sys
+import random
+import asyncio
+import tempfile
+from collections import Counter
+
+import aiosqlite
+
+import order_states
+from order_states import PENDING, PAID, DELIVERED, CANCELLED, REFUNDED, InvalidTransition
+
+ORDERS = 50
+ATTEMPTS_PER_ORDER = 20
+CONNECTIONS = 16
+
+
+async def setup(db_path, status):
+    async with aiosqlite.connect(db_path) as db:
+        await db.execute("DROP TABLE IF EXISTS orders")
+        await db.execute('''
+        CREATE TABLE orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            status TEXT,
+            payment_confirmed BOOLEAN DEFAULT 0,
+            paid_at TIMESTAMP,
+            delivered_at TIMESTAMP
+        )
+        ''')
+        await db.executemany(
+            "INSERT INTO orders (id, user_id, status) VALUES (?, ?, ?)",
+            [(order_id, order_id, status) for order_id in range(1, ORDERS + 1)]
+        )
+        await db.commit()
+
+
+async def hammer(db_path, attempts):
+    """Run (order_id, to_status) attempts concurrently over several connections"""
+    queue = asyncio.Queue()
+    for attempt in attempts:
+        queue.put_nowait(attempt)
+    winners = []
+
+    async def worker():
+        async with aiosqlite.connect(db_path, timeout=30) as db:
+            while not queue.empty():
+                order_id, to_status = queue.get_nowait()
+                won = await order_states.transition(db, order_id, to_status)
+                await db.commit()
+                if won:
+                    winners.append((order_id, to_status))
+                # Let the other connections interleave
+                await asyncio.sleep(0)
+
+    await asyncio.gather(*(worker() for _ in range(CONNECTIONS)))
+    return winners
+
+
+async def final_statuses(db_path):
+    async with aiosqlite.connect(db_path) as db:
+        async with db.execute("SELECT id, status FROM orders") as cursor:
+            return dict(await cursor.fetchall())
+
+
+def shuffled_attempts(targets):
+    attempts = [
+        (order_id, random.choice(targets))
+        for order_id in range(1, ORDERS + 1)
+        for _ in range(ATTEMPTS_PER_ORDER)
+    ]
+    random.shuffle(attempts)
+    return attempts
+
+
+def check(name, passed, detail=""):
+    print(f"{'✅' if passed else '❌'} {name}{': ' + detail if detail and not passed else ''}")
+    return passed
+
+
+async def check_cancel_vs_pay(db_path):
+    """An order is either cancelled or paid, never both"""
+    await setup(db_path, PENDING)
+    winners = await hammer(db_path, shuffled_attempts([CANCELLED, PAID]))
+    statuses = await final_statuses(db_path)
+    per_order = Counter(order_id for order_id, _ in winners)
+    return (
+        check("cancel vs pay: one winner per order", all(per_order[o] == 1 for o in statuses), str(per_order))
+        and check("cancel vs pay: final status matches winner",
+                  all(statuses[o] == to_status for o, to_status in winners))
+    )
+
+
+async def check_double_delivery(db_path):
+    """A paid order is delivered exactly once however many admins try"""
+    await setup(db_path, PAID)
+    winners = await hammer(db_path, shuffled_attempts([DELIVERED]))
+    statuses = await final_statuses(db_path)
+    per_order = Counter(order_id for order_id, _ in winners)
+    return (
+        check("double delivery: one delivery per order", all(per_order[o] == 1 for o in statuses), str(per_order))
+        and check("double delivery: all orders delivered", set(statuses.values()) == {DELIVERED})
+    )
+
+
+async def check_deliver_vs_refund(db_path):
+    """Refund and deliver may both win, but only as paid → delivered → refunded"""
+    await setup(db_path, PAID)
+    winners = await hammer(db_path, shuffled_attempts([DELIVERED, REFUNDED]))
+    statuses = await final_statuses(db_path)
+    won = {}
+    for order_id, to_status in winners:
+        won.setdefault(order_id, []).append(to_status)
+    valid = all(targets in ([REFUNDED], [DELIVERED], [DELIVERED, REFUNDED]) for targets in won.values())
+    return (
+        check("deliver vs refund: only valid sequences win", valid, str(won))
+        and check("deliver vs refund: final status matches last winner",
+                  all(statuses[o] == targets[-1] for o, targets in won.items()))
+    )
+
+
+async def check_invalid_transitions(db_path):
+    await setup(db_path, CANCELLED)
+    async with aiosqlite.connect(db_path) as db:
+        reopened = await order_states.transition(db, 1, PAID)
+        await db.commit()
+    try:
+        order_states.sources("shipped")
+        unknown_rejected = False
+    except InvalidTransition:
+        unknown_rejected = True
+    try:
+        async with aiosqlite.connect(db_path) as db:
+            await order_states.transition(db, 1, DELIVERED, [PENDING])
+        narrow_rejected = False
+    except InvalidTransition:
+        narrow_rejected = True
+    return (
+        check("cancelled orders can't be paid", not reopened)
+        and check("unknown statuses are rejected", unknown_rejected)
+        and check("disallowed source statuses are rejected", narrow_rejected)
+    )
+
+
+async def main():
+    print("Starting order state machine concurrency check...")
+    print(f"{ORDERS} orders, {ATTEMPTS_PER_ORDER} attempts each, {CONNECTIONS} connections\n")
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "order_states_check.db")
+        results = [
+            await check_cancel_vs_pay(db_path),
+            await check_double_delivery(db_path),
+            await check_deliver_vs_refund(db_path),
+            await check_invalid_transitions(db_path),
+        ]
+    print(f"\n{'All checks passed' if all(results) else 'Some checks FAILED'}")
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,350 @@
+import random
+import asyncio
+import logging
+
+import query_log
+import discord
+
+import outbox
+import order_states
+
+logger = logging.getLogger("shop_bot")
+
+# Delivery statuses
+QUEUED = "queued"
+SENDING = "sending"
+DELIVERED = "delivered"
+DEAD = "dead"
+
+
+def idempotency_key(order_id):
+    """One delivery per order, however many times it is approved"""
+    return f"order:{order_id}"
+
+
+async def create_table(db):
+    await db.execute('''
+    CREATE TABLE IF NOT EXISTS deliveries (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        order_id INTEGER NOT NULL,
+        idempotency_key TEXT UNIQUE NOT NULL,
+        user_id INTEGER NOT NULL,
+        message TEXT,
+        status TEXT NOT NULL DEFAULT 'queued',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_error TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        delivered_at TIMESTAMP,
+        FOREIGN KEY (order_id) REFERENCES orders (id)
+    )
+    ''')
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_deliveries_due ON deliveries (status, next_attempt_at)"
+    )
+
+
+async def enqueue(db, order_id, user_id, message=None):
+    """Queue the delivery of an order, inside the caller's transaction
+
+    The order must already be paid (or be moved to paid in the same
+    transaction): the worker dead-letters deliveries of orders in any other
+    status. Returns False if the order already has a delivery. The caller
+    commits together with its own order update and then calls
+    DeliveryWorker.notify().
+    """
+    cursor = await db.execute(
+        "INSERT OR IGNORE INTO deliveries (order_id, idempotency_key, user_id, message) VALUES (?, ?, ?, ?)",
+        (order_id, idempotency_key(order_id), user_id, message)
+    )
+    return cursor.rowcount == 1
+
+
+async def approve_orders(db_path, order_ids, message=None, confirmation=None, events=None, pending=None):
+    """Confirm payment for many orders and queue their deliveries in one transaction
+
+    Pending and confirmed orders move to paid through the order state
+    machine; orders that were already paid only get their delivery queued.
+    ``confirmation`` builds the payment confirmation embed for an order ID,
+    which is written to the outbox in the same transaction. Paid orders
+    are dropped from the ``pending`` index. Returns the list of order IDs
+    that were approved.
+    """
+    order_ids = list(dict.fromkeys(order_ids))
+    if not order_ids:
+        return []
+
+    async with query_log.connect(db_path) as db:
+        await db.execute("BEGIN IMMEDIATE")
+        paid = await order_states.transition_many(db, order_ids, order_states.PAID)
+
+        # The idempotency key keeps this to one delivery per order
+        approved_ids = []
+        for order_id in order_ids:
+            cursor = await db.execute(
+                "INSERT OR IGNORE INTO deliveries (order_id, idempotency_key, user_id, message) "
+                "SELECT id, ?, user_id, ? FROM orders WHERE id = ? AND status = ?",
+                (idempotency_key(order_id), message, order_id, order_states.PAID)
+            )
+            if cursor.rowcount == 1 or order_id in paid:
+                approved_ids.append(order_id)
+
+        if confirmation and paid:
+            placeholders = ", ".join("?" for _ in paid)
+            async with db.execute(
+                f"SELECT id, user_id FROM orders WHERE id IN ({placeholders})", tuple(paid)
+            ) as cursor:
+                for order_id, user_id in await cursor.fetchall():
+                    await outbox.add(db, user_id, "payment_confirmed", confirmation(order_id), order_id)
+        await db.commit()
+
+    if events is not None:
+        for order_id in paid:
+            events.record(order_id, "paid", order_states.PAID)
+    if pending is not None:
+        pending.discard_many(paid)
+    return approved_ids
+
+
+class DeliveryWorker:
+    """Pool of async consumers that send queued deliveries
+
+    Failed sends are retried with exponential backoff; after max_attempts
+    the delivery is moved to the dead-letter state for an admin to retry.
+    """
+
+    def __init__(self, bot, db_path, events=None, concurrency=4, max_attempts=6, base_delay=30, max_delay=3600, poll_interval=15,
+                 dm_status=None):
+        self.bot = bot
+        self.db_path = db_path
+        self.events = events
+        self.dm_status = dm_status
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self._wake = asyncio.Event()
+        self._claim_lock = asyncio.Lock()
+        self._tasks = []
+
+    @property
+    def running(self):
+        return any(not task.done() for task in self._tasks)
+
+    async def start(self):
+        """Recover deliveries interrupted by a restart and start the consumers"""
+        if self.running:
+            return
+        async with query_log.connect(self.db_path) as db:
+            cursor = await db.execute(
+                "UPDATE deliveries SET status = ? WHERE status = ?", (QUEUED, SENDING)
+            )
+            if cursor.rowcount:
+                logger.info(f"Requeued {cursor.rowcount} interrupted deliveries")
+            await db.commit()
+        self._tasks = [
+            asyncio.create_task(self._consume(n), name=f"delivery-worker-{n}")
+            for n in range(self.concurrency)
+        ]
+        logger.info(f"Delivery worker started with {self.concurrency} consumers")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        """Wake the consumers after new deliveries were committed"""
+        self._wake.set()
+
+    def backoff(self, attempts):
+        """Seconds to wait before the next attempt, with jitter"""
+        delay = min(self.base_delay * (2 ** (attempts - 1)), self.max_delay)
+        return delay * random.uniform(0.8, 1.2)
+
+    async def _claim(self):
+        """Mark the oldest due delivery as sending and return it"""
+        async with self._claim_lock:
+            async with query_log.connect(self.db_path) as db:
+                await db.execute("BEGIN IMMEDIATE")
+                # Drop deliveries for orders that were cancelled, refunded or delivered elsewhere
+                cursor = await db.execute(
+                    "UPDATE deliveries SET status = ?, "
+                    "last_error = 'Order is ' || (SELECT status FROM orders WHERE id = deliveries.order_id) "
+                    "WHERE status = ? AND order_id IN (SELECT id FROM orders WHERE status != ?)",
+                    (DEAD, QUEUED, order_states.PAID)
+                )
+                if cursor.rowcount:
+                    logger.warning(f"Dropped {cursor.rowcount} deliveries for orders that are no longer paid")
+                async with db.execute(
+                    "SELECT d.id, d.order_id, d.user_id, d.message, d.attempts, i.name, i.drive_link, o.guild_id "
+                    "FROM deliveries d JOIN orders o ON o.id = d.order_id "
+                    "LEFT JOIN items i ON i.id = o.item_id "
+                    "WHERE d.status = ? AND d.next_attempt_at <= CURRENT_TIMESTAMP "
+                    "ORDER BY d.next_attempt_at, d.id LIMIT 1",
+                    (QUEUED,)
+                ) as cursor:
+                    row = await cursor.fetchone()
+                if row:
+                    await db.execute(
+                        "UPDATE deliveries SET status = ?, attempts = attempts + 1 WHERE id = ?",
+                        (SENDING, row[0])
+                    )
+                await db.commit()
+        return row
+
+    async def _consume(self, worker_number):
+        while True:
+            try:
+                delivery = await self._claim()
+            except Exception as e:
+                logger.error(f"Delivery worker {worker_number} failed to claim a delivery: {e}")
+                delivery = None
+
+            if delivery is None:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                await self._deliver(*delivery)
+            except Exception as e:
+                logger.error(f"Delivery worker {worker_number} failed on delivery {delivery[0]} (order #{delivery[1]}): {e}")
+                await self._requeue(delivery[0], delivery[1], delivery[4] + 1, str(e))
+
+    async def _deliver(self, delivery_id, order_id, user_id, message, attempts, item_name, drive_link, guild_id):
+        attempts += 1
+        blocked = self.dm_status.blocked(user_id) if self.dm_status is not None else None
+        if blocked is not None:
+            await self._postpone(delivery_id, order_id, blocked.retry_at, f"DMs unavailable ({blocked.reason})")
+            return
+        try:
+            if not drive_link:
+                raise RuntimeError(f"Item for order #{order_id} has no drive link")
+            user = await self.bot.user_cache.get(user_id)
+
+            embed = self.bot.create_embed(
+                "📦 Your Order Has Been Delivered",
+                message or "Thank you for your purchase!",
+                self.bot.COLORS["success"]
+            )
+            embed.add_field(
+                name="Order Details",
+                value=f"**Order ID:** #{order_id}\n**Item:** {item_name}",
+                inline=False
+            )
+            embed.add_field(name="Download", value=drive_link, inline=False)
+            await user.send(embed=embed)
+        except (discord.HTTPException, RuntimeError) as e:
+            if self.dm_status is not None:
+                entry = await self.dm_status.failed(user_id, e, guild_id, f"order #{order_id}")
+                if entry is not None:
+                    await self._postpone(delivery_id, order_id, entry.retry_at, str(e))
+                    return
+            await self._failed(delivery_id, order_id, attempts, str(e))
+            return
+        if self.dm_status is not None:
+            await self.dm_status.record_success(user_id)
+
+        async with query_log.connect(self.db_path) as db:
+            await db.execute(
+                "UPDATE deliveries SET status = ?, delivered_at = CURRENT_TIMESTAMP, last_error = NULL WHERE id = ?",
+                (DELIVERED, delivery_id)
+            )
+            won = await order_states.transition(db, order_id, order_states.DELIVERED, [order_states.PAID])
+            await db.commit()
+        if not won:
+            logger.warning(f"Order #{order_id} changed status while it was being delivered")
+        elif self.events is not None:
+            self.events.record(order_id, "delivered", order_states.DELIVERED)
+        logger.info(f"Delivered order #{order_id} to user {user_id}")
+
+    async def _failed(self, delivery_id, order_id, attempts, error):
+        async with query_log.connect(self.db_path) as db:
+            if attempts >= self.max_attempts:
+                logger.error(f"Delivery for order #{order_id} moved to dead letters after {attempts} attempts: {error}")
+                await db.execute(
+                    "UPDATE deliveries SET status = ?, last_error = ? WHERE id = ?",
+                    (DEAD, error, delivery_id)
+                )
+            else:
+                delay = self.backoff(attempts)
+                logger.warning(f"Delivery for order #{order_id} failed (attempt {attempts}), retrying in {delay:.0f}s: {error}")
+                await db.execute(
+                    "UPDATE deliveries SET status = ?, last_error = ?, "
+                    "next_attempt_at = datetime('now', ?) WHERE id = ?",
+                    (QUEUED, error, f"+{int(delay)} seconds", delivery_id)
+                )
+            await db.commit()
+
+    async def _requeue(self, delivery_id, order_id, attempts, error):
+        """Put a delivery that hit an unexpected error back in the queue with backoff
+
+        The DM may already have gone out, so the user can get it twice; that
+        beats leaving the row in 'sending' until the next restart. Like
+        _failed(), it goes to dead letters once max_attempts is used up.
+        """
+        try:
+            async with query_log.connect(self.db_path) as db:
+                if attempts >= self.max_attempts:
+                    logger.error(f"Delivery for order #{order_id} moved to dead letters after {attempts} attempts: {error}")
+                    await db.execute(
+                        "UPDATE deliveries SET status = ?, last_error = ? WHERE id = ? AND status = ?",
+                        (DEAD, error, delivery_id, SENDING)
+                    )
+                else:
+                    await db.execute(
+                        "UPDATE deliveries SET status = ?, last_error = ?, next_attempt_at = datetime('now', ?) "
+                        "WHERE id = ? AND status = ?",
+                        (QUEUED, error, f"+{int(self.backoff(attempts))} seconds", delivery_id, SENDING)
+                    )
+                await db.commit()
+        except Exception as e:
+            logger.error(f"Could not requeue delivery {delivery_id}, it stays 'sending' until restart: {e}")
+
+    async def _postpone(self, delivery_id, order_id, retry_at, error):
+        """Wait until the user's DMs may work again; doesn't use up an attempt"""
+        logger.info(f"Delivery for order #{order_id} postponed, the user can't be DMed: {error}")
+        async with query_log.connect(self.db_path) as db:
+            await db.execute(
+                "UPDATE deliveries SET status = ?, attempts = attempts - 1, last_error = ?, "
+                "next_attempt_at = datetime(?, 'unixepoch') WHERE id = ?",
+                (QUEUED, error, retry_at, delivery_id)
+            )
+            await db.commit()
+
+    async def retry_dead(self, delivery_ids=None):
+        """Move dead deliveries back to the queue; all of them when no IDs are given"""
+        async with query_log.connect(self.db_path) as db:
+            if delivery_ids:
+                placeholders = ", ".join("?" for _ in delivery_ids)
+                cursor = await db.execute(
+                    f"UPDATE deliveries SET status = ?, attempts = 0, next_attempt_at = CURRENT_TIMESTAMP "
+                    f"WHERE status = ? AND id IN ({placeholders})",
+                    (QUEUED, DEAD, *delivery_ids)
+                )
+            else:
+                cursor = await db.execute(
+                    "UPDATE deliveries SET status = ?, attempts = 0, next_attempt_at = CURRENT_TIMESTAMP WHERE status = ?",
+                    (QUEUED, DEAD)
+                )
+            await db.commit()
+        self.notify()
+        return cursor.rowcount
+
+    async def stats(self):
+        """Return delivery counts by status and the most recent dead letters"""
+        async with query_log.connect(self.db_path) as db:
+            async with db.execute("SELECT status, COUNT(*) FROM deliveries GROUP BY status") as cursor:
+                counts = dict(await cursor.fetchall())
+            async with db.execute(
+                "SELECT id, order_id, attempts, last_error FROM deliveries WHERE status = ? ORDER BY id DESC LIMIT 10",
+                (DEAD,)
+            ) as cursor:
+                dead = await cursor.fetchall()
+        return counts, dead
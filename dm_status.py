@@ -0,0 +1,161 @@
+import time
+import logging
+
+import discord
+
+import query_log
+
+logger = logging.getLogger("shop_bot")
+
+FORBIDDEN = "forbidden"    # DMs closed or the bot is blocked
+NOT_FOUND = "not_found"    # the account no longer exists
+
+# A closed DM is retried after 1h, 4h, 16h, ... up to three days;
+# an unknown user only once a week
+BASE_DELAY = 3600
+BACKOFF = 4
+MAX_DELAY = 3 * 86400
+NOT_FOUND_DELAY = 7 * 86400
+
+
+async def create_table(db):
+    await db.execute('''
+    CREATE TABLE IF NOT EXISTS dm_status (
+        user_id INTEGER PRIMARY KEY,
+        reason TEXT NOT NULL,
+        failures INTEGER NOT NULL,
+        retry_at REAL NOT NULL,
+        first_failed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+
+class UndeliverableDM:
+    __slots__ = ("reason", "failures", "retry_at")
+
+    def __init__(self, reason, failures, retry_at):
+        self.reason = reason
+        self.failures = failures
+        self.retry_at = retry_at
+
+
+def failure_reason(error):
+    """FORBIDDEN or NOT_FOUND for errors that will happen again on retry, else None"""
+    if isinstance(error, discord.Forbidden):
+        return FORBIDDEN
+    if isinstance(error, discord.NotFound):
+        return NOT_FOUND
+    return None
+
+
+class DMStatusCache:
+    """Remembers users who can't be DMed so we stop asking Discord every time
+
+    Lookups are in memory; changes are written through to the dm_status
+    table so the schedule survives restarts. A user is tried again once
+    their retry time passes, with the delay growing after every failure,
+    and forgotten as soon as a DM gets through.
+    """
+
+    def __init__(self, bot, db_path):
+        self.bot = bot
+        self.db_path = db_path
+        self._users = {}
+        self.saved = 0
+        self.forbidden = 0
+        self.not_found = 0
+        self.fallbacks = 0
+        self.recovered = 0
+
+    def __len__(self):
+        return len(self._users)
+
+    async def load(self):
+        async with query_log.connect(self.db_path) as db:
+            async with db.execute("SELECT user_id, reason, failures, retry_at FROM dm_status") as cursor:
+                self._users = {row[0]: UndeliverableDM(*row[1:]) for row in await cursor.fetchall()}
+        logger.info(f"Loaded {len(self._users)} users with undeliverable DMs")
+
+    def blocked(self, user_id):
+        """The user's failure record if DMs to them should not be tried yet
+
+        Every call that returns a record is a Discord request saved.
+        """
+        entry = self._users.get(user_id)
+        if entry is None or entry.retry_at <= time.time():
+            return None
+        self.saved += 1
+        return entry
+
+    async def record_failure(self, user_id, reason):
+        entry = self._users.get(user_id)
+        failures = entry.failures + 1 if entry else 1
+        if reason == NOT_FOUND:
+            delay = NOT_FOUND_DELAY
+            self.not_found += 1
+        else:
+            delay = min(BASE_DELAY * BACKOFF ** (failures - 1), MAX_DELAY)
+            self.forbidden += 1
+        entry = self._users[user_id] = UndeliverableDM(reason, failures, time.time() + delay)
+        async with query_log.connect(self.db_path) as db:
+            await db.execute(
+                "INSERT INTO dm_status (user_id, reason, failures, retry_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET reason = excluded.reason, failures = excluded.failures, "
+                "retry_at = excluded.retry_at",
+                (user_id, reason, failures, entry.retry_at)
+            )
+            await db.commit()
+        logger.info(f"DMs to user {user_id} failed ({reason}), next try in {delay / 3600:g}h")
+        return entry
+
+    async def record_success(self, user_id):
+        if self._users.pop(user_id, None) is None:
+            return
+        self.recovered += 1
+        await self.clear(user_id)
+
+    async def clear(self, user_id):
+        """Forget a user's failures so the next DM is tried straight away"""
+        self._users.pop(user_id, None)
+        async with query_log.connect(self.db_path) as db:
+            await db.execute("DELETE FROM dm_status WHERE user_id = ?", (user_id,))
+            await db.commit()
+
+    async def notify_fallback(self, guild_id, user_id, about):
+        """Ask the user in the guild's notification channel to open their DMs
+
+        Only the mention and a short note are posted; the DM itself may hold
+        private details like download links.
+        """
+        config = self.bot.guild_configs.get(guild_id)
+        channel = self.bot.get_channel(config.notify_channel_id) if config.notify_channel_id else None
+        if channel is None:
+            return False
+        try:
+            await channel.send(
+                f"<@{user_id}> I couldn't send you a DM about {about}. Please allow direct messages "
+                f"from server members, then use `{config.prefix}orders` to check on it.",
+                allowed_mentions=discord.AllowedMentions(users=True, roles=False, everyone=False)
+            )
+        except discord.HTTPException as e:
+            logger.warning(f"Could not post DM fallback for user {user_id} in channel {channel.id}: {e}")
+            return False
+        self.fallbacks += 1
+        return True
+
+    async def failed(self, user_id, error, guild_id, about):
+        """Record a DM failure; posts the channel fallback if it won't succeed on retry
+
+        The fallback is posted once per block: when the user is first
+        recorded as refusing DMs, not again on each failed retry. Returns
+        the user's failure record, or None for errors worth retrying
+        normally.
+        """
+        reason = failure_reason(error)
+        if reason is None:
+            return None
+        previous = self._users.get(user_id)
+        entry = await self.record_failure(user_id, reason)
+        if reason == FORBIDDEN and (previous is None or previous.reason != FORBIDDEN):
+            await self.notify_fallback(guild_id, user_id, about)
+        return entry
@@ -0,0 +1,177 @@
+import io
+import os
+import re
+import csv
+import sys
+import gzip
+import json
+import asyncio
+from datetime import datetime
+
+import query_log
+
+from reporting import readonly_uri
+
+# Discord's default attachment limit
+DEFAULT_MAX_BYTES = 8 * 1024 * 1024
+# Room left for data still buffered in the text wrapper and compressor
+CHUNK_MARGIN = 256 * 1024
+FETCH_SIZE = 500
+FORMATS = ("csv", "jsonl")
+
+EXPORTS = {
+    "orders": (
+        "SELECT o.id, o.user_id, o.item_id, i.name AS item_name, o.quantity, o.total_cents, o.ltc_litoshis, "
+        "o.status, o.confirmation_key, o.created_at, o.paid_at, o.delivered_at "
+        "FROM orders o LEFT JOIN items i ON i.id = o.item_id {where} ORDER BY o.id",
+        "o.created_at",
+    ),
+    "items": (
+        # price as exact decimal text, so an export can be fed back to importcatalog
+        "SELECT id, name, CASE WHEN price_cents IS NOT NULL "
+        "THEN printf('%d.%02d', price_cents / 100, price_cents % 100) END AS price, "
+        "stock, description, drive_link FROM items ORDER BY id",
+        None,
+    ),
+    # By the day the order was paid, like order_events.sales_aggregates and
+    # sales_daily; orders from before paid_at was recorded use created_at
+    "sales": (
+        "SELECT date(COALESCE(o.paid_at, o.created_at)) AS day, COUNT(*) AS orders, SUM(o.quantity) AS units, "
+        "SUM(o.total_cents) AS revenue_cents FROM orders o "
+        "WHERE o.status IN ('paid', 'delivered') {and_where} GROUP BY day ORDER BY day",
+        "COALESCE(o.paid_at, o.created_at)",
+    ),
+}
+
+
+def parse_range(text):
+    """Parse '7d', 'all', or 'YYYY-MM-DD:YYYY-MM-DD' into SQL bounds (start, end)"""
+    if not text or text == "all":
+        return None, None
+    match = re.fullmatch(r"(\d+)d", text)
+    if match:
+        return f"-{match.group(1)} days", None
+    match = re.fullmatch(r"(\d{4}-\d{2}-\d{2})?:(\d{4}-\d{2}-\d{2})?", text)
+    if match and any(match.groups()):
+        return match.group(1), match.group(2)
+    raise ValueError(f"Invalid range '{text}', use 7d, all or YYYY-MM-DD:YYYY-MM-DD")
+
+
+def build_query(kind, date_range=None):
+    """Return the SQL and parameters for an export"""
+    if kind not in EXPORTS:
+        raise ValueError(f"Unknown export '{kind}', choose from {', '.join(EXPORTS)}")
+    query, column = EXPORTS[kind]
+    start, end = parse_range(date_range)
+    conditions, params = [], []
+    if column and start:
+        if start.startswith("-"):
+            conditions.append(f"{column} >= datetime('now', ?)")
+        else:
+            conditions.append(f"{column} >= ?")
+        params.append(start)
+    if column and end:
+        conditions.append(f"{column} < date(?, '+1 day')")
+        params.append(end)
+    where = " AND ".join(conditions)
+    return query.format(where=f"WHERE {where}" if where else "", and_where=f"AND {where}" if where else ""), params
+
+
+async def iter_rows(db, query, params=(), fetch_size=FETCH_SIZE):
+    """Yield rows from a query a batch at a time instead of with fetchall()"""
+    async with db.execute(query, params) as cursor:
+        columns = [column[0] for column in cursor.description]
+        yield columns
+        while True:
+            rows = await cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield row
+
+
+class _ChunkWriter:
+    """gzip-compressed CSV or JSONL file built in memory"""
+
+    def __init__(self, fmt, columns):
+        self.fmt = fmt
+        self.columns = columns
+        self.buffer = io.BytesIO()
+        self.text = io.TextIOWrapper(gzip.GzipFile(fileobj=self.buffer, mode='wb'), encoding='utf-8', newline='')
+        self.rows = 0
+        if fmt == "csv":
+            self.writer = csv.writer(self.text)
+            self.writer.writerow(columns)
+
+    @property
+    def size(self):
+        return self.buffer.tell()
+
+    def write(self, row):
+        if self.fmt == "csv":
+            self.writer.writerow(row)
+        else:
+            self.text.write(json.dumps(dict(zip(self.columns, row)), default=str) + "\n")
+        self.rows += 1
+
+    def finish(self):
+        self.text.close()
+        return self.buffer.getvalue()
+
+
+async def export_chunks(db, kind, fmt="csv", date_range=None, max_bytes=DEFAULT_MAX_BYTES):
+    """Stream an export as gzip files no larger than max_bytes
+
+    Yields (filename, data, row_count). Only one chunk is held in memory at
+    a time, however large the table is.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format '{fmt}', choose from {', '.join(FORMATS)}")
+    query, params = build_query(kind, date_range)
+    stamp = datetime.utcnow().strftime('%Y%m%d-%H%M%S')
+    limit = max(max_bytes - CHUNK_MARGIN, max_bytes // 2)
+
+    rows = iter_rows(db, query, params)
+    columns = await rows.__anext__()
+    part = 1
+    chunk = _ChunkWriter(fmt, columns)
+    async for row in rows:
+        chunk.write(row)
+        if chunk.size >= limit:
+            yield f"{kind}-{stamp}-part{part:03d}.{fmt}.gz", chunk.finish(), chunk.rows
+            part += 1
+            chunk = _ChunkWriter(fmt, columns)
+    if chunk.rows or part == 1:
+        yield f"{kind}-{stamp}-part{part:03d}.{fmt}.gz", chunk.finish(), chunk.rows
+
+
+async def export_to_directory(db_path, kind, fmt, date_range, out_dir, max_bytes):
+    os.makedirs(out_dir, exist_ok=True)
+    total = 0
+    async with query_log.connect(readonly_uri(db_path), uri=True) as db:
+        async for filename, data, rows in export_chunks(db, kind, fmt, date_range, max_bytes):
+            path = os.path.join(out_dir, filename)
+            with open(path, 'wb') as f:
+                f.write(data)
+            total += rows
+            print(f"Wrote {path} ({rows} rows, {len(data)} bytes)")
+    print(f"Exported {total} rows")
+
+
+def main(argv=None):
+    # Only the command line needs argparse; the bot imports this module too
+    import argparse
+    parser = argparse.ArgumentParser(description="Export shop data as gzip-compressed CSV or JSONL")
+    parser.add_argument("kind", choices=list(EXPORTS))
+    parser.add_argument("--range", dest="date_range", help="7d, all or YYYY-MM-DD:YYYY-MM-DD")
+    parser.add_argument("--format", dest="fmt", choices=FORMATS, default="csv")
+    parser.add_argument("--db", default=os.getenv('DB_PATH', 'shop_database.db'), help="Path to the shop database")
+    parser.add_argument("--out", default="exports", help="Output directory")
+    parser.add_argument("--max-bytes", type=int, default=DEFAULT_MAX_BYTES, help="Maximum size of each file")
+    args = parser.parse_args(argv)
+    asyncio.run(export_to_directory(args.db, args.kind, args.fmt, args.date_range, args.out, args.max_bytes))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+import os
+import logging
+
+import aiosqlite
+
+import query_log
+
+logger = logging.getLogger("shop_bot")
+
+DEFAULT_PREFIX = "s!"
+DEFAULT_REMINDER_MINUTES = 2
+
+# Settings an admin can change with s!shopconfig, mapped to their column
+CONFIG_KEYS = {
+    "adminrole": "admin_role_id",
+    "ltcaddress": "ltc_address",
+    "prefix": "prefix",
+    "reminder": "reminder_minutes",
+    "notifychannel": "notify_channel_id",
+}
+
+_COLUMNS = "guild_id, admin_role_id, ltc_address, prefix, reminder_minutes, notify_channel_id"
+
+
+class GuildConfig:
+    """Shop settings for a single guild, falling back to the process defaults"""
+
+    __slots__ = ("guild_id", "admin_role_id", "ltc_address", "prefix", "reminder_minutes", "notify_channel_id")
+
+    def __init__(self, guild_id, admin_role_id=None, ltc_address=None, prefix=None, reminder_minutes=None,
+                 notify_channel_id=None):
+        self.guild_id = guild_id
+        self.admin_role_id = admin_role_id
+        self.ltc_address = ltc_address
+        self.prefix = prefix
+        self.reminder_minutes = reminder_minutes
+        self.notify_channel_id = notify_channel_id
+
+    def resolved(self, defaults):
+        """Return a copy with unset values taken from the defaults"""
+        return GuildConfig(
+            self.guild_id,
+            self.admin_role_id or defaults.admin_role_id,
+            self.ltc_address or defaults.ltc_address,
+            self.prefix or defaults.prefix,
+            self.reminder_minutes or defaults.reminder_minutes,
+            self.notify_channel_id or defaults.notify_channel_id,
+        )
+
+
+class GuildConfigStore:
+    """In-memory map of guild settings backed by the guild_config table
+
+    Lookups never touch the database; updates are written through to the
+    table before the map is changed.
+    """
+
+    def __init__(self, db_path, admin_role_id=0, ltc_address=None):
+        self.db_path = db_path
+        self.defaults = GuildConfig(
+            None,
+            admin_role_id or None,
+            ltc_address,
+            os.getenv('COMMAND_PREFIX', DEFAULT_PREFIX),
+            int(os.getenv('REMINDER_MINUTES', DEFAULT_REMINDER_MINUTES)),
+            int(os.getenv('NOTIFY_CHANNEL_ID', 0)) or None,
+        )
+        self._configs = {}
+
+    def __len__(self):
+        return len(self._configs)
+
+    async def create_table(self, db):
+        await db.execute('''
+        CREATE TABLE IF NOT EXISTS guild_config (
+            guild_id INTEGER PRIMARY KEY,
+            admin_role_id INTEGER,
+            ltc_address TEXT,
+            prefix TEXT,
+            reminder_minutes INTEGER,
+            notify_channel_id INTEGER,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+        try:
+            await db.execute("SELECT notify_channel_id FROM guild_config LIMIT 1")
+        except aiosqlite.OperationalError:
+            logger.info("Adding missing notify_channel_id column to guild_config table")
+            await db.execute("ALTER TABLE guild_config ADD COLUMN notify_channel_id INTEGER")
+
+    async def load(self):
+        """Load every guild's settings into memory"""
+        configs = {}
+        async with query_log.connect(self.db_path) as db:
+            async with db.execute(
+                f"SELECT {_COLUMNS} FROM guild_config"
+            ) as cursor:
+                async for row in cursor:
+                    configs[row[0]] = GuildConfig(*row).resolved(self.defaults)
+        self._configs = configs
+        logger.info(f"Loaded configuration for {len(configs)} guilds")
+
+    def get(self, guild_id):
+        """Return the settings for a guild, or the defaults if it has none"""
+        config = self._configs.get(guild_id)
+        if config is None:
+            return self.defaults
+        return config
+
+    def prefix_for(self, guild_id):
+        return self.get(guild_id).prefix
+
+    async def update(self, guild_id, **fields):
+        """Write changed settings to the table, then to the in-memory map"""
+        unknown = set(fields) - set(CONFIG_KEYS.values())
+        if unknown:
+            raise ValueError(f"Unknown guild config fields: {', '.join(sorted(unknown))}")
+
+        columns = ", ".join(fields)
+        placeholders = ", ".join("?" for _ in fields)
+        updates = ", ".join(f"{column} = excluded.{column}" for column in fields)
+        async with query_log.connect(self.db_path) as db:
+            await db.execute(
+                f"INSERT INTO guild_config (guild_id, {columns}) VALUES (?, {placeholders}) "
+                f"ON CONFLICT(guild_id) DO UPDATE SET {updates}, updated_at = CURRENT_TIMESTAMP",
+                (guild_id, *fields.values())
+            )
+            await db.commit()
+            async with db.execute(
+                f"SELECT {_COLUMNS} FROM guild_config WHERE guild_id = ?",
+                (guild_id,)
+            ) as cursor:
+                row = await cursor.fetchone()
+
+        config = GuildConfig(*row).resolved(self.defaults)
+        self._configs[guild_id] = config
+        return config
@@ -0,0 +1,322 @@
+import os
+import sys
+import json
+import socket
+import time
+import uuid
+import random
+import asyncio
+import logging
+
+import query_log
+
+logger = logging.getLogger("shop_bot")
+
+# Job statuses
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+async def create_table(db):
+    await db.execute('''
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        payload TEXT,
+        status TEXT NOT NULL DEFAULT 'queued',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        max_attempts INTEGER NOT NULL DEFAULT 3,
+        available_at REAL NOT NULL,
+        lease_token TEXT,
+        lease_owner TEXT,
+        lease_expires_at REAL,
+        result TEXT,
+        error TEXT,
+        applied INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        started_at REAL,
+        finished_at REAL
+    )
+    ''')
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs (status, available_at)"
+    )
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_jobs_unapplied ON jobs (applied, status)"
+    )
+
+
+async def enqueue(db, kind, payload=None, unique=False, delay=0, max_attempts=3):
+    """Queue a job inside the caller's transaction
+
+    With ``unique``, nothing is queued while a job of the same kind is still
+    queued or running. Returns the new job's ID, or None if it was skipped.
+    """
+    params = (kind, json.dumps(payload) if payload is not None else None, time.time() + delay, max_attempts)
+    if unique:
+        cursor = await db.execute(
+            "INSERT INTO jobs (kind, payload, available_at, max_attempts) SELECT ?, ?, ?, ? "
+            "WHERE NOT EXISTS (SELECT 1 FROM jobs WHERE kind = ? AND status IN (?, ?))",
+            (*params, kind, QUEUED, RUNNING)
+        )
+    else:
+        cursor = await db.execute(
+            "INSERT INTO jobs (kind, payload, available_at, max_attempts) VALUES (?, ?, ?, ?)", params
+        )
+    return cursor.lastrowid if cursor.rowcount else None
+
+
+class Job:
+    """A job claimed by a worker"""
+
+    __slots__ = ("id", "kind", "payload", "attempts", "token")
+
+    def __init__(self, job_id, kind, payload, attempts, token):
+        self.id = job_id
+        self.kind = kind
+        self.payload = json.loads(payload) if payload else {}
+        self.attempts = attempts
+        self.token = token
+
+
+async def claim(db, owner, limit=1, lease=60, kinds=None):
+    """Atomically lease up to ``limit`` due jobs to a worker
+
+    Jobs whose lease ran out (their worker died) are claimed again. The
+    lease token returned with each job must be presented to finish it, so a
+    worker whose lease was taken over can't overwrite the new result.
+    """
+    now = time.time()
+    token = uuid.uuid4().hex
+    kind_filter = f" AND kind IN ({', '.join('?' for _ in kinds)})" if kinds else ""
+    await db.execute("BEGIN IMMEDIATE")
+    try:
+        await db.execute(
+            "UPDATE jobs SET status = ?, error = 'Lease expired too many times', finished_at = ? "
+            "WHERE status = ? AND lease_expires_at < ? AND attempts >= max_attempts",
+            (FAILED, now, RUNNING, now)
+        )
+        await db.execute(
+            "UPDATE jobs SET status = ?, lease_token = ?, lease_owner = ?, lease_expires_at = ?, "
+            "attempts = attempts + 1, started_at = ? "
+            "WHERE id IN (SELECT id FROM jobs WHERE ((status = ? AND available_at <= ?) "
+            f"OR (status = ? AND lease_expires_at < ?)){kind_filter} ORDER BY available_at, id LIMIT ?)",
+            (RUNNING, token, owner, now + lease, now, QUEUED, now, RUNNING, now, *(kinds or ()), limit)
+        )
+        async with db.execute(
+            "SELECT id, kind, payload, attempts FROM jobs WHERE lease_token = ? ORDER BY id", (token,)
+        ) as cursor:
+            rows = await cursor.fetchall()
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    return [Job(*row, token) for row in rows]
+
+
+async def next_due(db, kinds=None):
+    """UNIX time at which claim() could next find work, or None if no job is waiting
+
+    That is the earliest available_at of a queued job or lease expiry of a
+    running one. A plain read, so it doesn't take the write lock.
+    """
+    kind_filter = f" AND kind IN ({', '.join('?' for _ in kinds)})" if kinds else ""
+    async with db.execute(
+        "SELECT MIN(CASE WHEN status = ? THEN available_at ELSE lease_expires_at END) FROM jobs "
+        f"WHERE status IN (?, ?){kind_filter}",
+        (QUEUED, QUEUED, RUNNING, *(kinds or ()))
+    ) as cursor:
+        row = await cursor.fetchone()
+    return row[0]
+
+
+async def extend_lease(db, job, lease=60):
+    cursor = await db.execute(
+        "UPDATE jobs SET lease_expires_at = ? WHERE id = ? AND lease_token = ? AND status = ?",
+        (time.time() + lease, job.id, job.token, RUNNING)
+    )
+    await db.commit()
+    return cursor.rowcount == 1
+
+
+async def complete(db, job, result=None):
+    """Store a job's result; False if the lease had already been lost"""
+    cursor = await db.execute(
+        "UPDATE jobs SET status = ?, result = ?, finished_at = ?, lease_expires_at = NULL "
+        "WHERE id = ? AND lease_token = ? AND status = ?",
+        (DONE, json.dumps(result) if result is not None else None, time.time(), job.id, job.token, RUNNING)
+    )
+    await db.commit()
+    return cursor.rowcount == 1
+
+
+async def fail(db, job, error, base_delay=30):
+    """Requeue a failed job with backoff, or mark it failed after its last attempt"""
+    delay = base_delay * 2 ** (job.attempts - 1) * random.uniform(0.8, 1.2)
+    cursor = await db.execute(
+        "UPDATE jobs SET status = CASE WHEN attempts >= max_attempts THEN ? ELSE ? END, "
+        "error = ?, available_at = ?, finished_at = CASE WHEN attempts >= max_attempts THEN ? END, "
+        "lease_expires_at = NULL WHERE id = ? AND lease_token = ? AND status = ?",
+        (FAILED, QUEUED, str(error)[:1000], time.time() + delay, time.time(), job.id, job.token, RUNNING)
+    )
+    await db.commit()
+    return cursor.rowcount == 1
+
+
+async def stats(db_path):
+    """{(kind, status): count} for every job not yet cleaned up"""
+    async with query_log.connect(db_path) as db:
+        async with db.execute("SELECT kind, status, COUNT(*) FROM jobs GROUP BY kind, status") as cursor:
+            return {(kind, status): count for kind, status, count in await cursor.fetchall()}
+
+
+class ResultApplier:
+    """Applies the results of finished jobs in the gateway process
+
+    ``handlers`` maps a job kind to ``async handler(db, status, result, error)``.
+    The handler's writes and the job's applied flag are committed together,
+    so every result is applied exactly once. ``after_apply`` is called once
+    a batch of results has been committed.
+    """
+
+    def __init__(self, db_path, handlers, after_apply=None, poll_interval=5, keep_days=7):
+        self.db_path = db_path
+        self.handlers = handlers
+        self.after_apply = after_apply
+        self.poll_interval = poll_interval
+        self.keep_days = keep_days
+        self._wake = asyncio.Event()
+        self._task = None
+        self.applied = 0
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="job-results")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def notify(self):
+        self._wake.set()
+
+    async def _run(self):
+        last_cleanup = 0
+        while True:
+            try:
+                if await self.apply_pending() and self.after_apply is not None:
+                    self.after_apply()
+                if time.monotonic() - last_cleanup > 3600:
+                    await self.cleanup()
+                    last_cleanup = time.monotonic()
+            except Exception as e:
+                logger.error(f"Applying job results failed: {e}")
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def apply_pending(self, limit=50):
+        async with query_log.connect(self.db_path) as db:
+            async with db.execute(
+                "SELECT id, kind, status, result, error FROM jobs WHERE applied = 0 AND status IN (?, ?) "
+                "ORDER BY id LIMIT ?",
+                (DONE, FAILED, limit)
+            ) as cursor:
+                rows = await cursor.fetchall()
+            for job_id, kind, status, result, error in rows:
+                handler = self.handlers.get(kind)
+                try:
+                    if handler is not None:
+                        await handler(db, status, json.loads(result) if result else None, error)
+                    elif status == FAILED:
+                        logger.error(f"Job #{job_id} ({kind}) failed: {error}")
+                    await db.execute("UPDATE jobs SET applied = 1 WHERE id = ?", (job_id,))
+                    await db.commit()
+                    self.applied += 1
+                except Exception as e:
+                    await db.rollback()
+                    logger.error(f"Could not apply result of job #{job_id} ({kind}): {e}")
+        return len(rows)
+
+    async def cleanup(self):
+        async with query_log.connect(self.db_path) as db:
+            cursor = await db.execute(
+                "DELETE FROM jobs WHERE applied = 1 AND finished_at < ?", (time.time() - self.keep_days * 86400,)
+            )
+            await db.commit()
+        if cursor.rowcount:
+            logger.info(f"Removed {cursor.rowcount} old jobs")
+
+
+class WorkerPool:
+    """Runs worker.py in child processes and restarts them if they exit
+
+    With no processes the jobs run on the caller's event loop instead, so
+    light job kinds like backups don't cost a second interpreter at idle.
+    That worker doesn't poll: call notify() after committing an enqueue()
+    and it claims the job straight away. Otherwise it only wakes when a
+    retry or an expired lease falls due.
+    """
+
+    def __init__(self, processes=0, concurrency=2, restart_delay=5, db_path=None):
+        self.processes = processes
+        self.concurrency = concurrency
+        self.restart_delay = restart_delay
+        self.db_path = db_path
+        self._tasks = []
+        self._children = {}
+        self._wake = asyncio.Event()
+
+    def notify(self):
+        """Tell the in-process worker a job was queued; worker processes poll instead"""
+        self._wake.set()
+
+    def start(self):
+        if self._tasks:
+            return
+        if not self.processes:
+            self._tasks.append(asyncio.create_task(self._run_in_process(), name="job-worker"))
+            logger.info("Running jobs in the bot process")
+            return
+        for number in range(self.processes):
+            self._tasks.append(asyncio.create_task(self._supervise(number), name=f"job-worker-{number}"))
+        logger.info(f"Started {self.processes} job worker processes")
+
+    async def _run_in_process(self):
+        # worker imports this module, so it can only be imported here
+        import worker
+        name = f"{socket.gethostname()}:{os.getpid()}:in-process"
+        while True:
+            try:
+                await worker.Worker(self.db_path, name, self.concurrency, wake=self._wake).run()
+            except Exception as e:
+                logger.error(f"In-process job worker stopped, restarting in {self.restart_delay}s: {e}")
+                await asyncio.sleep(self.restart_delay)
+
+    async def _supervise(self, number):
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "worker.py")
+        while True:
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, script, "--concurrency", str(self.concurrency), "--name", f"pool-{number}"
+            )
+            self._children[number] = process
+            code = await process.wait()
+            logger.warning(f"Job worker {number} exited with code {code}, restarting in {self.restart_delay}s")
+            await asyncio.sleep(self.restart_delay)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for process in self._children.values():
+            if process.returncode is None:
+                process.terminate()
+        await asyncio.gather(*(process.wait() for process in self._children.values()), return_exceptions=True)
+        self._children = {}
@@ -0,0 +1,149 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from collections import deque
+
+logger = logging.getLogger("shop_bot")
+
+# Upper bounds of the lag histogram buckets, in milliseconds
+LAG_BUCKETS = (5, 25, 100, 250, 1000, 5000)
+# Frames from these modules are the loop's own machinery, not the blocking code
+_LOOP_MODULES = (os.sep + "asyncio" + os.sep, os.sep + "selectors.py", os.sep + "threading.py")
+
+
+def _blocking_frame(stack):
+    """Innermost frame that isn't part of the event loop itself"""
+    for frame in reversed(stack):
+        if not any(part in frame.filename for part in _LOOP_MODULES):
+            return frame
+    return stack[-1] if stack else None
+
+
+class Stall:
+    """One period during which the event loop didn't run"""
+
+    __slots__ = ("started", "duration", "location", "stack")
+
+    def __init__(self, started, location, stack):
+        self.started = started
+        self.duration = None
+        self.location = location
+        self.stack = stack
+
+
+class LoopWatchdog:
+    """Measures event-loop lag and captures the stack of whatever blocks the loop
+
+    A task on the loop wakes up every ``interval`` seconds and records how
+    late it was. A helper thread watches the task's heartbeat; when the loop
+    hasn't run for ``threshold`` seconds it grabs the loop thread's current
+    frame, so the log names the code that is blocking, while it is blocking.
+    """
+
+    def __init__(self, interval=0.1, threshold=0.25, history=20):
+        self.interval = interval
+        self.threshold = threshold
+        self.buckets = [0] * (len(LAG_BUCKETS) + 1)
+        self.samples = 0
+        self.max_lag = 0.0
+        self.stalls = deque(maxlen=history)
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id = None
+        self._stall = None
+        self._task = None
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._beat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        logger.info(f"Event loop watchdog started (threshold {self.threshold * 1000:.0f} ms)")
+
+    async def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def record(self, lag):
+        lag_ms = lag * 1000
+        for i, bound in enumerate(LAG_BUCKETS):
+            if lag_ms <= bound:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+        self.samples += 1
+        self.max_lag = max(self.max_lag, lag)
+
+    async def _beat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._heartbeat = now
+            self.record(max(0.0, now - expected))
+            stall = self._stall
+            if stall is not None:
+                self._stall = None
+                stall.duration = now - stall.started
+                logger.warning(f"Event loop was blocked for {stall.duration * 1000:.0f} ms in {stall.location}")
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval):
+            blocked_since = self._heartbeat
+            if self._stall is None and time.monotonic() - blocked_since >= self.threshold:
+                self._capture(blocked_since)
+
+    def _capture(self, blocked_since):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return
+        stack = traceback.extract_stack(frame)
+        culprit = _blocking_frame(stack)
+        location = f"{culprit.name} ({culprit.filename}:{culprit.lineno})" if culprit else "unknown code"
+        stall = Stall(blocked_since, location, "".join(traceback.format_list(stack[-12:])))
+        self.stalls.append(stall)
+        self._stall = stall
+        logger.warning(
+            f"Event loop blocked for over {self.threshold * 1000:.0f} ms in {location}\n"
+            f"Stack of the event loop thread:\n{stall.stack}"
+        )
+
+    def histogram(self):
+        """(label, count) pairs for each lag bucket"""
+        labels = [f"≤{bound} ms" for bound in LAG_BUCKETS] + [f">{LAG_BUCKETS[-1]} ms"]
+        return list(zip(labels, self.buckets))
+
+    def summary(self):
+        """Short text for status embeds"""
+        if not self.samples:
+            return "No samples yet"
+        lines = [f"`{label:>9}` {count}" for label, count in self.histogram() if count]
+        lines.append(f"**Max lag:** {self.max_lag * 1000:.0f} ms · **Stalls:** {len(self.stalls)}")
+        if self.stalls:
+            last = self.stalls[-1]
+            duration = f"{last.duration * 1000:.0f} ms" if last.duration is not None else "ongoing"
+            lines.append(f"**Last stall:** {duration} in `{last.location}`")
+        return "\n".join(lines)
+
+
+def watchdog_from_env():
+    return LoopWatchdog(
+        interval=float(os.getenv('LOOP_LAG_INTERVAL_MS', 100)) / 1000,
+        threshold=float(os.getenv('LOOP_LAG_THRESHOLD_MS', 250)) / 1000,
+    )
@@ -1,8 +1,12 @@
+import time
+# Taken before anything heavy is imported; the ready log line reports from here
+STARTED = time.perf_counter()
+
 import discord
-from discord.ext import commands, tasks
+from discord.ext import commands
 import aiosqlite
 import os
-import json
+import io
 import asyncio
 from datetime import datetime
 import logging
@@ -10,21 +14,34 @@ from dotenv import load_dotenv
 import random
 import string
 import sys
+from cache_policy import get_cache_policy, bot_cache_options, UserCache, cache_report
+from guild_config import GuildConfigStore, CONFIG_KEYS
+from rates import oracle_from_env, RateUnavailable
+from orders import lock_ltc_amount
+import delivery_queue
+import outbox
+import order_events
+import backups
+from reporting import ReportingReplica
+import catalog_import
+import order_pages
+import search
+import jobs
+import scheduler
+import dm_status
+import money
+import order_states
+import pending_orders
+import query_log
+from loop_watchdog import watchdog_from_env
+from profiler import SamplingProfiler, ProfilerBusy, MAX_SECONDS
+from memory import MemoryTracker, rss_bytes, format_bytes
 
 # Add the current directory to the Python path
 current_dir = os.path.dirname(os.path.abspath(__file__))
 if current_dir not in sys.path:
     sys.path.insert(0, current_dir)
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("bot.log"),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger("shop_bot")
 
 # Load environment variables
@@ -33,34 +50,136 @@ TOKEN = os.getenv('DISCORD_TOKEN')
 ADMIN_ROLE_ID = int(os.getenv('ADMIN_ROLE_ID', 0))
 LTC_ADDRESS = os.getenv('LTC_ADDRESS')
 
-# Print token info for debugging (don't log the full token for security)
-if TOKEN:
-    logger.info(f"Token loaded successfully. First 5 chars: {TOKEN[:5]}...")
-    logger.info(f"Token length: {len(TOKEN)}")
-else:
-    logger.error("TOKEN NOT FOUND IN ENVIRONMENT VARIABLES!")
+# Environment and file listings at startup, only with STARTUP_DIAGNOSTICS=1
+# or `python main.py --diagnostics`
+STARTUP_DIAGNOSTICS = os.getenv('STARTUP_DIAGNOSTICS', '').lower() in ('1', 'true', 'yes')
+
+def configure_logging():
+    """Log to bot.log and stderr; only done when the bot runs, not on import"""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler("bot.log"),
+            logging.StreamHandler()
+        ]
+    )
+
+def log_startup_diagnostics():
+    """Log what the bot can see of its environment (never the token itself)"""
+    if TOKEN:
+        logger.info(f"Token loaded successfully. First 5 chars: {TOKEN[:5]}...")
+        logger.info(f"Token length: {len(TOKEN)}")
     logger.info("Environment variables available: " + str([k for k in os.environ.keys()]))
     logger.info("Current directory: " + os.getcwd())
     logger.info("Files in directory: " + str(os.listdir('.')))
     if os.path.exists('.env'):
-        logger.info(".env file exists, checking content length")
         with open('.env', 'r') as f:
-            env_content = f.read()
-            logger.info(f".env file length: {len(env_content)} chars")
+            logger.info(f".env file length: {len(f.read())} chars")
     else:
         logger.info(".env file does not exist")
 
 # Bot configuration
-intents = discord.Intents.default()
-intents.message_content = True
-intents.members = True
-bot = commands.Bot(command_prefix='s!', intents=intents, help_command=None)
+def get_prefix(bot, message):
+    """Resolve the command prefix for the guild a message was sent in"""
+    return guild_configs.prefix_for(message.guild.id if message.guild else None)
+
+CACHE_POLICY = get_cache_policy()
+bot = commands.Bot(command_prefix=get_prefix, help_command=None, **bot_cache_options(CACHE_POLICY))
+# Seconds from process start to the first on_ready, for the startup log line and s!memory
+bot.ready_after = None
+
+# Users that aren't in the gateway cache are fetched on demand and kept in a small LRU
+user_cache = UserCache(bot)
+bot.user_cache = user_cache
 
 # Store LTC address in bot so it can be accessed by cogs
 bot.LTC_ADDRESS = LTC_ADDRESS
 
-# Database path
-DB_PATH = "shop_database.db"
+# Database path (point this at the persistent disk, e.g. /data/shop_database.db on Render)
+DB_PATH = os.getenv('DB_PATH', "shop_database.db")
+
+# Compressed, rotated snapshots taken with SQLite's online backup API
+BACKUP_DIR = backups.default_backup_dir(DB_PATH)
+BACKUP_KEEP = int(os.getenv('BACKUP_KEEP', 14))
+BACKUP_INTERVAL_HOURS = float(os.getenv('BACKUP_INTERVAL_HOURS', 6))
+
+# Read-only snapshot that serves heavy reporting queries
+REPORTING_REFRESH_MINUTES = float(os.getenv('REPORTING_REFRESH_MINUTES', 5))
+reporting = ReportingReplica(
+    DB_PATH, os.getenv('REPORTING_SNAPSHOT'), max_age=REPORTING_REFRESH_MINUTES * 60 * 2
+)
+bot.reporting = reporting
+
+# Per-guild settings (admin role, payout address, prefix, reminder cadence)
+# kept in memory; the environment variables are the defaults
+guild_configs = GuildConfigStore(DB_PATH, ADMIN_ROLE_ID, LTC_ADDRESS)
+bot.guild_configs = guild_configs
+
+# Cached USD→LTC rate; orders lock their LTC amount when they are created
+rate_oracle = oracle_from_env()
+bot.rate_oracle = rate_oracle
+
+# Append-only order history, buffered and flushed in batches
+order_event_log = order_events.EventLog(DB_PATH)
+bot.order_events = order_event_log
+
+# Pending orders in memory for payment reminders and s!confirm; order
+# write paths keep it current and a periodic check repairs any drift
+pending_index = pending_orders.PendingOrderIndex(DB_PATH)
+bot.pending_orders = pending_index
+
+# Users whose DMs fail (closed DMs, deleted accounts) are not retried on
+# every message, only on a growing schedule
+dm_statuses = dm_status.DMStatusCache(bot, DB_PATH)
+bot.dm_status = dm_statuses
+
+# Durable delivery queue; approve/deliver enqueue and return straight away
+delivery_worker = delivery_queue.DeliveryWorker(
+    bot, DB_PATH, events=order_event_log, concurrency=int(os.getenv('DELIVERY_WORKERS', 4)), dm_status=dm_statuses
+)
+bot.delivery_worker = delivery_worker
+
+# User notifications are written to the outbox with the order change they
+# belong to and sent by the dispatcher
+outbox_dispatcher = outbox.OutboxDispatcher(bot, DB_PATH, dm_status=dm_statuses)
+bot.outbox_dispatcher = outbox_dispatcher
+
+# Background work is queued as jobs. They run on this loop unless
+# WORKER_PROCESSES starts worker processes for them
+job_results = jobs.ResultApplier(DB_PATH, {}, after_apply=outbox_dispatcher.notify)
+worker_pool = jobs.WorkerPool(
+    processes=int(os.getenv('WORKER_PROCESSES', 0)), concurrency=int(os.getenv('WORKER_CONCURRENCY', 2)), db_path=DB_PATH
+)
+
+# Periodic work (payment scans, backups, snapshot refreshes)
+PAYMENT_SCAN_MINUTES = float(os.getenv('PAYMENT_SCAN_MINUTES', 2))
+PENDING_RECONCILE_MINUTES = float(os.getenv('PENDING_RECONCILE_MINUTES', 30))
+periodic = scheduler.Scheduler(DB_PATH, max_concurrent=int(os.getenv('SCHEDULER_CONCURRENCY', 2)))
+
+# Reports event-loop lag and logs the stack of anything that blocks the loop
+loop_watchdog = watchdog_from_env()
+bot.loop_watchdog = loop_watchdog
+
+# On-demand sampling profiler for s!profile
+profiler = SamplingProfiler()
+
+# tracemalloc baseline and diffs for s!memory
+memory_tracker = MemoryTracker()
+
+# Full command messages for replay.py, only when COMMAND_CAPTURE is set
+# (replay.py is not imported otherwise)
+command_capture = None
+if os.getenv('COMMAND_CAPTURE'):
+    from replay import capture_from_env
+    command_capture = capture_from_env()
+
+# Health checks for the host (PORT is set on Render web services) and the
+# local admin API, which stays off unless ADMIN_API_TOKEN is set
+MONITOR_HOST = os.getenv('MONITOR_HOST', '0.0.0.0')
+MONITOR_PORT = int(os.getenv('PORT', 8080))
+ADMIN_API_TOKEN = os.getenv('ADMIN_API_TOKEN')
+ADMIN_API_REMOTE = os.getenv('ADMIN_API_REMOTE', '').lower() in ('1', 'true', 'yes')
 
 # Enhanced colors for embeds with a more modern palette
 COLORS = {
@@ -103,13 +222,17 @@ def generate_confirmation_key(length=8):
 
 # Initialize database
 async def init_db():
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with query_log.connect(DB_PATH) as db:
+        # WAL lets readers run alongside a writer instead of blocking it
+        await db.execute("PRAGMA journal_mode=WAL")
+        
         # Create items table
         await db.execute('''
         CREATE TABLE IF NOT EXISTS items (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT UNIQUE,
             price REAL,
+            price_cents INTEGER,
             stock INTEGER,
             description TEXT,
             drive_link TEXT
@@ -125,6 +248,8 @@ async def init_db():
             quantity INTEGER,
             total_price REAL,
             ltc_amount REAL,
+            total_cents INTEGER,
+            ltc_litoshis INTEGER,
             status TEXT,
             confirmation_key TEXT,
             payment_confirmed BOOLEAN DEFAULT 0,
@@ -144,6 +269,21 @@ async def init_db():
         )
         ''')
         
+        # Create per-guild configuration table
+        await guild_configs.create_table(db)
+        
+        # Create delivery queue table
+        await delivery_queue.create_table(db)
+        
+        # Create notification outbox table
+        await outbox.create_table(db)
+        
+        # Create background job table
+        await jobs.create_table(db)
+        
+        # Create table of users who can't be DMed
+        await dm_status.create_table(db)
+        
         # Check for and add missing columns if needed
         # Check for payment_confirmed column in orders
         try:
@@ -166,6 +306,33 @@ async def init_db():
             logger.info("Adding missing drive_link column to items table")
             await db.execute("ALTER TABLE items ADD COLUMN drive_link TEXT")
         
+        # Check for guild_id column in orders
+        try:
+            await db.execute("SELECT guild_id FROM orders LIMIT 1")
+        except aiosqlite.OperationalError:
+            logger.info("Adding missing guild_id column to orders table")
+            await db.execute("ALTER TABLE orders ADD COLUMN guild_id INTEGER")
+        
+        # Check for reminded_at column in orders
+        try:
+            await db.execute("SELECT reminded_at FROM orders LIMIT 1")
+        except aiosqlite.OperationalError:
+            logger.info("Adding missing reminded_at column to orders table")
+            await db.execute("ALTER TABLE orders ADD COLUMN reminded_at TIMESTAMP")
+        
+        # Integer cents and litoshis columns, backfilled from the REAL ones
+        await money.migrate(db)
+        
+        # Create order event log (needs the migrated orders columns)
+        await order_events.create_table(db)
+        
+        # Indexes for paging through order history
+        await order_pages.create_indexes(db)
+        await pending_orders.create_indexes(db)
+        
+        # Full-text index over item names and descriptions
+        await search.create_index(db)
+        
         await db.commit()
         logger.info("Database initialization complete")
 
@@ -173,59 +340,127 @@ async def init_db():
 async def on_ready():
     logger.info(f'{bot.user.name} has connected to Discord!')
     await init_db()
-    check_payments.start()
+    await guild_configs.load()
+    await dm_statuses.load()
+    await pending_index.load()
+    order_event_log.start()
+    await delivery_worker.start()
+    outbox_dispatcher.start()
+    job_results.start()
+    worker_pool.start()
+    await periodic.start()
+    if bot.ready_after is None:
+        bot.ready_after = time.perf_counter() - STARTED
+        logger.info(f"Ready {bot.ready_after:.2f}s after start")
 
 # Tasks
-@tasks.loop(minutes=2)
 async def check_payments():
-    """Check for pending payments and update if paid"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        try:
-            async with db.execute(
-                "SELECT id, user_id, item_id, total_price FROM orders WHERE status = 'pending' AND payment_confirmed = 0"
-            ) as cursor:
-                pending_orders = await cursor.fetchall()
-        except aiosqlite.OperationalError as e:
-            # If we still encounter an error with the column, log it and use a fallback query
-            logger.error(f"Error in check_payments: {e}")
-            async with db.execute(
-                "SELECT id, user_id, item_id, total_price FROM orders WHERE status = 'pending'"
-            ) as cursor:
-                pending_orders = await cursor.fetchall()
-        
-        for order in pending_orders:
-            order_id, user_id, item_id, total_price = order
-            
-            # In a real implementation, we would check the blockchain for payments
-            # For this simplified version, we'll assume payments are manually confirmed
-            
-            # Fetch the user and send a reminder
-            user = bot.get_user(user_id)
-            if user:
-                try:
-                    payment_reminder = create_embed(
-                        "💸 Payment Reminder",
-                        f"Hey there! Just a reminder about your pending order.",
-                        COLORS["info"]
-                    )
-                    payment_reminder.add_field(
-                        name="Order Details",
-                        value=f"**Order ID:** #{order_id}\n**Amount Due:** ${total_price:.2f}",
-                        inline=False
-                    )
-                    payment_reminder.add_field(
-                        name="Payment Instructions",
-                        value=f"Please send **{total_price} LTC** to:\n`{LTC_ADDRESS}`\n\nAfter sending payment, use `s!confirm <confirmation_key>` to notify us.",
-                        inline=False
-                    )
-                    
-                    await user.send(embed=payment_reminder)
-                except:
-                    pass
-
-@check_payments.before_loop
-async def before_check_payments():
-    await bot.wait_until_ready()
+    """Queue payment reminders for pending orders that are due one
+
+    Due orders come from the pending order index. The only read is
+    catch_up(), which adds orders created since the last scan.
+    """
+    await pending_index.catch_up()
+    due = pending_index.due_reminders(lambda guild_id: guild_configs.get(guild_id).reminder_minutes)
+    if not due:
+        return
+    
+    # Orders are created without an LTC amount; it is locked here, before the
+    # first reminder and outside the reminder transaction
+    for order in due:
+        if order.ltc_litoshis is None:
+            try:
+                async with query_log.connect(DB_PATH) as db:
+                    order.ltc_litoshis = await lock_ltc_amount(db, rate_oracle, order.id, order.total_cents)
+                    await db.commit()
+            except RateUnavailable:
+                logger.warning(f"No LTC rate available, skipping reminder for order #{order.id}")
+    
+    reminded = []
+    outdated = 0
+    async with query_log.connect(DB_PATH) as db:
+        for order in due:
+            if order.ltc_litoshis is None:
+                continue
+            reminded_at = order_events.utc_timestamp()
+            # Skip orders that were paid, cancelled or reminded behind the index's back
+            cursor = await db.execute(
+                "UPDATE orders SET reminded_at = ? WHERE id = ? AND status = 'pending' AND reminded_at IS ?",
+                (reminded_at, order.id, order.reminded_at)
+            )
+            if not cursor.rowcount:
+                outdated += 1
+                continue
+            config = guild_configs.get(order.guild_id)
+            embed = payment_reminder_embed(
+                order.id, money.usd(order.total_cents), money.ltc(order.ltc_litoshis), config.ltc_address, config.prefix
+            )
+            await outbox.add(db, order.user_id, "payment_reminder", embed, order.id)
+            reminded.append((order, reminded_at))
+        await db.commit()
+    
+    for order, reminded_at in reminded:
+        order.reminded_at = reminded_at
+    if reminded:
+        outbox_dispatcher.notify()
+    if outdated:
+        await pending_index.reconcile()
+
+async def reconcile_pending_orders():
+    """Check the pending order index against the orders table"""
+    await pending_index.reconcile()
+
+def payment_reminder_embed(order_id, total, ltc_due, ltc_address, prefix):
+    payment_reminder = create_embed(
+        "💸 Payment Reminder",
+        f"Hey there! Just a reminder about your pending order.",
+        COLORS["info"]
+    )
+    payment_reminder.add_field(
+        name="Order Details",
+        value=f"**Order ID:** #{order_id}\n**Amount Due:** {total}",
+        inline=False
+    )
+    payment_reminder.add_field(
+        name="Payment Instructions",
+        value=f"Please send **{ltc_due}** to:\n`{ltc_address}`\n\nAfter sending payment, use `{prefix}confirm <confirmation_key>` to notify us.",
+        inline=False
+    )
+    return payment_reminder
+
+def payment_confirmed_embed(order_id):
+    """DM sent when an admin approves an order"""
+    return create_embed(
+        "✅ Payment Confirmed",
+        f"Your payment for order **#{order_id}** has been confirmed. Your delivery is on its way!",
+        COLORS["success"]
+    )
+
+async def apply_backup(db, status, result, error):
+    if status == jobs.FAILED:
+        logger.error(f"Scheduled backup failed: {error}")
+    else:
+        logger.info(f"Scheduled backup written to {result['path']}")
+
+job_results.handlers.update(backup=apply_backup)
+
+async def backup_database():
+    """Queue a scheduled backup of the database for a job worker"""
+    async with query_log.connect(DB_PATH) as db:
+        await jobs.enqueue(db, "backup", {"dir": BACKUP_DIR, "keep": BACKUP_KEEP}, unique=True)
+        await db.commit()
+    worker_pool.notify()
+
+async def refresh_reporting():
+    """Refresh the read-only reporting snapshot"""
+    await reporting.refresh()
+
+# Next runs are persisted, so restarts keep each job's cadence; missed
+# backups are made up once, missed scans and refreshes are skipped
+periodic.every("payment_scan", PAYMENT_SCAN_MINUTES * 60, check_payments, catch_up=scheduler.SKIP)
+periodic.every("backup", BACKUP_INTERVAL_HOURS * 3600, backup_database, catch_up=scheduler.ONCE)
+periodic.every("reporting_refresh", REPORTING_REFRESH_MINUTES * 60, refresh_reporting, catch_up=scheduler.SKIP)
+periodic.every("pending_reconcile", PENDING_RECONCILE_MINUTES * 60, reconcile_pending_orders, catch_up=scheduler.SKIP)
 
 # Helper functions
 async def is_admin(ctx):
@@ -233,15 +468,20 @@ async def is_admin(ctx):
     if not ctx.guild:
         return False
     
-    admin_role = discord.utils.get(ctx.guild.roles, id=ADMIN_ROLE_ID)
-    if admin_role and admin_role in ctx.author.roles:
+    # Member.get_role checks the member's sorted role IDs, no scan over guild roles
+    admin_role_id = guild_configs.get(ctx.guild.id).admin_role_id
+    if admin_role_id and ctx.author.get_role(admin_role_id):
         return True
     
     return ctx.author.guild_permissions.administrator
 
+async def invalidate_catalog_caches():
+    """Refresh everything that caches the item catalog after a bulk change"""
+    await reporting.refresh()
+
 async def is_banned(user_id):
     """Check if a user is banned from using the shop"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with query_log.connect(DB_PATH) as db:
         async with db.execute(
             "SELECT 1 FROM banned_users WHERE user_id = ?", (user_id,)
         ) as cursor:
@@ -255,9 +495,12 @@ async def on_message(message):
         return
         
     # Debug message if it starts with command prefix
-    if message.content.startswith('s!'):
-        command_name = message.content.split()[0][2:] if ' ' in message.content else message.content[2:]
+    prefix = guild_configs.prefix_for(message.guild.id if message.guild else None)
+    if message.content.startswith(prefix):
+        command_name = message.content[len(prefix):].split(' ', 1)[0]
         logger.info(f"Command detected: {command_name} from {message.author}")
+        if command_capture:
+            command_capture.record(message)
         
         # Check if the command exists
         cmd = bot.get_command(command_name)
@@ -298,7 +541,7 @@ async def on_command_error(ctx, error):
         await ctx.send(
             embed=create_embed(
                 "❌ Error: Missing Argument",
-                f"You're missing the `{error.param.name}` parameter.\nCheck `s!help` for proper command usage.",
+                f"You're missing the `{error.param.name}` parameter.\nCheck `{ctx.clean_prefix}help` for proper command usage.",
                 COLORS["error"]
             )
         )
@@ -306,7 +549,7 @@ async def on_command_error(ctx, error):
         await ctx.send(
             embed=create_embed(
                 "❌ Error: Invalid Argument",
-                "One of the values you provided isn't valid.\nCheck `s!help` for proper command usage.",
+                f"One of the values you provided isn't valid.\nCheck `{ctx.clean_prefix}help` for proper command usage.",
                 COLORS["error"]
             )
         )
@@ -334,8 +577,9 @@ async def load_extensions():
         # Check if cogs directory exists
         if not os.path.exists('./cogs'):
             logger.error("Cogs directory not found!")
-            logger.info(f"Current directory: {os.getcwd()}")
-            logger.info(f"Directory contents: {os.listdir('.')}")
+            if STARTUP_DIAGNOSTICS:
+                logger.info(f"Current directory: {os.getcwd()}")
+                logger.info(f"Directory contents: {os.listdir('.')}")
             
             # Try to find cogs in different locations
             possible_locations = ['./cogs', '/opt/render/project/src/cogs', '../cogs', '../../cogs']
@@ -372,13 +616,37 @@ async def load_extensions():
         logger.error(f"Error loading extensions: {e}")
         import traceback
         logger.error(traceback.format_exc())
+    finally:
+        # Keyset-paginated order history and the index-backed s!confirm
+        # replace any cog commands of the same names
+        for command in (orders_command, view_orders, confirm_payment):
+            override_command(command)
+
+def override_command(command):
+    """Register one of our commands, replacing a cog command of the same name"""
+    existing = bot.get_command(command.name)
+    if existing is command:
+        return
+    if existing is not None:
+        bot.remove_command(existing.name)
+        logger.info(f"Replacing the '{command.name}' command from {existing.cog_name or 'another extension'} with the built-in one")
+    bot.add_command(command)
 
 # Run the bot
 async def main():
-    # Start the monitoring server if imported
-    if 'run_monitor' in globals():
-        monitor_thread = run_monitor()
-        logger.info("Monitor server started")
+    if not TOKEN:
+        logger.error("TOKEN NOT FOUND IN ENVIRONMENT VARIABLES! Run with --diagnostics for details")
+    if STARTUP_DIAGNOSTICS:
+        log_startup_diagnostics()
+    logger.info(f"Imports took {time.perf_counter() - STARTED:.2f}s")
+    
+    # Start the health check and admin API server on this event loop. Imported
+    # here so that importing main (replay.py, scripts) doesn't load aiohttp.web
+    from monitor import run_monitor
+    monitor = await run_monitor(
+        bot, DB_PATH, MONITOR_HOST, MONITOR_PORT, token=ADMIN_API_TOKEN, allow_remote=ADMIN_API_REMOTE,
+        confirmation=payment_confirmed_embed, on_catalog_change=invalidate_catalog_caches
+    )
     
     # First connect to Discord
     async with bot:
@@ -393,12 +661,23 @@ async def main():
             logger.error(f"Failed to sync commands: {e}")
         
         # Log all registered commands
-        logger.info("Registered commands:")
-        for command in bot.commands:
-            logger.info(f"- {command.name}")
+        if STARTUP_DIAGNOSTICS:
+            logger.info("Registered commands:")
+            for command in bot.commands:
+                logger.info(f"- {command.name}")
+        logger.info(f"{len(bot.commands)} commands registered")
         
         # Start the bot
-        await bot.start(TOKEN)
+        loop_watchdog.start()
+        try:
+            await bot.start(TOKEN)
+        finally:
+            await monitor.stop()
+            await loop_watchdog.stop()
+            await periodic.stop()
+            await worker_pool.stop()
+            # Write any order events still in the buffer
+            await order_event_log.stop()
 
 # Add a help command manually since we disabled the default
 @bot.command(name="help")
@@ -411,7 +690,7 @@ async def custom_help(ctx, command_name=None):
         command = bot.get_command(command_name)
         if command:
             embed = create_embed(
-                f"Command: s!{command.name}",
+                f"Command: {ctx.clean_prefix}{command.name}",
                 command.help or "No description available",
                 COLORS["info"]
             )
@@ -419,7 +698,7 @@ async def custom_help(ctx, command_name=None):
         else:
             embed = create_embed(
                 "Command Not Found",
-                f"No command named '{command_name}' was found. Use `s!help` to see all commands.",
+                f"No command named '{command_name}' was found. Use `{ctx.clean_prefix}help` to see all commands.",
                 COLORS["error"]
             )
             await ctx.send(embed=embed)
@@ -446,9 +725,9 @@ async def custom_help(ctx, command_name=None):
         is_admin = False
         if command.cog and command.cog.__class__.__name__ == 'AdminCommands':
             is_admin = True
-            admin_commands.append(f"**s!{command.name}** - {command.help or 'No description'}")
+            admin_commands.append(f"**{ctx.clean_prefix}{command.name}** - {command.help or 'No description'}")
         else:
-            general_commands.append(f"**s!{command.name}** - {command.help or 'No description'}")
+            general_commands.append(f"**{ctx.clean_prefix}{command.name}** - {command.help or 'No description'}")
     
     # Add command sections
     if general_commands:
@@ -515,9 +794,16 @@ async def status_command(ctx):
         inline=False
     )
     
+    # Event loop lag since startup
+    embed.add_field(
+        name="Event Loop Lag",
+        value=loop_watchdog.summary(),
+        inline=False
+    )
+    
     # Check database
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
+        async with query_log.connect(DB_PATH) as db:
             async with db.execute("SELECT COUNT(*) FROM items") as cursor:
                 items_count = await cursor.fetchone()
                 items_count = items_count[0] if items_count else 0
@@ -586,7 +872,7 @@ async def debug_cog(ctx, cog_name: str = None):
         
         embed.add_field(
             name="Commands",
-            value="\n".join([f"• `s!{cmd}`" for cmd in cog_commands]) or "No commands registered",
+            value="\n".join([f"• `{ctx.clean_prefix}{cmd}`" for cmd in cog_commands]) or "No commands registered",
             inline=False
         )
         
@@ -626,5 +912,684 @@ async def debug_cog(ctx, cog_name: str = None):
     
     await ctx.send(embed=embed)
 
+# Add cache report command
+@bot.command(name="cachestats")
+async def cache_stats(ctx):
+    """Show the sizes of the bot's member, user and message caches"""
+    logger.info(f"Cache stats command executed by {ctx.author}")
+    
+    if not await is_admin(ctx):
+        return await ctx.send(
+            embed=create_embed(
+                "🔒 Access Denied",
+                "You don't have permission to use this command.",
+                COLORS["error"]
+            )
+        )
+    
+    report = cache_report(bot, CACHE_POLICY, user_cache)
+    embed = create_embed(
+        "🧠 Cache Report",
+        f"Member cache policy: **{report['policy']}**",
+        COLORS["admin"]
+    )
+    embed.add_field(
+        name="Gateway Caches",
+        value=f"**Guilds:** {report['guilds']}\n**Users:** {report['users']}\n**Members:** {report['members']}\n"
+              f"**Messages:** {report['messages']} / {report['max_messages'] or 'disabled'}",
+        inline=False
+    )
+    embed.add_field(
+        name="User LRU",
+        value=f"**Size:** {report['lru_size']} / {report['lru_max']}\n**Hits:** {report['lru_hits']}\n"
+              f"**Fetches:** {report['lru_fetches']}\n**Not Found:** {report['lru_misses']}",
+        inline=False
+    )
+    
+    await ctx.send(embed=embed)
+
+# Add per-guild configuration command
+@bot.command(name="shopconfig")
+async def shop_config(ctx, key: str = None, *, value: str = None):
+    """View or change this server's shop settings (adminrole, ltcaddress, prefix, reminder, notifychannel)"""
+    logger.info(f"Shop config command executed by {ctx.author}")
+    
+    if not await is_admin(ctx):
+        return await ctx.send(
+            embed=create_embed(
+                "🔒 Access Denied",
+                "You don't have permission to use this command.",
+                COLORS["error"]
+            )
+        )
+    
+    if key is None:
+        config = guild_configs.get(ctx.guild.id)
+        admin_role = ctx.guild.get_role(config.admin_role_id) if config.admin_role_id else None
+        embed = create_embed(
+            "⚙️ Shop Settings",
+            f"Settings for **{ctx.guild.name}**",
+            COLORS["admin"]
+        )
+        embed.add_field(
+            name="Current Values",
+            value=f"**adminrole:** {admin_role.mention if admin_role else 'Not set'}\n"
+                  f"**ltcaddress:** `{config.ltc_address or 'Not set'}`\n"
+                  f"**prefix:** `{config.prefix}`\n"
+                  f"**reminder:** every {config.reminder_minutes} minutes\n"
+                  f"**notifychannel:** {f'<#{config.notify_channel_id}>' if config.notify_channel_id else 'Not set'}",
+            inline=False
+        )
+        return await ctx.send(embed=embed)
+    
+    key = key.lower()
+    if key not in CONFIG_KEYS or value is None:
+        return await ctx.send(
+            embed=create_embed(
+                "❌ Error: Invalid Setting",
+                f"Usage: `{ctx.prefix}shopconfig <{'|'.join(CONFIG_KEYS)}> <value>`",
+                COLORS["error"]
+            )
+        )
+    
+    if key == "adminrole":
+        value = (await commands.RoleConverter().convert(ctx, value)).id
+    elif key == "reminder":
+        if not value.isdigit() or int(value) < 1:
+            raise commands.BadArgument("Reminder cadence must be a whole number of minutes")
+        value = int(value)
+    elif key == "notifychannel":
+        value = (await commands.TextChannelConverter().convert(ctx, value)).id
+    
+    await guild_configs.update(ctx.guild.id, **{CONFIG_KEYS[key]: value})
+    await ctx.send(
+        embed=create_embed(
+            "✅ Setting Updated",
+            f"**{key}** has been updated for this server.",
+            COLORS["success"]
+        )
+    )
+
+# Add batch approval command
+@bot.command(name="approvebatch")
+async def approve_batch(ctx, order_ids: commands.Greedy[int], *, message: str = None):
+    """Mark many orders as paid and queue their deliveries in one go"""
+    logger.info(f"Approve batch command executed by {ctx.author}")
+    
+    if not await is_admin(ctx):
+        return await ctx.send(
+            embed=create_embed(
+                "🔒 Access Denied",
+                "You don't have permission to use this command.",
+                COLORS["error"]
+            )
+        )
+    
+    if not order_ids:
+        raise commands.BadArgument("No order IDs given")
+    
+    approved = await delivery_queue.approve_orders(
+        DB_PATH, order_ids, message, payment_confirmed_embed, events=order_event_log, pending=pending_index
+    )
+    delivery_worker.notify()
+    outbox_dispatcher.notify()
+    
+    skipped = sorted(set(order_ids) - set(approved))
+    embed = create_embed(
+        "✅ Orders Approved",
+        f"Queued delivery for **{len(approved)}** order(s).",
+        COLORS["success"]
+    )
+    if skipped:
+        embed.add_field(
+            name="Skipped",
+            value=", ".join(f"#{order_id}" for order_id in skipped[:50]) + "\n(not found, cancelled, refunded or delivered)",
+            inline=False
+        )
+    await ctx.send(embed=embed)
+
+# Add delivery queue command
+@bot.command(name="deliveries")
+async def deliveries_command(ctx, action: str = None, *delivery_ids: int):
+    """Show the delivery queue, or `retry [ids]` to requeue dead deliveries"""
+    logger.info(f"Deliveries command executed by {ctx.author}")
+    
+    if not await is_admin(ctx):
+        return await ctx.send(
+            embed=create_embed(
+                "🔒 Access Denied",
+                "You don't have permission to use this command.",
+                COLORS["error"]
+            )
+        )
+    
+    if action == "retry":
+        requeued = await delivery_worker.retry_dead(list(delivery_ids))
+        return await ctx.send(
+            embed=create_embed(
+                "🔁 Deliveries Requeued",
+                f"Moved **{requeued}** dead delivery(s) back to the queue.",
+                COLORS["success"]
+            )
+        )
+    
+    counts, dead = await delivery_worker.stats()
+    embed = create_embed(
+        "📦 Delivery Queue",
+        f"Worker: {'✅ Running' if delivery_worker.running else '❌ Stopped'}",
+        COLORS["admin"]
+    )
+    embed.add_field(
+        name="Deliveries",
+        value="\n".join(f"**{status.title()}:** {counts.get(status, 0)}" for status in
+                        (delivery_queue.QUEUED, delivery_queue.SENDING, delivery_queue.DELIVERED, delivery_queue.DEAD)),
+        inline=False
+    )
+    if dead:
+        embed.add_field(
+            name="Dead Letters",
+            value="\n".join(f"**#{delivery_id}** order #{order_id} after {attempts} attempts: {(error or '')[:80]}"
+                            for delivery_id, order_id, attempts, error in dead),
+            inline=False
+        )
+    await ctx.send(embed=embed)
+
+# Add backup command
+@bot.command(name="backup")
+async def backup_command(ctx, action: str = "list", backup_name: str = None):
+    """List backups, take one with `now`, or `restore <name>` to roll the database back"""
+    logger.info(f"Backup command executed by {ctx.author}")
+    
+    if not await is_admin(ctx):
+        return await ctx.send(
+            embed=create_embed(
+                "🔒 Access Denied",
+                "You don't have permission to use this command.",
+                COLORS["error"]
+            )
+        )
+    
+    if action == "now":
+        path = await backups.run_backup(DB_PATH, BACKUP_DIR, BACKUP_KEEP)
+        return await ctx.send(
+            embed=create_embed(
+                "💾 Backup Complete",
+                f"Saved `{os.path.basename(path)}` ({os.path.getsize(path) / 1024:.1f} KB).",
+                COLORS["success"]
+            )
+        )
+    
+    if action == "restore":
+        paths = {os.path.basename(path): path for path in backups.list_backups(BACKUP_DIR)}
+        if backup_name not in paths:
+            raise commands.BadArgument(f"No backup named {backup_name}")
+        await backups.run_restore(paths[backup_name], DB_PATH)
+        # Reload state that is cached in memory
+        await guild_configs.load()
+        await dm_statuses.load()
+        await pending_index.load()
+        return await ctx.send(
+            embed=create_embed(
+                "♻️ Backup Restored",
+                f"The database was restored from `{backup_name}`.",
+                COLORS["warning"]
+            )
+        )
+    
+    paths = backups.list_backups(BACKUP_DIR)
+    embed = create_embed(
+        "💾 Backups",
+        f"**Directory:** `{BACKUP_DIR}`\n**Every:** {BACKUP_INTERVAL_HOURS:g} hours, keeping {BACKUP_KEEP}",
+        COLORS["admin"]
+    )
+    embed.add_field(
+        name="Snapshots",
+        value="\n".join(f"`{os.path.basename(path)}` ({os.path.getsize(path) / 1024:.1f} KB)" for path in paths[:15])
+              or "No backups yet",
+        inline=False
+    )
+    await ctx.send(embed=embed)
+
+# Add export command
+@bot.command(name="export")
+async def export_command(ctx, kind: str, *options: str):
+    """Export orders, items or sales as gzipped CSV/JSONL, e.g. `export orders 30d jsonl`"""
+    logger.info(f"Export command executed by {ctx.author}")
+    
+    if not await is_admin(ctx):
+        return await ctx.send(
+            embed=create_embed(
+                "🔒 Access Denied",
+                "You don't have permission to use this command.",
+                COLORS["error"]
+            )
+        )
+    
+    import export
+    fmt = next((option for option in options if option in export.FORMATS), "csv")
+    date_range = next((option for option in options if option not in export.FORMATS), None)
+    try:
+        export.build_query(kind, date_range)
+    except ValueError as e:
+        raise commands.BadArgument(str(e))
+    
+    max_bytes = ctx.guild.filesize_limit if ctx.guild else export.DEFAULT_MAX_BYTES
+    total_rows = 0
+    files = 0
+    # Exports read the reporting snapshot so they never lock the live database
+    async with reporting.connect() as db:
+        async for filename, data, rows in export.export_chunks(db, kind, fmt, date_range, max_bytes):
+            await ctx.send(file=discord.File(io.BytesIO(data), filename=filename))
+            total_rows += rows
+            files += 1
+    
+    await ctx.send(
+        embed=create_embed(
+            "📤 Export Complete",
+            f"Exported **{total_rows}** {kind} rows in {files} file(s).",
+            COLORS["success"]
+        )
+    )
+
+# Add bulk catalog import command
+@bot.command(name="importcatalog")
+async def import_catalog(ctx, *options: str):
+    """Preview a CSV/JSON catalog attached to the message; add `apply` to apply it, `prune` to remove missing items"""
+    logger.info(f"Import catalog command executed by {ctx.author}")
+    
+    if not await is_admin(ctx):
+        return await ctx.send(
+            embed=create_embed(
+                "🔒 Access Denied",
+                "You don't have permission to use this command.",
+                COLORS["error"]
+            )
+        )
+    
+    if not ctx.message.attachments:
+        raise commands.BadArgument("Attach a .csv or .json catalog file")
+    
+    attachment = ctx.message.attachments[0]
+    apply = "apply" in options
+    prune = "prune" in options
+    try:
+        catalog = catalog_import.parse_catalog(await attachment.read(), attachment.filename)
+        async with query_log.connect(DB_PATH) as db:
+            diff = await catalog_import.compute_diff(db, catalog, prune)
+            if diff and apply:
+                await catalog_import.apply_diff(db, diff)
+    except catalog_import.CatalogError as e:
+        return await ctx.send(embed=create_embed("❌ Invalid Catalog", str(e), COLORS["error"]))
+    
+    if diff and apply:
+        # Invalidate catalog caches once for the whole import
+        await invalidate_catalog_caches()
+    
+    if not diff:
+        title, description = "✅ Catalog Up To Date", "No changes needed."
+    elif apply:
+        title, description = "✅ Catalog Imported", f"Applied changes from `{attachment.filename}`."
+    else:
+        title, description = "📝 Catalog Preview", f"Dry run of `{attachment.filename}`. Run `{ctx.prefix}importcatalog apply` with the same file to apply."
+    embed = create_embed(title, description, COLORS["success"] if apply or not diff else COLORS["info"])
+    for name, value in diff.summary().items():
+        embed.add_field(name=name, value=value[:1024], inline=False)
+    await ctx.send(embed=embed)
+
+@bot.command(name="querystats")
+async def query_stats(ctx, order: str = "total", count: int = 8):
+    """Show the most expensive database queries; order by total, count, max or mean, or `reset`"""
+    logger.info(f"Query stats command executed by {ctx.author}")
+    
+    if not await is_admin(ctx):
+        return await ctx.send(
+            embed=create_embed(
+                "🔒 Access Denied",
+                "You don't have permission to use this command.",
+                COLORS["error"]
+            )
+        )
+    
+    stats = query_log.query_log
+    if order == "reset":
+        stats.reset()
+        return await ctx.send(embed=create_embed("✅ Query Stats Reset", "Query timings cleared.", COLORS["success"]))
+    if order not in ("total", "count", "max", "mean"):
+        raise commands.BadArgument("Order by total, count, max or mean")
+    
+    top = stats.top(max(1, min(count, 20)), by=order)
+    embed = create_embed(
+        "🐢 Query Stats",
+        f"{len(stats.stats)} statement shapes, slow threshold {stats.slow_seconds * 1000:.0f} ms, ordered by {order}",
+        COLORS["info"]
+    )
+    for entry in top:
+        value = (
+            f"```sql\n{entry.sql[:300]}\n```"
+            f"{entry.count} runs · mean {entry.mean * 1000:.1f} ms · max {entry.max * 1000:.1f} ms · "
+            f"total {entry.total:.2f}s · {entry.slow} slow · {entry.errors} errors"
+        )
+        if entry.plan:
+            value += f"\n```{entry.plan[:200]}```"
+        embed.add_field(name=f"{entry.total * 1000:.0f} ms total", value=value[:1024], inline=False)
+    if not top:
+        embed.description += "\n\nNo queries recorded yet."
+    await ctx.send(embed=embed)
+
+@bot.command(name="profile")
+async def profile_command(ctx, seconds: int = 10):
+    """Sample what the event loop is doing for a few seconds and attach a flamegraph file"""
+    logger.info(f"Profile command executed by {ctx.author}")
+    
+    if not await is_admin(ctx):
+        return await ctx.send(
+            embed=create_embed(
+                "🔒 Access Denied",
+                "You don't have permission to use this command.",
+                COLORS["error"]
+            )
+        )
+    
+    seconds = max(1, min(seconds, MAX_SECONDS))
+    await ctx.send(embed=create_embed("🔬 Profiling", f"Sampling the event loop for {seconds}s...", COLORS["info"]))
+    try:
+        result = await profiler.run(seconds)
+    except ProfilerBusy:
+        return await ctx.send(embed=create_embed("⏳ Profile Running", "A profile is already running.", COLORS["warning"]))
+    
+    stamp = datetime.utcnow().strftime('%Y%m%d-%H%M%S')
+    summary = result.summary(40)
+    files = [
+        discord.File(io.BytesIO(result.collapsed().encode()), filename=f"profile-{stamp}.collapsed.txt"),
+        discord.File(io.BytesIO(summary.encode()), filename=f"profile-{stamp}.top.txt"),
+    ]
+    embed = create_embed(
+        "🔬 Profile",
+        f"```\n{result.summary(12)[:3900]}\n```\n"
+        "The `.collapsed.txt` file can be opened with speedscope or flamegraph.pl.",
+        COLORS["success"]
+    )
+    await ctx.send(embed=embed, files=files)
+
+@bot.command(name="memory")
+async def memory_command(ctx, action: str = None):
+    """Show memory use and cache sizes; `baseline` snapshots allocations, `diff` shows growth since, `stop` ends tracing"""
+    logger.info(f"Memory command executed by {ctx.author}")
+    
+    if not await is_admin(ctx):
+        return await ctx.send(
+            embed=create_embed(
+                "🔒 Access Denied",
+                "You don't have permission to use this command.",
+                COLORS["error"]
+            )
+        )
+    
+    if action == "baseline":
+        await memory_tracker.take_baseline()
+        current, _ = memory_tracker.traced()
+        return await ctx.send(embed=create_embed(
+            "📸 Baseline Taken",
+            f"Tracing allocations ({format_bytes(current)} traced). Run `{ctx.prefix}memory diff` later to see what grew.",
+            COLORS["success"]
+        ))
+    
+    if action == "diff":
+        if memory_tracker.baseline is None:
+            raise commands.BadArgument(f"Take a baseline first with `{ctx.prefix}memory baseline`")
+        stats = await memory_tracker.diff(10)
+        lines = [
+            f"{format_bytes(stat.size_diff):>10} {stat.count_diff:+7} blocks  "
+            f"{stat.traceback[0].filename.rsplit(os.sep, 1)[-1]}:{stat.traceback[0].lineno}"
+            for stat in stats
+        ]
+        return await ctx.send(embed=create_embed(
+            "📈 Allocation Growth Since Baseline",
+            f"```\n{chr(10).join(lines) or 'No growth'}\n```"[:4000],
+            COLORS["info"]
+        ))
+    
+    if action == "stop":
+        memory_tracker.stop()
+        return await ctx.send(embed=create_embed("✅ Tracing Stopped", "tracemalloc stopped and the baseline dropped.", COLORS["success"]))
+    
+    if action is not None:
+        raise commands.BadArgument("Use baseline, diff or stop")
+    
+    report = cache_report(bot, CACHE_POLICY, user_cache)
+    embed = create_embed("🧮 Memory", f"**RSS:** {format_bytes(rss_bytes())}", COLORS["admin"])
+    if bot.ready_after is not None:
+        embed.description += f"\n**Ready after:** {bot.ready_after:.2f}s"
+    embed.add_field(
+        name="discord.py Caches",
+        value=f"**Guilds:** {report['guilds']}\n**Users:** {report['users']}\n**Members:** {report['members']}\n"
+              f"**Messages:** {report['messages']} / {report['max_messages'] or 'disabled'}",
+        inline=False
+    )
+    embed.add_field(
+        name="Our Caches",
+        value=f"**User LRU:** {len(user_cache)} / {user_cache.maxsize}\n**Guild configs:** {len(guild_configs)}\n"
+              f"**Buffered order events:** {len(order_event_log)}\n**Pending orders:** {len(pending_index)}\n"
+              f"**Query shapes:** {len(query_log.query_log.stats)}\n"
+              f"**Recorded stalls:** {len(loop_watchdog.stalls)}",
+        inline=False
+    )
+    if memory_tracker.tracing:
+        current, peak = memory_tracker.traced()
+        tracing = f"On, {format_bytes(current)} traced (peak {format_bytes(peak)})"
+        if memory_tracker.baseline is None:
+            tracing += f"\nNo baseline; run `{ctx.prefix}memory baseline`"
+    else:
+        tracing = f"Off; `{ctx.prefix}memory baseline` starts it"
+    embed.add_field(name="tracemalloc", value=tracing, inline=False)
+    await ctx.send(embed=embed)
+
+@bot.command(name="search")
+async def search_command(ctx, *, terms: str):
+    """Search item names and descriptions"""
+    logger.info(f"Search command executed by {ctx.author}: {terms}")
+    
+    try:
+        results = await search.search_items(DB_PATH, terms)
+    except aiosqlite.OperationalError as e:
+        logger.error(f"Search failed: {e}")
+        return await ctx.send(embed=create_embed("❌ Search Unavailable", "Item search isn't available right now.", COLORS["error"]))
+    
+    if not results:
+        return await ctx.send(embed=create_embed("🔍 No Results", f"No items match **{discord.utils.escape_markdown(terms)}**.", COLORS["warning"]))
+    
+    embed = create_embed("🔍 Search Results", f"{len(results)} items matching **{discord.utils.escape_markdown(terms)}**", COLORS["info"])
+    for item_id, name, price_cents, stock, name_highlight, snippet in results:
+        stock_text = f"{stock} in stock" if stock else "Out of stock"
+        embed.add_field(
+            name=f"{name} · {money.usd(price_cents)}"[:256],
+            value=f"{name_highlight}\n{snippet or 'No description'}\n*{stock_text}* · `{ctx.prefix}buy {name}`"[:1024],
+            inline=False
+        )
+    await ctx.send(embed=embed)
+
+@bot.command(name="jobs")
+async def jobs_command(ctx):
+    """Show background jobs by kind and status"""
+    logger.info(f"Jobs command executed by {ctx.author}")
+    
+    if not await is_admin(ctx):
+        return await ctx.send(
+            embed=create_embed(
+                "🔒 Access Denied",
+                "You don't have permission to use this command.",
+                COLORS["error"]
+            )
+        )
+    
+    counts = await jobs.stats(DB_PATH)
+    kinds = sorted({kind for kind, _ in counts})
+    embed = create_embed(
+        "🛠️ Background Jobs",
+        f"**Worker processes:** {worker_pool.processes or 'none, jobs run in the bot'}\n**Results applied:** {job_results.applied}",
+        COLORS["admin"]
+    )
+    for kind in kinds:
+        embed.add_field(
+            name=kind,
+            value="\n".join(
+                f"**{status.capitalize()}:** {counts.get((kind, status), 0)}"
+                for status in (jobs.QUEUED, jobs.RUNNING, jobs.DONE, jobs.FAILED)
+            ),
+            inline=True
+        )
+    if not kinds:
+        embed.description += "\n\nNo jobs recorded."
+    await ctx.send(embed=embed)
+
+@bot.command(name="schedule")
+async def schedule_command(ctx, action: str = None, name: str = None):
+    """Show periodic jobs with their next run and run durations; `run <name>` runs one now"""
+    logger.info(f"Schedule command executed by {ctx.author}")
+    
+    if not await is_admin(ctx):
+        return await ctx.send(
+            embed=create_embed(
+                "🔒 Access Denied",
+                "You don't have permission to use this command.",
+                COLORS["error"]
+            )
+        )
+    
+    if action == "run":
+        if name not in periodic.jobs:
+            raise commands.BadArgument(f"Unknown job, choose from {', '.join(periodic.jobs)}")
+        periodic.run_now(name)
+        return await ctx.send(embed=create_embed("▶️ Job Started", f"Running **{name}** now.", COLORS["success"]))
+    if action is not None:
+        raise commands.BadArgument("Use `run <name>`")
+    
+    embed = create_embed("⏱️ Scheduled Jobs", "Durations are in seconds.", COLORS["admin"])
+    now = datetime.now().timestamp()
+    for job in periodic.jobs.values():
+        next_run = f"in {max(0, job.next_run - now):.0f}s" if job.next_run is not None else "not scheduled"
+        recent = ", ".join(f"{duration:.2f}" for duration in list(job.durations)[-5:]) or "none yet"
+        value = (
+            f"**Every:** {job.interval:g}s · **Next:** {next_run} · **Running:** {job.running}/{job.max_concurrency}\n"
+            f"**Runs:** {job.runs} · **Failures:** {job.failures} · **Skipped:** {job.skipped}\n"
+            f"**Last:** {job.last_duration or 0:.2f} · **Mean:** {job.mean_duration:.2f} · **Max:** {job.max_duration:.2f}\n"
+            f"**Recent:** {recent}"
+        )
+        if job.last_error:
+            value += f"\n**Last error:** {job.last_error[:200]}"
+        embed.add_field(name=f"{job.name} ({job.catch_up} catch-up)", value=value, inline=False)
+    await ctx.send(embed=embed)
+
+@bot.command(name="dmstatus")
+async def dm_status_command(ctx, action: str = None, user: discord.User = None):
+    """Show users whose DMs fail and the requests saved; `clear @user` retries them now"""
+    logger.info(f"DM status command executed by {ctx.author}")
+    
+    if not await is_admin(ctx):
+        return await ctx.send(
+            embed=create_embed(
+                "🔒 Access Denied",
+                "You don't have permission to use this command.",
+                COLORS["error"]
+            )
+        )
+    
+    if action == "clear":
+        if user is None:
+            raise commands.BadArgument("Mention the user to clear")
+        await dm_statuses.clear(user.id)
+        # Bring postponed deliveries forward
+        async with query_log.connect(DB_PATH) as db:
+            await db.execute(
+                "UPDATE deliveries SET next_attempt_at = CURRENT_TIMESTAMP WHERE user_id = ? AND status = ?",
+                (user.id, delivery_queue.QUEUED)
+            )
+            await db.commit()
+        delivery_worker.notify()
+        return await ctx.send(embed=create_embed("✅ DM Status Cleared", f"DMs to {user.mention} will be tried again.", COLORS["success"]))
+    if action is not None:
+        raise commands.BadArgument("Use `clear @user`")
+    
+    embed = create_embed(
+        "📪 Undeliverable DMs",
+        f"**Users:** {len(dm_statuses)}\n**Requests saved:** {dm_statuses.saved}\n"
+        f"**Closed DMs:** {dm_statuses.forbidden} · **Unknown users:** {dm_statuses.not_found}\n"
+        f"**Channel fallbacks:** {dm_statuses.fallbacks} · **Recovered:** {dm_statuses.recovered}\n"
+        f"**Outbox messages postponed:** {outbox_dispatcher.postponed}",
+        COLORS["admin"]
+    )
+    await ctx.send(embed=embed)
+
+# Registered in load_extensions(), after the cogs
+@commands.command(name="orders")
+async def orders_command(ctx):
+    """View your past and pending orders"""
+    logger.info(f"Orders command executed by {ctx.author}")
+    view = order_pages.OrderPages(
+        DB_PATH, ctx.author.id, "🧾 Your Orders",
+        lambda title, description: create_embed(title, description, COLORS["info"]),
+        user_id=ctx.author.id
+    )
+    await view.send(ctx)
+
+@commands.command(name="confirm")
+async def confirm_payment(ctx, confirmation_key: str):
+    """Tell the admins you've sent the payment for an order"""
+    logger.info(f"Confirm command executed by {ctx.author}")
+    order = await pending_index.find_key(confirmation_key)
+    if order is None or order.user_id != ctx.author.id:
+        return await ctx.send(
+            embed=create_embed(
+                "❌ Order Not Found",
+                "None of your orders awaiting payment has that confirmation key.",
+                COLORS["error"]
+            )
+        )
+    
+    async with query_log.connect(DB_PATH) as db:
+        confirmed = await order_states.transition(db, order.id, order_states.CONFIRMED, [order_states.PENDING])
+        await db.commit()
+    pending_index.discard(order.id)
+    if not confirmed:
+        return await ctx.send(
+            embed=create_embed(
+                "ℹ️ Already Updated",
+                f"Order **#{order.id}** is no longer awaiting payment.",
+                COLORS["info"]
+            )
+        )
+    order_event_log.record(order.id, "confirmed", order_states.CONFIRMED)
+    await ctx.send(
+        embed=create_embed(
+            "✅ Payment Submitted",
+            f"Thanks! An admin will verify your payment for order **#{order.id}** and deliver it shortly.",
+            COLORS["success"]
+        )
+    )
+
+@commands.command(name="vieworders")
+async def view_orders(ctx, status: str = None):
+    """List all orders, optionally only those with a status"""
+    logger.info(f"View orders command executed by {ctx.author}")
+    
+    if not await is_admin(ctx):
+        return await ctx.send(
+            embed=create_embed(
+                "🔒 Access Denied",
+                "You don't have permission to use this command.",
+                COLORS["error"]
+            )
+        )
+    
+    view = order_pages.OrderPages(
+        DB_PATH, ctx.author.id, f"📋 {status.capitalize()} Orders" if status else "📋 All Orders",
+        lambda title, description: create_embed(title, description, COLORS["admin"]),
+        status=status.lower() if status else None
+    )
+    await view.send(ctx)
+
 if __name__ == "__main__":
+    if "--diagnostics" in sys.argv[1:]:
+        STARTUP_DIAGNOSTICS = True
+    configure_logging()
     asyncio.run(main()) 
\ No newline at end of file
@@ -0,0 +1,84 @@
+import os
+import asyncio
+import resource
+import tracemalloc
+
+# Allocations made by tracemalloc itself and by imports aren't interesting for leaks
+_IGNORED = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+def rss_bytes():
+    """Current resident set size, or the peak RSS where /proc isn't available"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+
+def format_bytes(size):
+    for unit in ("B", "KiB", "MiB"):
+        if abs(size) < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
+
+
+class MemoryTracker:
+    """tracemalloc snapshots diffed against a stored baseline
+
+    Tracing slows allocation down and uses memory of its own, so it only
+    runs between start() and stop().
+    """
+
+    def __init__(self, frames=1):
+        self.frames = frames
+        self.baseline = None
+
+    @property
+    def tracing(self):
+        return tracemalloc.is_tracing()
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+
+    def stop(self):
+        self.baseline = None
+        tracemalloc.stop()
+
+    def _snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces(_IGNORED)
+
+    async def take_baseline(self):
+        """Start tracing if needed and store a snapshot to diff against"""
+        self.start()
+        loop = asyncio.get_running_loop()
+        self.baseline = await loop.run_in_executor(None, self._snapshot)
+        return self.baseline
+
+    def _diff(self, limit):
+        snapshot = self._snapshot()
+        stats = snapshot.compare_to(self.baseline, "lineno")
+        return [stat for stat in stats if stat.size_diff][:limit]
+
+    async def diff(self, limit=10):
+        """Lines whose allocations grew the most since the baseline"""
+        if self.baseline is None:
+            raise RuntimeError("No baseline snapshot; take one first")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._diff, limit)
+
+    def traced(self):
+        """(current, peak) bytes allocated since tracing started"""
+        return tracemalloc.get_traced_memory()
@@ -0,0 +1,223 @@
+import logging
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+logger = logging.getLogger("shop_bot")
+
+# Currency -> number of decimal places of its minor unit
+USD = "USD"    # cents
+LTC = "LTC"    # litoshis
+DECIMALS = {USD: 2, LTC: 8}
+CENTS_PER_DOLLAR = 10 ** DECIMALS[USD]
+LITOSHIS_PER_LTC = 10 ** DECIMALS[LTC]
+
+# (table, legacy REAL column, integer minor-unit column, minor units per whole unit)
+COLUMNS = (
+    ("items", "price", "price_cents", CENTS_PER_DOLLAR),
+    ("orders", "total_price", "total_cents", CENTS_PER_DOLLAR),
+    ("orders", "ltc_amount", "ltc_litoshis", LITOSHIS_PER_LTC),
+)
+
+
+def to_minor(value, currency=USD):
+    """Exact minor units of a decimal amount given as a str, int, float or Decimal
+
+    Floats go through their shortest repr, so 19.99 becomes 1999 and not
+    1998. Rounds half up to the currency's precision.
+    """
+    try:
+        amount = Decimal(str(value).strip().lstrip("$"))
+    except InvalidOperation:
+        raise ValueError(f"Invalid {currency} amount: {value!r}")
+    if not amount.is_finite():
+        raise ValueError(f"Invalid {currency} amount: {value!r}")
+    return int((amount * 10 ** DECIMALS[currency]).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+class Money:
+    """An amount of USD or LTC held as an integer number of minor units
+
+    Adding and subtracting is exact and only allowed within one currency;
+    multiplying takes an integer (a quantity). Formatting without a spec
+    gives "$12.34" or "0.12345678 LTC"; a numeric spec such as ``:.2f``
+    formats the decimal amount, so existing f-strings keep working.
+    """
+
+    __slots__ = ("minor", "currency")
+
+    def __init__(self, minor, currency=USD):
+        if not isinstance(minor, int):
+            raise TypeError(f"Money needs an integer number of minor units, not {type(minor).__name__}")
+        self.minor = minor
+        self.currency = currency
+
+    @classmethod
+    def usd(cls, cents):
+        return cls(cents, USD)
+
+    @classmethod
+    def ltc(cls, litoshis):
+        return cls(litoshis, LTC)
+
+    @classmethod
+    def parse(cls, text, currency=USD):
+        return cls(to_minor(text, currency), currency)
+
+    @property
+    def amount(self):
+        """The exact decimal amount in whole units"""
+        return Decimal(self.minor).scaleb(-DECIMALS[self.currency])
+
+    def _check(self, other):
+        if not isinstance(other, Money):
+            return NotImplemented
+        if other.currency != self.currency:
+            raise ValueError(f"Can't combine {self.currency} and {other.currency}")
+        return other
+
+    def __add__(self, other):
+        # sum() starts from the integer 0
+        if type(other) is int and other == 0:
+            return self
+        other = self._check(other)
+        if other is NotImplemented:
+            return other
+        return Money(self.minor + other.minor, self.currency)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        other = self._check(other)
+        if other is NotImplemented:
+            return other
+        return Money(self.minor - other.minor, self.currency)
+
+    def __mul__(self, quantity):
+        if not isinstance(quantity, int):
+            return NotImplemented
+        return Money(self.minor * quantity, self.currency)
+
+    __rmul__ = __mul__
+
+    def __neg__(self):
+        return Money(-self.minor, self.currency)
+
+    def __bool__(self):
+        return self.minor != 0
+
+    def __eq__(self, other):
+        if isinstance(other, Money):
+            return self.minor == other.minor and self.currency == other.currency
+        return NotImplemented
+
+    def __hash__(self):
+        return hash((self.minor, self.currency))
+
+    def __lt__(self, other):
+        other = self._check(other)
+        return other if other is NotImplemented else self.minor < other.minor
+
+    def __le__(self, other):
+        other = self._check(other)
+        return other if other is NotImplemented else self.minor <= other.minor
+
+    def __gt__(self, other):
+        other = self._check(other)
+        return other if other is NotImplemented else self.minor > other.minor
+
+    def __ge__(self, other):
+        other = self._check(other)
+        return other if other is NotImplemented else self.minor >= other.minor
+
+    def __str__(self):
+        if self.currency == USD:
+            return f"-${-self.amount}" if self.minor < 0 else f"${self.amount}"
+        return f"{self.amount} {self.currency}"
+
+    def __format__(self, spec):
+        return format(self.amount, spec) if spec else str(self)
+
+    def __repr__(self):
+        return f"Money({self.minor}, {self.currency!r})"
+
+
+def usd(cents):
+    """Money for a cents column that may be NULL"""
+    return None if cents is None else Money(cents, USD)
+
+
+def ltc(litoshis):
+    """Money for a litoshis column that may be NULL"""
+    return None if litoshis is None else Money(litoshis, LTC)
+
+
+def _sql_to_minor(column, scale):
+    """SQL for the integer minor units of a REAL column, rounded like to_minor()
+
+    ROUND(x * 100) rounds the binary product, so 1.005 (stored as
+    1.00499999...) gives 100 where to_minor gives 101. printf rounds the
+    decimal digits half up, which agrees with to_minor on prices.
+    """
+    places = len(str(scale)) - 1
+    return f"CAST(REPLACE(printf('%.{places}f', {column}), '.', '') AS INTEGER)"
+
+
+def _sync_triggers(table, real, minor, scale):
+    """Triggers that keep a legacy REAL column and its integer column equal
+
+    The integer column is authoritative. Writers that still only set the
+    REAL column (older cogs and scripts) get the integer column filled in,
+    and integer writes are mirrored back to the REAL column.
+    """
+    from_real = _sql_to_minor(f"NEW.{real}", scale)
+    to_real = f"NEW.{minor} / {float(scale)}"
+    name = f"{table}_{minor}"
+    return (
+        f'''CREATE TRIGGER IF NOT EXISTS {name}_insert AFTER INSERT ON {table}
+        WHEN NEW.{minor} IS NULL AND NEW.{real} IS NOT NULL BEGIN
+            UPDATE {table} SET {minor} = {from_real} WHERE rowid = NEW.rowid;
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS {name}_insert_real AFTER INSERT ON {table}
+        WHEN NEW.{minor} IS NOT NULL BEGIN
+            UPDATE {table} SET {real} = {to_real} WHERE rowid = NEW.rowid;
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS {name}_update AFTER UPDATE OF {real} ON {table}
+        WHEN NEW.{minor} IS OLD.{minor} AND NEW.{real} IS NOT OLD.{real} BEGIN
+            UPDATE {table} SET {minor} = {from_real} WHERE rowid = NEW.rowid;
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS {name}_update_real AFTER UPDATE OF {minor} ON {table}
+        WHEN NEW.{minor} IS NOT OLD.{minor} BEGIN
+            UPDATE {table} SET {real} = {to_real} WHERE rowid = NEW.rowid;
+        END''',
+    )
+
+
+async def migrate(db):
+    """Add the integer money columns, backfill them and keep the REAL columns in sync
+
+    Safe to run on every start: columns and triggers are only created once
+    and the backfill only touches rows whose integer column is still NULL.
+    The backfill converts with to_minor() itself, so existing rows follow
+    exactly the rule new amounts do.
+    """
+    for table, real, minor, scale in COLUMNS:
+        async with db.execute(f"PRAGMA table_info({table})") as cursor:
+            columns = {row[1] for row in await cursor.fetchall()}
+        if minor not in columns:
+            logger.info(f"Adding {table}.{minor}")
+            await db.execute(f"ALTER TABLE {table} ADD COLUMN {minor} INTEGER")
+        currency = USD if scale == CENTS_PER_DOLLAR else LTC
+        async with db.execute(
+            f"SELECT rowid, {real} FROM {table} WHERE {minor} IS NULL AND {real} IS NOT NULL"
+        ) as cursor:
+            rows = await cursor.fetchall()
+        updates = []
+        for rowid, value in rows:
+            try:
+                updates.append((to_minor(value, currency), rowid))
+            except ValueError:
+                logger.warning(f"Not backfilling {table}.{minor} for row {rowid}, {real} is {value!r}")
+        if updates:
+            await db.executemany(f"UPDATE {table} SET {minor} = ? WHERE rowid = ?", updates)
+            logger.info(f"Backfilled {len(updates)} rows of {table}.{minor}")
+        for trigger in _sync_triggers(table, real, minor, scale):
+            await db.execute(trigger)
@@ -0,0 +1,244 @@
+import hmac
+import math
+import time
+import asyncio
+import ipaddress
+import logging
+
+from aiohttp import web
+
+import query_log
+import order_states
+import delivery_queue
+
+logger = logging.getLogger("shop_bot")
+
+# Limits for one admin API request
+MAX_BATCH = 500
+DB_CHECK_TIMEOUT = 2
+
+
+class Monitor:
+    """HTTP health checks and a JSON admin API served on the bot's event loop
+
+    ``/healthz`` answers as long as the event loop does, so a hung process
+    gets restarted. ``/readyz`` is 200 only while the gateway is connected
+    and the database answers. The ``/admin`` routes need
+    ``Authorization: Bearer <token>``, are disabled when no token is set and
+    only accept requests from loopback addresses unless ``allow_remote``.
+    """
+
+    def __init__(self, bot, db_path, token=None, allow_remote=False, confirmation=None, on_catalog_change=None):
+        self.bot = bot
+        self.db_path = db_path
+        self.token = token
+        self.allow_remote = allow_remote
+        self.confirmation = confirmation
+        self.on_catalog_change = on_catalog_change
+        self.started = time.time()
+        self._runner = None
+
+        self.app = web.Application(middlewares=[self._admin_guard])
+        self.app.add_routes([
+            web.get("/", self.healthz),
+            web.get("/healthz", self.healthz),
+            web.get("/readyz", self.readyz),
+            web.get("/admin/orders", self.list_orders),
+            web.post("/admin/orders/approve", self.approve_orders),
+            web.post("/admin/orders/cancel", self.cancel_orders),
+            web.get("/admin/stock", self.list_stock),
+            web.post("/admin/stock", self.update_stock),
+            web.get("/admin/bans", self.list_bans),
+            web.post("/admin/bans", self.update_bans),
+        ])
+
+    async def start(self, host, port):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info(f"Monitor listening on {host}:{port}, admin API {'enabled' if self.token else 'disabled'}")
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    @web.middleware
+    async def _admin_guard(self, request, handler):
+        if not request.path.startswith("/admin"):
+            return await handler(request)
+        if not self.token:
+            raise web.HTTPNotFound()
+        if not self.allow_remote and not _is_loopback(request.remote):
+            raise web.HTTPForbidden(text="The admin API only accepts local requests")
+        supplied = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(supplied.encode(), f"Bearer {self.token}".encode()):
+            raise web.HTTPUnauthorized(headers={"WWW-Authenticate": "Bearer"})
+        try:
+            return await handler(request)
+        except KeyError as e:
+            return web.json_response({"error": f"Bad request: missing field {e}"}, status=400)
+        except (TypeError, ValueError, order_states.InvalidTransition) as e:
+            return web.json_response({"error": f"Bad request: {e}"}, status=400)
+
+    # Health
+
+    async def healthz(self, request):
+        return web.json_response({"status": "ok", "uptime": round(time.time() - self.started)})
+
+    async def readyz(self, request):
+        checks = {
+            "gateway": self.bot.is_ready() and not self.bot.is_closed(),
+            "heartbeat": math.isfinite(self.bot.latency),
+            "database": await self._database_ok(),
+        }
+        ready = all(checks.values())
+        body = {"status": "ready" if ready else "unavailable", "checks": checks}
+        if checks["heartbeat"]:
+            body["latency_ms"] = round(self.bot.latency * 1000)
+        return web.json_response(body, status=200 if ready else 503)
+
+    async def _database_ok(self):
+        async def ping():
+            async with query_log.connect(self.db_path) as db:
+                async with db.execute("SELECT 1") as cursor:
+                    return await cursor.fetchone() == (1,)
+        try:
+            return await asyncio.wait_for(ping(), DB_CHECK_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"Readiness check could not reach the database: {e}")
+            return False
+
+    # Orders
+
+    async def list_orders(self, request):
+        status = request.query.get("status", order_states.PENDING)
+        limit = min(int(request.query.get("limit", 100)), MAX_BATCH)
+        async with query_log.connect(self.db_path) as db:
+            async with db.execute(
+                "SELECT id, user_id, item_id, quantity, total_cents, ltc_litoshis, status, guild_id, created_at "
+                "FROM orders WHERE status = ? ORDER BY created_at DESC, id DESC LIMIT ?",
+                (status, limit)
+            ) as cursor:
+                columns = [column[0] for column in cursor.description]
+                rows = await cursor.fetchall()
+        return web.json_response({"orders": [dict(zip(columns, row)) for row in rows]})
+
+    async def approve_orders(self, request):
+        """Same as s!approvebatch: {"order_ids": [...], "message": "..."}"""
+        body = await _json_body(request)
+        order_ids = _ids(body["order_ids"])
+        approved = await delivery_queue.approve_orders(
+            self.db_path, order_ids, body.get("message"), self.confirmation, events=self.bot.order_events,
+            pending=self.bot.pending_orders
+        )
+        self.bot.delivery_worker.notify()
+        self.bot.outbox_dispatcher.notify()
+        logger.info(f"Admin API approved {len(approved)} of {len(order_ids)} orders")
+        return web.json_response({"approved": approved, "skipped": sorted(set(order_ids) - set(approved))})
+
+    async def cancel_orders(self, request):
+        """{"order_ids": [...]}; only pending and confirmed orders can be cancelled"""
+        order_ids = _ids((await _json_body(request))["order_ids"])
+        async with query_log.connect(self.db_path) as db:
+            await db.execute("BEGIN IMMEDIATE")
+            cancelled = await order_states.transition_many(db, order_ids, order_states.CANCELLED)
+            await db.commit()
+        self.bot.pending_orders.discard_many(cancelled)
+        for order_id in cancelled:
+            self.bot.order_events.record(order_id, "cancelled", order_states.CANCELLED, source="admin_api")
+        logger.info(f"Admin API cancelled {len(cancelled)} of {len(order_ids)} orders")
+        return web.json_response({"cancelled": cancelled, "skipped": sorted(set(order_ids) - set(cancelled))})
+
+    # Stock
+
+    async def list_stock(self, request):
+        async with query_log.connect(self.db_path) as db:
+            async with db.execute("SELECT id, name, price_cents, stock FROM items ORDER BY id") as cursor:
+                rows = await cursor.fetchall()
+        return web.json_response({"items": [
+            {"id": item_id, "name": name, "price_cents": price_cents, "stock": stock}
+            for item_id, name, price_cents, stock in rows
+        ]})
+
+    async def update_stock(self, request):
+        """{"items": [{"id": 1, "stock": 10}, {"id": 2, "delta": -1}, ...]}, applied in one transaction"""
+        changes = (await _json_body(request))["items"]
+        if not isinstance(changes, list) or len(changes) > MAX_BATCH:
+            raise ValueError(f"items must be a list of at most {MAX_BATCH} changes")
+        updated, missing = [], []
+        async with query_log.connect(self.db_path) as db:
+            await db.execute("BEGIN IMMEDIATE")
+            for change in changes:
+                item_id = int(change["id"])
+                if "stock" in change:
+                    cursor = await db.execute(
+                        "UPDATE items SET stock = ? WHERE id = ?", (max(int(change["stock"]), 0), item_id)
+                    )
+                else:
+                    cursor = await db.execute(
+                        "UPDATE items SET stock = MAX(stock + ?, 0) WHERE id = ?", (int(change["delta"]), item_id)
+                    )
+                (updated if cursor.rowcount else missing).append(item_id)
+            await db.commit()
+        if updated and self.on_catalog_change:
+            await self.on_catalog_change()
+        logger.info(f"Admin API updated stock of {len(updated)} items")
+        return web.json_response({"updated": updated, "missing": missing})
+
+    # Bans
+
+    async def list_bans(self, request):
+        async with query_log.connect(self.db_path) as db:
+            async with db.execute("SELECT user_id, banned_at, reason FROM banned_users ORDER BY banned_at") as cursor:
+                rows = await cursor.fetchall()
+        return web.json_response({"bans": [
+            {"user_id": user_id, "banned_at": banned_at, "reason": reason} for user_id, banned_at, reason in rows
+        ]})
+
+    async def update_bans(self, request):
+        """{"ban": [user IDs], "unban": [user IDs], "reason": "..."}"""
+        body = await _json_body(request)
+        ban = _ids(body.get("ban", []), required=False)
+        unban = _ids(body.get("unban", []), required=False)
+        async with query_log.connect(self.db_path) as db:
+            await db.executemany(
+                "INSERT OR REPLACE INTO banned_users (user_id, reason) VALUES (?, ?)",
+                [(user_id, body.get("reason")) for user_id in ban]
+            )
+            await db.executemany("DELETE FROM banned_users WHERE user_id = ?", [(user_id,) for user_id in unban])
+            await db.commit()
+        logger.info(f"Admin API banned {len(ban)} and unbanned {len(unban)} users")
+        return web.json_response({"banned": ban, "unbanned": unban})
+
+
+def _is_loopback(address):
+    try:
+        return ipaddress.ip_address(address).is_loopback
+    except (TypeError, ValueError):
+        return False
+
+
+async def _json_body(request):
+    try:
+        body = await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(text="Request body must be JSON")
+    if not isinstance(body, dict):
+        raise web.HTTPBadRequest(text="Request body must be a JSON object")
+    return body
+
+
+def _ids(values, required=True):
+    if not isinstance(values, list) or len(values) > MAX_BATCH:
+        raise ValueError(f"expected a list of at most {MAX_BATCH} IDs")
+    if required and not values:
+        raise ValueError("no IDs given")
+    return list(dict.fromkeys(int(value) for value in values))
+
+
+async def run_monitor(bot, db_path, host="0.0.0.0", port=8080, **options):
+    """Start a Monitor on the running event loop; the caller stops it"""
+    monitor = Monitor(bot, db_path, **options)
+    await monitor.start(host, port)
+    return monitor
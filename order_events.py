@@ -0,0 +1,292 @@
+import sys
+import json
+import sqlite3
+import asyncio
+import logging
+from datetime import datetime
+
+import query_log
+from money import to_minor
+
+logger = logging.getLogger("shop_bot")
+
+# Statuses after which an order never changes again
+TERMINAL_STATUSES = ("delivered", "cancelled", "refunded")
+# Statuses that count as a sale
+SALE_STATUSES = ("paid", "delivered", "completed")
+
+
+def utc_timestamp():
+    """Current time in the same format as SQLite's CURRENT_TIMESTAMP"""
+    return datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+
+
+async def create_table(db):
+    await db.execute('''
+    CREATE TABLE IF NOT EXISTS order_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        order_id INTEGER NOT NULL,
+        event TEXT NOT NULL,
+        status TEXT,
+        data TEXT,
+        created_at TIMESTAMP NOT NULL
+    )
+    ''')
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_order_events_order ON order_events (order_id, id)"
+    )
+
+    # Seed the log with a snapshot of every existing order the first time
+    async with db.execute("SELECT 1 FROM order_events LIMIT 1") as cursor:
+        has_events = await cursor.fetchone() is not None
+    if not has_events:
+        cursor = await db.execute('''
+        INSERT INTO order_events (order_id, event, status, data, created_at)
+        SELECT id, 'snapshot', status,
+               json_object('user_id', user_id, 'item_id', item_id, 'quantity', quantity,
+                           'total_cents', total_cents, 'ltc_litoshis', ltc_litoshis,
+                           'created_at', created_at, 'paid_at', paid_at, 'delivered_at', delivered_at),
+               COALESCE(created_at, CURRENT_TIMESTAMP)
+        FROM orders ORDER BY id
+        ''')
+        if cursor.rowcount:
+            logger.info(f"Seeded order event log with {cursor.rowcount} existing orders")
+
+
+class EventLog:
+    """Buffered writer for the append-only order event log
+
+    record() only appends to an in-memory buffer. The buffer is written
+    with a single executemany when it reaches max_buffer events or every
+    flush_interval seconds, and on stop().
+    """
+
+    def __init__(self, db_path, flush_interval=5, max_buffer=100):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self._buffer = []
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+        self.flushed = 0
+        self.flushes = 0
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def record(self, order_id, event, status=None, **data):
+        """Append an event; it is written on the next flush"""
+        self._buffer.append((order_id, event, status, json.dumps(data) if data else None, utc_timestamp()))
+        if len(self._buffer) >= self.max_buffer:
+            asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        """Write every buffered event in one transaction"""
+        async with self._flush_lock:
+            if not self._buffer:
+                return 0
+            events, self._buffer = self._buffer, []
+            try:
+                async with query_log.connect(self.db_path) as db:
+                    await db.executemany(
+                        "INSERT INTO order_events (order_id, event, status, data, created_at) VALUES (?, ?, ?, ?, ?)",
+                        events
+                    )
+                    await db.commit()
+            except Exception as e:
+                # Put the events back so the next flush retries them
+                logger.error(f"Failed to flush {len(events)} order events: {e}")
+                self._buffer[:0] = events
+                return 0
+            self.flushed += len(events)
+            self.flushes += 1
+            return len(events)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="order-event-flusher")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+
+def fold_events(rows):
+    """Fold (order_id, event, status, data, created_at) rows into per-order state"""
+    orders = {}
+    for order_id, event, status, data, created_at in rows:
+        data = json.loads(data) if data else {}
+        if event == "snapshot":
+            state = orders[order_id] = dict(data)
+        else:
+            state = orders.setdefault(order_id, {})
+            state.update(data)
+        if status:
+            state["status"] = status
+        if event == "created" and not state.get("created_at"):
+            state["created_at"] = created_at
+        elif event == "paid" and not state.get("paid_at"):
+            state["paid_at"] = created_at
+        elif event == "delivered":
+            state["delivered_at"] = created_at
+    return orders
+
+
+def sales_aggregates(orders):
+    """Daily order count and revenue in integer cents for orders that count as sales
+
+    Events written before amounts were stored as integers carry a float
+    total_price instead, which is converted exactly.
+    """
+    days = {}
+    for state in orders.values():
+        if state.get("status") not in SALE_STATUSES:
+            continue
+        timestamp = state.get("paid_at") or state.get("created_at")
+        if not timestamp:
+            continue
+        day = timestamp[:10]
+        cents = state.get("total_cents")
+        if cents is None:
+            cents = to_minor(state["total_price"]) if state.get("total_price") is not None else 0
+        count, revenue = days.get(day, (0, 0))
+        days[day] = (count + 1, revenue + cents)
+    return days
+
+
+def replay(db_path, apply=False):
+    """Compare order statuses with the event log; with ``apply``, rebuild them and sales_daily
+
+    The log is not a complete record. Events are buffered for a few
+    seconds after the order's own commit, and status changes made by cogs
+    emit none. Applying therefore reverts any order whose later events are
+    missing. Only statuses are compared and written back: event times are
+    taken when the buffer is written, not when the order's row changed, so
+    paid_at and delivered_at in orders stay authoritative. Returns (orders
+    replayed, changes, days of sales); each change is (order_id, current
+    status, replayed status).
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute(
+            "SELECT order_id, event, status, data, created_at FROM order_events ORDER BY id"
+        )
+        orders = fold_events(rows)
+        days = sales_aggregates(orders)
+
+        current = dict(conn.execute("SELECT id, status FROM orders"))
+        changes = []
+        for order_id, state in orders.items():
+            replayed = state.get("status")
+            if current.get(order_id) != replayed:
+                changes.append((order_id, current.get(order_id), replayed))
+
+        if apply:
+            with conn:
+                conn.executemany(
+                    "UPDATE orders SET status = ? WHERE id = ?",
+                    [(replayed, order_id) for order_id, _, replayed in changes]
+                )
+                # Rebuilt from scratch, which also replaces the old REAL revenue column
+                conn.execute("DROP TABLE IF EXISTS sales_daily")
+                conn.execute('''
+                CREATE TABLE sales_daily (
+                    day TEXT PRIMARY KEY,
+                    orders INTEGER NOT NULL,
+                    revenue_cents INTEGER NOT NULL
+                )
+                ''')
+                conn.executemany(
+                    "INSERT INTO sales_daily (day, orders, revenue_cents) VALUES (?, ?, ?)",
+                    [(day, count, revenue) for day, (count, revenue) in sorted(days.items())]
+                )
+        return len(orders), changes, len(days)
+    finally:
+        conn.close()
+
+
+def compact(db_path, older_than_days=30):
+    """Collapse the events of long-finished orders into one snapshot each"""
+    conn = sqlite3.connect(db_path)
+    try:
+        finished = [
+            row[0] for row in conn.execute(
+                f'''
+                SELECT order_id FROM order_events e
+                WHERE id = (SELECT MAX(id) FROM order_events WHERE order_id = e.order_id)
+                AND status IN ({", ".join("?" for _ in TERMINAL_STATUSES)})
+                AND created_at < datetime('now', ?)
+                AND (SELECT COUNT(*) FROM order_events WHERE order_id = e.order_id) > 1
+                ''',
+                (*TERMINAL_STATUSES, f"-{older_than_days} days")
+            )
+        ]
+        if not finished:
+            return 0, 0
+
+        placeholders = ", ".join("?" for _ in finished)
+        rows = conn.execute(
+            f"SELECT order_id, event, status, data, created_at FROM order_events "
+            f"WHERE order_id IN ({placeholders}) ORDER BY id",
+            finished
+        ).fetchall()
+        orders = fold_events(rows)
+        last_seen = {}
+        for order_id, _, _, _, created_at in rows:
+            last_seen[order_id] = created_at
+
+        with conn:
+            conn.execute(f"DELETE FROM order_events WHERE order_id IN ({placeholders})", finished)
+            conn.executemany(
+                "INSERT INTO order_events (order_id, event, status, data, created_at) VALUES (?, 'snapshot', ?, ?, ?)",
+                [(order_id, state.get("status"), json.dumps(state), last_seen[order_id])
+                 for order_id, state in orders.items()]
+            )
+        conn.execute("VACUUM")
+        return len(finished), len(rows)
+    finally:
+        conn.close()
+
+
+def main(argv=None):
+    # Only the command line needs argparse; the bot imports this module too
+    import argparse
+    parser = argparse.ArgumentParser(description="Replay or compact the order event log")
+    parser.add_argument("--db", default="shop_database.db", help="Path to the shop database")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    replay_parser = subparsers.add_parser(
+        "replay", help="Show how order statuses differ from the events; --apply rebuilds them and sales_daily"
+    )
+    replay_parser.add_argument("--apply", action="store_true",
+                               help="Write the replayed statuses back to orders (reverts orders with missing events)")
+    replay_parser.add_argument("--show", type=int, default=20, help="Differences to list (default: 20)")
+    compact_parser = subparsers.add_parser("compact", help="Collapse events of finished orders into snapshots")
+    compact_parser.add_argument("--days", type=int, default=30, help="Only compact orders finished this many days ago")
+    args = parser.parse_args(argv)
+
+    if args.command == "replay":
+        orders, changes, days = replay(args.db, apply=args.apply)
+        for order_id, current, replayed in changes[:args.show]:
+            print(f"#{order_id}: {current} -> {replayed}")
+        if len(changes) > args.show:
+            print(f"... and {len(changes) - args.show} more")
+        if args.apply:
+            print(f"Replayed {orders} orders. Updated {len(changes)} orders and {days} days of sales.")
+        else:
+            print(f"Replayed {orders} orders. {len(changes)} orders differ from the log; nothing changed. "
+                  f"Re-run with --apply to write them back.")
+    else:
+        orders, events = compact(args.db, older_than_days=args.days)
+        print(f"Compacted {events} events of {orders} finished orders into snapshots.")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+from collections import OrderedDict
+
+import discord
+
+import money
+import query_log
+
+PAGE_SIZE = 10
+# Pages kept per view; older ones are fetched again by cursor if revisited
+MAX_CACHED_PAGES = 20
+
+_COLUMNS = (
+    "SELECT o.id, o.user_id, i.name, o.quantity, o.total_cents, o.status, o.created_at "
+    "FROM orders o LEFT JOIN items i ON i.id = o.item_id"
+)
+
+
+async def create_indexes(db):
+    """Indexes matching the (created_at, id) keyset for each way orders are listed"""
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_orders_created ON orders (created_at, id)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders (user_id, created_at, id)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_orders_status_created ON orders (status, created_at, id)")
+
+
+def page_query(user_id=None, status=None, anchor=None, newer=False, limit=PAGE_SIZE):
+    """SQL for one page of orders, newest first, starting after ``anchor``
+
+    ``anchor`` is the (created_at, id) of the last row of the previous page,
+    or of the first row of the next page when paging back (``newer``). The
+    row-value comparison lets SQLite seek straight to it in the index.
+    """
+    conditions, params = [], []
+    if user_id is not None:
+        conditions.append("o.user_id = ?")
+        params.append(user_id)
+    if status is not None:
+        conditions.append("o.status = ?")
+        params.append(status)
+    if anchor is not None:
+        conditions.append(f"(o.created_at, o.id) {'>' if newer else '<'} (?, ?)")
+        params.extend(anchor)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    order = "ASC" if newer else "DESC"
+    # One extra row tells whether there is another page in this direction
+    return f"{_COLUMNS}{where} ORDER BY o.created_at {order}, o.id {order} LIMIT ?", (*params, limit + 1)
+
+
+async def fetch_page(db_path, user_id=None, status=None, anchor=None, newer=False, page_size=PAGE_SIZE):
+    """Return (rows newest first, whether more rows exist in that direction)"""
+    query, params = page_query(user_id, status, anchor, newer, page_size)
+    async with query_log.connect(db_path) as db:
+        async with db.execute(query, params) as cursor:
+            rows = await cursor.fetchall()
+    more = len(rows) > page_size
+    rows = rows[:page_size]
+    if newer:
+        rows.reverse()
+    return rows, more
+
+
+def _key(row):
+    return row[6], row[0]
+
+
+class OrderPages(discord.ui.View):
+    """Previous/next buttons over an order list, paged by (created_at, id) cursor"""
+
+    def __init__(self, db_path, author_id, title, make_embed, user_id=None, status=None,
+                 page_size=PAGE_SIZE, timeout=180):
+        super().__init__(timeout=timeout)
+        self.db_path = db_path
+        self.author_id = author_id
+        self.title = title
+        self.make_embed = make_embed
+        self.user_id = user_id
+        self.status = status
+        self.page_size = page_size
+        self.page = 0
+        # page number -> (rows, whether an older page exists)
+        self.pages = OrderedDict()
+        self.message = None
+
+    async def _load(self, number, anchor=None, newer=False):
+        cached = self.pages.get(number)
+        if cached is not None:
+            self.pages.move_to_end(number)
+            return cached
+        rows, more = await fetch_page(self.db_path, self.user_id, self.status, anchor, newer, self.page_size)
+        # Paging back always lands on a page that has an older one after it
+        entry = (rows, True if newer else more)
+        self.pages[number] = entry
+        if len(self.pages) > MAX_CACHED_PAGES:
+            self.pages.popitem(last=False)
+        return entry
+
+    def render(self):
+        rows, has_older = self.pages[self.page]
+        lines = []
+        for order_id, user_id, item_name, quantity, total_cents, status, created_at in rows:
+            line = f"`#{order_id}` **{item_name or 'Deleted item'}** ×{quantity} · {money.usd(total_cents)} · {status} · {created_at}"
+            if self.user_id is None:
+                line += f" · <@{user_id}>"
+            lines.append(line)
+        embed = self.make_embed(self.title, "\n".join(lines) or "No orders found.")
+        embed.set_footer(text=f"{embed.footer.text} · Page {self.page + 1}", icon_url=embed.footer.icon_url)
+        self.previous_page.disabled = self.page == 0
+        self.next_page.disabled = not has_older
+        return embed
+
+    async def send(self, ctx):
+        await self._load(0)
+        embed = self.render()
+        rows, has_older = self.pages[0]
+        if not has_older:
+            self.stop()
+            return await ctx.send(embed=embed)
+        self.message = await ctx.send(embed=embed, view=self)
+        return self.message
+
+    async def interaction_check(self, interaction):
+        if interaction.user.id != self.author_id:
+            await interaction.response.send_message("Only the person who ran the command can page through it.", ephemeral=True)
+            return False
+        return True
+
+    async def _turn(self, interaction, step):
+        rows, _ = self.pages[self.page]
+        if rows:
+            number = self.page + step
+            await self._load(number, _key(rows[0] if step < 0 else rows[-1]), newer=step < 0)
+        else:
+            # Every order on this page is gone; start again from the newest
+            number = 0
+            self.pages.clear()
+            await self._load(number)
+        self.page = number
+        await interaction.response.edit_message(embed=self.render(), view=self)
+
+    @discord.ui.button(label="◀ Newer", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction, button):
+        await self._turn(interaction, -1)
+
+    @discord.ui.button(label="Older ▶", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction, button):
+        await self._turn(interaction, 1)
+
+    async def on_timeout(self):
+        self.pages.clear()
+        if self.message is not None:
+            try:
+                await self.message.edit(view=None)
+            except discord.HTTPException:
+                pass
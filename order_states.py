@@ -0,0 +1,88 @@
+"""Order status state machine
+
+Status changes made here are checked against TRANSITIONS and applied with
+a compare-and-set UPDATE, so concurrent writers can't both win. The bot's
+own writers use it: s!confirm, payment approval and delivery
+(delivery_queue.py) and the monitor's cancel endpoint. The cog commands
+cancelorder, refund, deliver and approve still write orders.status
+directly, because the cogs are not part of this repository. Those changes
+are not checked, emit no order events and only reach the pending order
+index at its next reconcile.
+"""
+import logging
+
+logger = logging.getLogger("shop_bot")
+
+# Order statuses
+PENDING = "pending"
+CONFIRMED = "confirmed"
+PAID = "paid"
+DELIVERED = "delivered"
+CANCELLED = "cancelled"
+REFUNDED = "refunded"
+
+# Allowed transitions: status -> statuses it may move to
+TRANSITIONS = {
+    PENDING: {CONFIRMED, PAID, CANCELLED},
+    CONFIRMED: {PAID, CANCELLED},
+    PAID: {DELIVERED, REFUNDED},
+    DELIVERED: {REFUNDED},
+    CANCELLED: set(),
+    REFUNDED: set(),
+}
+
+# Extra columns set when an order enters a status
+STATUS_COLUMNS = {
+    CONFIRMED: "payment_confirmed = 1",
+    PAID: "payment_confirmed = 1, paid_at = COALESCE(paid_at, CURRENT_TIMESTAMP)",
+    DELIVERED: "delivered_at = CURRENT_TIMESTAMP",
+}
+
+
+class InvalidTransition(Exception):
+    """Raised when asking for a status change the state machine doesn't allow"""
+
+
+def sources(to_status):
+    """Statuses an order may be in to move to to_status"""
+    if to_status not in TRANSITIONS:
+        raise InvalidTransition(f"Unknown order status '{to_status}'")
+    return sorted(status for status, targets in TRANSITIONS.items() if to_status in targets)
+
+
+def _transition_sql(to_status, from_statuses):
+    allowed = sources(to_status)
+    if from_statuses is not None:
+        invalid = set(from_statuses) - set(allowed)
+        if invalid:
+            raise InvalidTransition(f"Orders can't move from {', '.join(sorted(invalid))} to {to_status}")
+        allowed = sorted(from_statuses)
+
+    columns = STATUS_COLUMNS.get(to_status)
+    assignments = f"status = ?, {columns}" if columns else "status = ?"
+    placeholders = ", ".join("?" for _ in allowed)
+    return f"UPDATE orders SET {assignments} WHERE id = ? AND status IN ({placeholders})", allowed
+
+
+async def transition(db, order_id, to_status, from_statuses=None):
+    """Move an order to to_status if it is currently in an allowed status
+
+    This is a single conditional UPDATE, so of two concurrent transitions
+    on the same order at most one wins. Returns True if this call won.
+    ``from_statuses`` narrows the allowed source statuses. The caller
+    commits.
+    """
+    sql, allowed = _transition_sql(to_status, from_statuses)
+    cursor = await db.execute(sql, (to_status, order_id, *allowed))
+    return cursor.rowcount == 1
+
+
+async def transition_many(db, order_ids, to_status, from_statuses=None):
+    """Apply the same transition to many orders; returns the IDs that won"""
+    sql, allowed = _transition_sql(to_status, from_statuses)
+    won = []
+    for order_id in order_ids:
+        cursor = await db.execute(sql, (to_status, order_id, *allowed))
+        if cursor.rowcount == 1:
+            won.append(order_id)
+    return won
@@ -0,0 +1,19 @@
+import logging
+
+logger = logging.getLogger("shop_bot")
+
+
+async def lock_ltc_amount(db, rate_oracle, order_id, total_cents):
+    """Quote and store the LTC amount for an order created without one
+
+    Only fills in a missing amount, so an amount that is already locked is
+    never changed. Returns the order's amount in litoshis; the caller commits.
+    """
+    ltc_litoshis = await rate_oracle.quote_litoshis(total_cents)
+    await db.execute(
+        "UPDATE orders SET ltc_litoshis = ? WHERE id = ? AND ltc_litoshis IS NULL",
+        (ltc_litoshis, order_id)
+    )
+    async with db.execute("SELECT ltc_litoshis FROM orders WHERE id = ?", (order_id,)) as cursor:
+        row = await cursor.fetchone()
+    return row[0] if row else ltc_litoshis
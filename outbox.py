@@ -0,0 +1,195 @@
+import json
+import asyncio
+import logging
+
+import query_log
+import discord
+
+logger = logging.getLogger("shop_bot")
+
+# Outbox statuses
+PENDING = "pending"
+SENT = "sent"
+FAILED = "failed"
+
+
+async def create_table(db):
+    await db.execute('''
+    CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        order_id INTEGER,
+        payload TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        available_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_error TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        sent_at TIMESTAMP
+    )
+    ''')
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, available_at)"
+    )
+    # Messages to blocked users used to be dropped as 'undeliverable'; queue them again
+    cursor = await db.execute("UPDATE outbox SET status = ? WHERE status = 'undeliverable'", (PENDING,))
+    if cursor.rowcount:
+        logger.info(f"Requeued {cursor.rowcount} outbox messages previously marked undeliverable")
+
+
+async def add(db, user_id, kind, embed, order_id=None):
+    """Queue a DM to a user inside the caller's transaction
+
+    The message is only sent once the caller commits, so it can never
+    disagree with the state change it belongs to.
+    """
+    await db.execute(
+        "INSERT INTO outbox (user_id, kind, order_id, payload) VALUES (?, ?, ?, ?)",
+        (user_id, kind, order_id, json.dumps({"embed": embed.to_dict()}))
+    )
+
+
+class OutboxDispatcher:
+    """Drain the outbox in batches, pacing sends and backing off on rate limits"""
+
+    def __init__(self, bot, db_path, batch_size=20, rate=5, max_attempts=5, poll_interval=10, dm_status=None):
+        self.bot = bot
+        self.db_path = db_path
+        self.dm_status = dm_status
+        self.batch_size = batch_size
+        self.rate = rate
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self._wake = asyncio.Event()
+        self._task = None
+        self.sent = 0
+        self.failed = 0
+        self.rate_limited = 0
+        # Messages held back until the user's DMs may work again; see dm_status
+        self.postponed = 0
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if not self.running:
+            self._task = asyncio.create_task(self._run(), name="outbox-dispatcher")
+            logger.info("Outbox dispatcher started")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def notify(self):
+        """Wake the dispatcher after new messages were committed"""
+        self._wake.set()
+
+    async def _run(self):
+        while True:
+            try:
+                drained = await self.dispatch_batch()
+            except Exception as e:
+                logger.error(f"Outbox dispatch failed: {e}")
+                drained = 0
+
+            # A full batch means there is probably more waiting
+            if drained < self.batch_size:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def dispatch_batch(self):
+        """Send one batch of due messages; returns the number of rows handled"""
+        async with query_log.connect(self.db_path) as db:
+            async with db.execute(
+                "SELECT m.id, m.user_id, m.kind, m.payload, m.attempts, m.order_id, o.guild_id FROM outbox m "
+                "LEFT JOIN orders o ON o.id = m.order_id "
+                "WHERE m.status = ? AND m.available_at <= CURRENT_TIMESTAMP ORDER BY m.id LIMIT ?",
+                (PENDING, self.batch_size)
+            ) as cursor:
+                batch = await cursor.fetchall()
+
+            sent, retries, failures, postponed = [], [], [], []
+            for message_id, user_id, kind, payload, attempts, order_id, guild_id in batch:
+                # Don't spend a request on a user whose DMs failed recently
+                blocked = self.dm_status.blocked(user_id) if self.dm_status is not None else None
+                if blocked is not None:
+                    self._postpone(message_id, blocked, f"DMs unavailable ({blocked.reason})", postponed)
+                    continue
+                try:
+                    await self._send(user_id, payload)
+                    sent.append((message_id,))
+                    self.sent += 1
+                    if self.dm_status is not None:
+                        await self.dm_status.record_success(user_id)
+                except discord.HTTPException as e:
+                    if e.status == 429:
+                        # Leave the rest of the batch for later and back off
+                        self.rate_limited += 1
+                        logger.warning("Outbox hit a rate limit, pausing dispatch")
+                        await self._record(db, sent, retries, failures, postponed)
+                        await asyncio.sleep(self.poll_interval)
+                        return len(sent) + len(retries) + len(failures) + len(postponed)
+                    entry = await self._blocked(user_id, e, guild_id, order_id)
+                    if entry is not None:
+                        self._postpone(message_id, entry, str(e), postponed)
+                    else:
+                        self._failed(message_id, kind, attempts, str(e), retries, failures)
+
+                await asyncio.sleep(1 / self.rate)
+
+            await self._record(db, sent, retries, failures, postponed)
+        return len(batch)
+
+    async def _send(self, user_id, payload):
+        user = await self.bot.user_cache.get(user_id)
+        data = json.loads(payload)
+        await user.send(embed=discord.Embed.from_dict(data["embed"]))
+
+    async def _blocked(self, user_id, error, guild_id, order_id):
+        """The user's dm_status record if the error means they can't be DMed for now, else None"""
+        if self.dm_status is None:
+            return None
+        about = f"order #{order_id}" if order_id else "your order"
+        return await self.dm_status.failed(user_id, error, guild_id, about)
+
+    def _postpone(self, message_id, entry, error, postponed):
+        """Keep the message pending until the user's retry time; doesn't use up an attempt"""
+        postponed.append((error, entry.retry_at, message_id))
+        self.postponed += 1
+
+    def _failed(self, message_id, kind, attempts, error, retries, failures):
+        attempts += 1
+        if attempts >= self.max_attempts:
+            logger.error(f"Giving up on {kind} message #{message_id} after {attempts} attempts: {error}")
+            failures.append((attempts, error, message_id))
+            self.failed += 1
+        else:
+            retries.append((attempts, error, f"+{60 * 2 ** attempts} seconds", message_id))
+
+    async def _record(self, db, sent, retries, failures, postponed=()):
+        """Write the outcome of a batch in one transaction"""
+        if sent:
+            await db.executemany(
+                "UPDATE outbox SET status = 'sent', sent_at = CURRENT_TIMESTAMP WHERE id = ?", sent
+            )
+        if retries:
+            await db.executemany(
+                "UPDATE outbox SET attempts = ?, last_error = ?, available_at = datetime('now', ?) WHERE id = ?",
+                retries
+            )
+        if failures:
+            await db.executemany(
+                "UPDATE outbox SET status = 'failed', attempts = ?, last_error = ? WHERE id = ?", failures
+            )
+        if postponed:
+            await db.executemany(
+                "UPDATE outbox SET last_error = ?, available_at = datetime(?, 'unixepoch') WHERE id = ?", postponed
+            )
+        await db.commit()
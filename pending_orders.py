@@ -0,0 +1,204 @@
+import logging
+from datetime import datetime, timedelta
+
+import query_log
+
+logger = logging.getLogger("shop_bot")
+
+_COLUMNS = "id, user_id, guild_id, total_cents, ltc_litoshis, confirmation_key, reminded_at"
+# Orders still waiting for payment: what reminders and s!confirm look at
+_PENDING = "status = 'pending' AND payment_confirmed = 0"
+
+
+async def create_indexes(db):
+    """Index for find_key() lookups that miss the in-memory index"""
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_orders_confirmation_key ON orders (confirmation_key)")
+
+
+class PendingOrder:
+    """The fields of a pending order that reminders and confirmations need; amounts are integers"""
+
+    __slots__ = ("id", "user_id", "guild_id", "total_cents", "ltc_litoshis", "confirmation_key", "reminded_at")
+
+    def __init__(self, order_id, user_id, guild_id, total_cents, ltc_litoshis, confirmation_key, reminded_at=None):
+        self.id = order_id
+        self.user_id = user_id
+        self.guild_id = guild_id
+        self.total_cents = total_cents
+        self.ltc_litoshis = ltc_litoshis
+        self.confirmation_key = confirmation_key
+        self.reminded_at = reminded_at
+
+    def as_row(self):
+        return (self.id, self.user_id, self.guild_id, self.total_cents, self.ltc_litoshis,
+                self.confirmation_key, self.reminded_at)
+
+
+class PendingOrderIndex:
+    """Pending orders kept in memory, by order ID, user ID and confirmation key
+
+    Loaded once at startup. Code that moves orders out of pending updates
+    the index after its write. Orders are created by the cogs, which don't
+    know about the index, so catch_up() adds orders newer than any seen
+    before. reconcile() compares the index with the orders table and
+    repairs anything a write path missed.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._by_id = {}
+        self._by_user = {}
+        self._by_key = {}
+        # Highest order ID loaded or caught up; catch_up() only reads orders above it.
+        # find_key() doesn't move it, so orders created just before one it finds aren't skipped
+        self._last_id = 0
+        self.repairs = 0
+
+    def __len__(self):
+        return len(self._by_id)
+
+    async def _fetch(self):
+        async with query_log.connect(self.db_path) as db:
+            async with db.execute(f"SELECT {_COLUMNS} FROM orders WHERE {_PENDING}") as cursor:
+                return [PendingOrder(*row) for row in await cursor.fetchall()]
+
+    async def load(self):
+        orders = await self._fetch()
+        self._replace(orders)
+        self._last_id = max((order.id for order in orders), default=0)
+        logger.info(f"Loaded {len(self)} pending orders")
+
+    def _replace(self, orders):
+        self._by_id = {}
+        self._by_user = {}
+        self._by_key = {}
+        for order in orders:
+            self.add(order)
+
+    def add(self, order):
+        self.discard(order.id)
+        self._by_id[order.id] = order
+        self._by_user.setdefault(order.user_id, {})[order.id] = order
+        if order.confirmation_key:
+            self._by_key[order.confirmation_key] = order
+
+    def discard(self, order_id):
+        """Forget an order that is no longer pending; returns it, or None"""
+        order = self._by_id.pop(order_id, None)
+        if order is None:
+            return None
+        user_orders = self._by_user.get(order.user_id)
+        if user_orders is not None:
+            user_orders.pop(order_id, None)
+            if not user_orders:
+                del self._by_user[order.user_id]
+        if order.confirmation_key and self._by_key.get(order.confirmation_key) is order:
+            del self._by_key[order.confirmation_key]
+        return order
+
+    def discard_many(self, order_ids):
+        for order_id in order_ids:
+            self.discard(order_id)
+
+    def get(self, order_id):
+        return self._by_id.get(order_id)
+
+    def by_key(self, confirmation_key):
+        return self._by_key.get(confirmation_key)
+
+    async def find_key(self, confirmation_key):
+        """by_key(), falling back to the orders table on a miss
+
+        Orders placed through the cogs only reach the index at the next
+        catch_up(), so a buyer confirming straight away would miss. A
+        pending order found in the table is added to the index.
+        """
+        order = self._by_key.get(confirmation_key)
+        if order is not None:
+            return order
+        async with query_log.connect(self.db_path) as db:
+            async with db.execute(
+                f"SELECT {_COLUMNS} FROM orders WHERE confirmation_key = ? AND {_PENDING}", (confirmation_key,)
+            ) as cursor:
+                row = await cursor.fetchone()
+        if row is None:
+            return None
+        order = PendingOrder(*row)
+        self.add(order)
+        return order
+
+    async def catch_up(self):
+        """Add pending orders created since the index last saw one; returns how many
+
+        Reads only rows above the highest order ID seen, a primary key range
+        that is empty most of the time.
+        """
+        async with query_log.connect(self.db_path) as db:
+            async with db.execute(
+                f"SELECT {_COLUMNS}, {_PENDING} FROM orders WHERE id > ? ORDER BY id", (self._last_id,)
+            ) as cursor:
+                rows = await cursor.fetchall()
+        added = 0
+        for *row, pending in rows:
+            if pending and row[0] not in self._by_id:
+                self.add(PendingOrder(*row))
+                added += 1
+            self._last_id = max(self._last_id, row[0])
+        if added:
+            logger.debug(f"Added {added} new pending orders to the index")
+        return added
+
+    def for_user(self, user_id):
+        return list(self._by_user.get(user_id, {}).values())
+
+    def due_reminders(self, reminder_minutes, now=None):
+        """Orders never reminded, or reminded longer ago than their guild's cadence
+
+        ``reminder_minutes`` maps a guild ID to that guild's cadence.
+        reminded_at values are UTC 'YYYY-MM-DD HH:MM:SS' strings, so they are
+        compared as strings against each guild's cutoff instead of parsed.
+        """
+        now = now or datetime.utcnow()
+        cutoffs = {}
+        due = []
+        for order in self._by_id.values():
+            if order.reminded_at is not None:
+                cutoff = cutoffs.get(order.guild_id)
+                if cutoff is None:
+                    cutoff = cutoffs[order.guild_id] = (
+                        now - timedelta(minutes=reminder_minutes(order.guild_id))
+                    ).strftime('%Y-%m-%d %H:%M:%S')
+                if order.reminded_at > cutoff:
+                    continue
+            due.append(order)
+        return due
+
+    async def reconcile(self):
+        """Compare with the orders table and make the index match it
+
+        Returns (missing, stale, changed): orders the index lacked, orders
+        it held that are no longer pending, and orders whose fields differed.
+        Orders newer than any the index has seen are not counted as missing,
+        since catch_up() hasn't had a chance to add them; they are added
+        quietly.
+        """
+        rows = await self._fetch()
+        actual = {order.id: order for order in rows}
+        new = [order for order in rows if order.id > self._last_id]
+        missing = sum(1 for order_id in actual if order_id not in self._by_id and order_id <= self._last_id)
+        stale = sum(1 for order_id in self._by_id if order_id not in actual)
+        changed = sum(
+            1 for order_id, order in actual.items()
+            if order_id in self._by_id and self._by_id[order_id].as_row() != order.as_row()
+        )
+        if missing or stale or changed:
+            self.repairs += missing + stale + changed
+            logger.warning(
+                f"Pending order index was out of date: {missing} missing, {stale} stale, {changed} changed; rebuilt"
+            )
+            self._replace(rows)
+        else:
+            for order in new:
+                self.add(order)
+        self._last_id = max((order.id for order in new), default=self._last_id)
+        return missing, stale, changed
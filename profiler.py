@@ -0,0 +1,124 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+from collections import Counter
+
+# Samples per second are lowered while sampling takes more than this share of the wall time
+MAX_OVERHEAD = 0.02
+MIN_INTERVAL = 0.005
+MAX_SECONDS = 60
+
+
+def _frame_label(code):
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f"{module}:{code.co_name}"
+
+
+def _is_idle(frame):
+    """Whether the loop thread is waiting in select(), i.e. has nothing to run"""
+    return frame.f_code.co_name == "select" and frame.f_code.co_filename.endswith("selectors.py")
+
+
+class Profile:
+    """Result of a sampling run"""
+
+    def __init__(self, stacks, samples, idle, duration, interval, overhead):
+        self.stacks = stacks
+        self.samples = samples
+        self.idle = idle
+        self.duration = duration
+        self.interval = interval
+        self.overhead = overhead
+
+    def collapsed(self):
+        """Stacks in the collapsed format read by flamegraph.pl and speedscope"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def top_functions(self, n=15):
+        """(function, self samples, total samples) sorted by self samples"""
+        own = Counter()
+        total = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        return [(name, count, total[name]) for name, count in own.most_common(n)]
+
+    def summary(self, n=15):
+        busy = self.samples - self.idle
+        lines = [
+            f"{self.samples} samples over {self.duration:.1f}s "
+            f"(every {self.interval * 1000:.1f} ms, {self.overhead:.1%} sampling overhead)",
+            f"Event loop busy in {busy} samples ({busy / self.samples:.0%}), idle in {self.idle}" if self.samples else "No samples",
+            "",
+            f"{'self':>6} {'total':>6}  function",
+        ]
+        for name, own, total in self.top_functions(n):
+            lines.append(f"{own / self.samples:>6.1%} {total / self.samples:>6.1%}  {name}")
+        return "\n".join(lines)
+
+
+class ProfilerBusy(RuntimeError):
+    """Raised by SamplingProfiler.run while another profile is running"""
+
+
+class SamplingProfiler:
+    """Samples the event loop thread's stack from a helper thread
+
+    Nothing is installed on the loop itself, so profiling a live bot costs
+    only the time the helper thread holds the GIL while walking one stack.
+    The sampling interval backs off if that exceeds MAX_OVERHEAD.
+    """
+
+    def __init__(self, interval=0.01, max_depth=64):
+        self.interval = max(interval, MIN_INTERVAL)
+        self.max_depth = max_depth
+        self.lock = asyncio.Lock()
+
+    def _sample(self, thread_id, seconds, stop):
+        stacks = Counter()
+        samples = idle = 0
+        spent = 0.0
+        interval = self.interval
+        started = time.perf_counter()
+        deadline = started + seconds
+        while not stop.is_set() and time.perf_counter() < deadline:
+            before = time.perf_counter()
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                if _is_idle(frame):
+                    idle += 1
+                else:
+                    labels = []
+                    while frame is not None and len(labels) < self.max_depth:
+                        labels.append(_frame_label(frame.f_code))
+                        frame = frame.f_back
+                    stacks[";".join(reversed(labels))] += 1
+                samples += 1
+            frame = None
+            spent += time.perf_counter() - before
+            elapsed = time.perf_counter() - started
+            if elapsed > 0.5:
+                if spent > elapsed * MAX_OVERHEAD:
+                    interval = min(interval * 1.5, 0.1)
+                elif spent < elapsed * MAX_OVERHEAD / 2:
+                    interval = max(interval / 1.5, self.interval)
+            stop.wait(interval)
+        duration = time.perf_counter() - started
+        return Profile(stacks, samples, idle, duration, interval, spent / duration if duration else 0.0)
+
+    async def run(self, seconds):
+        """Profile the running event loop for ``seconds`` without blocking it"""
+        if self.lock.locked():
+            raise ProfilerBusy("A profile is already running")
+        async with self.lock:
+            seconds = max(1, min(seconds, MAX_SECONDS))
+            stop = threading.Event()
+            loop = asyncio.get_running_loop()
+            try:
+                return await loop.run_in_executor(None, self._sample, threading.get_ident(), seconds, stop)
+            finally:
+                stop.set()
@@ -0,0 +1,166 @@
+import os
+import re
+import time
+import sqlite3
+import logging
+
+import aiosqlite
+from aiosqlite.context import contextmanager
+
+logger = logging.getLogger("shop_bot")
+
+# Statements that have a query plan worth capturing
+_EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize(sql):
+    """Reduce a statement to its shape so timings of similar queries aggregate"""
+    sql = _STRING_LITERAL.sub("?", sql)
+    sql = _NUMBER_LITERAL.sub("?", sql)
+    sql = _PLACEHOLDER_LIST.sub("(...)", sql)
+    return _WHITESPACE.sub(" ", sql).strip()
+
+
+class QueryStats:
+    """Timing of one statement shape"""
+
+    __slots__ = ("sql", "count", "total", "max", "slow", "errors", "plan")
+
+    def __init__(self, sql):
+        self.sql = sql
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.slow = 0
+        self.errors = 0
+        self.plan = None
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+class QueryLog:
+    """Aggregates statement timings by normalized SQL and logs slow statements"""
+
+    def __init__(self, slow_ms=100):
+        self.slow_seconds = slow_ms / 1000
+        self.stats = {}
+
+    def record(self, sql, elapsed, error=False):
+        """Add a timing; returns the stats entry if the statement was slow"""
+        shape = normalize(sql)
+        stats = self.stats.get(shape)
+        if stats is None:
+            stats = self.stats[shape] = QueryStats(shape)
+        stats.count += 1
+        stats.total += elapsed
+        stats.max = max(stats.max, elapsed)
+        if error:
+            stats.errors += 1
+        if elapsed >= self.slow_seconds:
+            stats.slow += 1
+            return stats
+        return None
+
+    def add_fetch_time(self, sql, elapsed):
+        """Charge time spent fetching rows to the statement that produced them"""
+        stats = self.stats.get(normalize(sql))
+        if stats is not None:
+            stats.total += elapsed
+
+    def top(self, n=10, by="total"):
+        """The n statement shapes with the highest total, count, max or mean time"""
+        key = {
+            "total": lambda s: s.total,
+            "count": lambda s: s.count,
+            "max": lambda s: s.max,
+            "mean": lambda s: s.mean,
+        }[by]
+        return sorted(self.stats.values(), key=key, reverse=True)[:n]
+
+    def reset(self):
+        self.stats.clear()
+
+
+# Shared by every connection opened through connect()
+query_log = QueryLog(slow_ms=float(os.getenv('SLOW_QUERY_MS', 100)))
+
+
+class TimedCursor(aiosqlite.Cursor):
+    """Cursor that adds fetch time to its statement's timing"""
+
+    def __init__(self, conn, cursor, sql):
+        super().__init__(conn, cursor)
+        self._sql = sql
+
+    async def _timed(self, fn, *args):
+        started = time.perf_counter()
+        try:
+            return await self._execute(fn, *args)
+        finally:
+            query_log.add_fetch_time(self._sql, time.perf_counter() - started)
+
+    async def fetchone(self):
+        return await self._timed(self._cursor.fetchone)
+
+    async def fetchmany(self, size=None):
+        return await self._timed(self._cursor.fetchmany, *(() if size is None else (size,)))
+
+    async def fetchall(self):
+        return await self._timed(self._cursor.fetchall)
+
+
+class InstrumentedConnection(aiosqlite.Connection):
+    """aiosqlite connection that times every statement
+
+    Statements slower than SLOW_QUERY_MS are logged together with their
+    EXPLAIN QUERY PLAN, which is captured once per statement shape.
+    """
+
+    async def _timed_execute(self, fn, sql, parameters):
+        started = time.perf_counter()
+        try:
+            cursor = await self._execute(fn, sql, parameters)
+        except sqlite3.Error:
+            query_log.record(sql, time.perf_counter() - started, error=True)
+            raise
+        elapsed = time.perf_counter() - started
+        slow = query_log.record(sql, elapsed)
+        if slow is not None:
+            await self._log_slow(slow, sql, parameters, elapsed, fn == self._conn.executemany)
+        return TimedCursor(self, cursor, sql)
+
+    async def _log_slow(self, stats, sql, parameters, elapsed, many):
+        if stats.plan is None and sql.lstrip().upper().startswith(_EXPLAINABLE):
+            params = next(iter(parameters), ()) if many else parameters
+            try:
+                rows = await self._execute(self._conn.execute, f"EXPLAIN QUERY PLAN {sql}", params)
+                stats.plan = "\n".join(row[-1] for row in await self._execute(rows.fetchall))
+            except sqlite3.Error as e:
+                stats.plan = f"(no plan: {e})"
+        logger.warning(
+            f"Slow query ({elapsed * 1000:.1f} ms): {stats.sql}" + (f"\nQuery plan:\n{stats.plan}" if stats.plan else "")
+        )
+
+    @contextmanager
+    async def execute(self, sql, parameters=None):
+        return await self._timed_execute(self._conn.execute, sql, [] if parameters is None else parameters)
+
+    @contextmanager
+    async def executemany(self, sql, parameters):
+        return await self._timed_execute(self._conn.executemany, sql, parameters)
+
+
+def connect(database, *, iter_chunk_size=64, **kwargs):
+    """Drop-in replacement for aiosqlite.connect() that records query timings"""
+
+    def connector():
+        return sqlite3.connect(str(database), **kwargs)
+
+    return InstrumentedConnection(connector, iter_chunk_size)
@@ -0,0 +1,168 @@
+import os
+import json
+import time
+import asyncio
+import logging
+
+logger = logging.getLogger("shop_bot")
+
+COINGECKO_URL = "https://api.coingecko.com/api/v3/simple/price?ids=litecoin&vs_currencies=usd"
+LTC_DECIMALS = 8
+
+
+class RateUnavailable(Exception):
+    """Raised when no USD→LTC rate can be produced"""
+
+
+class PriceSource:
+    """Base class for USD-per-LTC price sources"""
+
+    name = "base"
+
+    async def fetch(self):
+        raise NotImplementedError
+
+
+class CoinGeckoSource(PriceSource):
+    """Fetch the LTC price from the public CoinGecko API"""
+
+    name = "coingecko"
+
+    def __init__(self, url=COINGECKO_URL, timeout=10):
+        self.url = url
+        self.timeout = timeout
+
+    async def fetch(self):
+        # aiohttp ships with discord.py
+        import aiohttp
+
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            async with session.get(self.url) as response:
+                response.raise_for_status()
+                data = await response.json()
+        return float(data["litecoin"]["usd"])
+
+
+class FileSource(PriceSource):
+    """Read the LTC price from a local JSON file, for offline use
+
+    The file holds either a bare number or {"usd_per_ltc": <number>}.
+    """
+
+    name = "file"
+
+    def __init__(self, path):
+        self.path = path
+
+    async def fetch(self):
+        with open(self.path, 'r') as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            data = data["usd_per_ltc"]
+        return float(data)
+
+
+class FixedSource(PriceSource):
+    """Always return the same price, for testing"""
+
+    name = "fixed"
+
+    def __init__(self, usd_per_ltc):
+        self.usd_per_ltc = float(usd_per_ltc)
+
+    async def fetch(self):
+        return self.usd_per_ltc
+
+
+def source_from_env():
+    """Build the price source named by RATE_SOURCE (coingecko, file:<path> or fixed:<rate>)"""
+    spec = os.getenv('RATE_SOURCE', 'coingecko')
+    kind, _, arg = spec.partition(':')
+    if kind == "file":
+        return FileSource(arg or "ltc_rate.json")
+    if kind == "fixed":
+        return FixedSource(arg)
+    if kind != "coingecko":
+        logger.warning(f"Unknown RATE_SOURCE '{spec}', using coingecko")
+    return CoinGeckoSource()
+
+
+class RateOracle:
+    """Cached USD→LTC rate with stale-while-revalidate and single-flight refresh
+
+    A rate younger than ``ttl`` seconds is returned as is. An older rate is
+    still returned while it is younger than ``max_stale`` seconds, and a
+    refresh is started in the background. Concurrent callers share a single
+    in-flight refresh, so a burst of purchases triggers at most one fetch.
+    """
+
+    def __init__(self, source, ttl=60, max_stale=900):
+        self.source = source
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self._rate = None
+        self._fetched_at = 0.0
+        self._refresh_task = None
+        self.fetches = 0
+        self.failures = 0
+
+    @property
+    def age(self):
+        return time.monotonic() - self._fetched_at if self._rate is not None else None
+
+    def _refresh(self):
+        """Return the in-flight refresh, starting one if needed"""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.ensure_future(self._fetch())
+            self._refresh_task.add_done_callback(_consume_exception)
+        return self._refresh_task
+
+    async def _fetch(self):
+        self.fetches += 1
+        try:
+            rate = await self.source.fetch()
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"Failed to fetch LTC rate from {self.source.name}: {e}")
+            raise RateUnavailable(str(e)) from e
+        if rate <= 0:
+            self.failures += 1
+            raise RateUnavailable(f"Invalid LTC rate {rate}")
+        self._rate = rate
+        self._fetched_at = time.monotonic()
+        return rate
+
+    async def get_rate(self):
+        """Return the current USD price of one LTC"""
+        age = self.age
+        if age is not None and age < self.ttl:
+            return self._rate
+
+        if age is not None and age < self.max_stale:
+            # Serve the stale rate and revalidate in the background
+            self._refresh()
+            return self._rate
+
+        # shield() so one cancelled caller doesn't cancel the shared refresh
+        return await asyncio.shield(self._refresh())
+
+    async def quote_litoshis(self, cents):
+        """Convert a USD amount in cents to a whole number of litoshis"""
+        rate = await self.get_rate()
+        return round(cents * 10 ** LTC_DECIMALS / (100 * rate))
+
+
+def _consume_exception(task):
+    # Background refresh failures are already logged in _fetch
+    if not task.cancelled():
+        task.exception()
+
+
+def oracle_from_env():
+    """Build a RateOracle configured from the environment"""
+    return RateOracle(
+        source_from_env(),
+        ttl=int(os.getenv('RATE_TTL', 60)),
+        max_stale=int(os.getenv('RATE_MAX_STALE', 900)),
+    )
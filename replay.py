@@ -0,0 +1,407 @@
+import os
+import re
+import sys
+import json
+import math
+import time
+import zlib
+import sqlite3
+import asyncio
+import logging
+import argparse
+import tempfile
+from datetime import datetime
+
+from discord.ext import commands
+
+logger = logging.getLogger("shop_bot")
+
+# "2024-05-01 12:00:00,123 - shop_bot - INFO - Command detected: shop from someone"
+LOG_LINE = re.compile(
+    r"^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3}) - shop_bot - INFO - Command detected: (\S*) from (.+)$"
+)
+PERCENTILES = (50, 90, 95, 99)
+
+
+class TraceEvent:
+    """One command invocation from a log or capture file"""
+
+    __slots__ = ("at", "author_id", "author", "guild_id", "channel_id", "content")
+
+    def __init__(self, at, author_id, author, guild_id, channel_id, content):
+        self.at = at
+        self.author_id = author_id
+        self.author = author
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.content = content
+
+
+def parse_log(lines, prefix="s!", arguments=None):
+    """Trace events from bot.log "Command detected" lines
+
+    The log only names the command, so each invocation is replayed without
+    arguments unless ``arguments`` maps the command name to an argument
+    string. Authors get a stable made-up ID derived from their name.
+    """
+    arguments = arguments or {}
+    for line in lines:
+        match = LOG_LINE.match(line.rstrip("\r\n"))
+        if not match:
+            continue
+        stamp, command, author = match.groups()
+        content = f"{prefix}{command} {arguments[command]}" if command in arguments else f"{prefix}{command}"
+        yield TraceEvent(
+            datetime.strptime(stamp, "%Y-%m-%d %H:%M:%S,%f").timestamp(),
+            zlib.crc32(author.encode()), author, None, None, content
+        )
+
+
+def parse_capture(lines):
+    """Trace events from a file written by CommandCapture"""
+    for line in lines:
+        if line.strip():
+            entry = json.loads(line)
+            yield TraceEvent(
+                entry["at"], entry["author_id"], entry["author"], entry["guild_id"], entry["channel_id"],
+                entry["content"]
+            )
+
+
+def load_trace(path, prefix="s!", arguments=None, limit=None):
+    """Read a capture file or a bot.log, whichever ``path`` is, sorted by time"""
+    with open(path, encoding="utf-8", errors="replace") as f:
+        lines = f.readlines()
+    first = next((line for line in lines if line.strip()), "")
+    events = parse_capture(lines) if first.lstrip().startswith("{") else parse_log(lines, prefix, arguments)
+    trace = sorted(events, key=lambda event: event.at)
+    return trace[:limit] if limit else trace
+
+
+class CommandCapture:
+    """Appends every command message to a JSON-lines file for replay
+
+    Unlike bot.log, the capture keeps the whole message, arguments
+    included, so it can hold confirmation keys and other private input.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8", buffering=1)
+        logger.info(f"Capturing commands to {path}")
+
+    def record(self, message):
+        self._file.write(json.dumps({
+            "at": message.created_at.timestamp(),
+            "author_id": message.author.id,
+            "author": str(message.author),
+            "guild_id": message.guild.id if message.guild else None,
+            "channel_id": message.channel.id,
+            "content": message.content,
+        }) + "\n")
+
+
+def capture_from_env():
+    path = os.getenv('COMMAND_CAPTURE')
+    return CommandCapture(path) if path else None
+
+
+# Stand-ins for the Discord objects commands touch. Nothing here talks to
+# Discord; sends are counted and take ``send_latency`` seconds.
+
+class ReplayPermissions:
+    def __init__(self, administrator):
+        self.administrator = administrator
+
+
+class ReplayGuild:
+    filesize_limit = 25 * 1024 * 1024
+
+    def __init__(self, guild_id, me):
+        self.id = guild_id
+        self.name = f"Replay guild {guild_id}"
+        # The bot's own member, which ctx.me and ctx.clean_prefix read
+        self.me = me
+
+    def get_role(self, role_id):
+        return None
+
+    def get_member(self, user_id):
+        return None
+
+
+class SentMessage:
+    def __init__(self, replayer):
+        self.replayer = replayer
+        self.id = 0
+
+    async def edit(self, **kwargs):
+        await self.replayer.sent()
+        return self
+
+    async def delete(self, **kwargs):
+        await self.replayer.sent()
+
+    async def add_reaction(self, emoji):
+        await self.replayer.sent()
+
+
+class ReplayMessageable:
+    async def send(self, content=None, **kwargs):
+        await self.replayer.sent()
+        return SentMessage(self.replayer)
+
+
+class ReplayChannel(ReplayMessageable):
+    def __init__(self, replayer, channel_id, guild):
+        self.replayer = replayer
+        self.id = channel_id
+        self.guild = guild
+
+
+class ReplayMember(ReplayMessageable):
+    bot = False
+
+    def __init__(self, replayer, user_id, name, administrator):
+        self.replayer = replayer
+        self.id = user_id
+        self.name = name
+        self.display_name = name
+        self.mention = f"<@{user_id}>"
+        self.guild_permissions = ReplayPermissions(administrator)
+
+    def get_role(self, role_id):
+        return None
+
+    def __str__(self):
+        return self.name
+
+
+class ReplayGateway:
+    """Stands in for the gateway connection so bot.latency has a value"""
+
+    open = False
+
+    def __init__(self, latency):
+        self.latency = latency
+
+
+class ReplayMessage:
+    def __init__(self, state, content, author, guild, channel):
+        self._state = state
+        self.id = 0
+        self.content = content
+        self.author = author
+        self.guild = guild
+        self.channel = channel
+        self.attachments = []
+        self.mentions = []
+
+
+class ReplayContext(commands.Context):
+    async def send(self, content=None, **kwargs):
+        return await self.message.channel.send(content, **kwargs)
+
+    async def reply(self, content=None, **kwargs):
+        return await self.send(content, **kwargs)
+
+
+class Result:
+    __slots__ = ("command", "latency", "lag", "failed")
+
+    def __init__(self, command, latency, lag, failed):
+        self.command = command
+        self.latency = latency
+        self.lag = lag
+        self.failed = failed
+
+
+class Replayer:
+    """Feeds a trace through the bot's command handling at ``speed`` times real time
+
+    Each event is invoked at its original offset from the start of the
+    trace divided by ``speed``, in its own task, so commands overlap the way
+    they did in production. ``lag`` is how late an event started, which
+    grows once the bot can't keep up.
+    """
+
+    def __init__(self, bot, trace, speed=1.0, send_latency=0.0, administrator=True, default_guild_id=1):
+        self.bot = bot
+        self.trace = trace
+        self.speed = speed
+        self.send_latency = send_latency
+        self.administrator = administrator
+        self.default_guild_id = default_guild_id
+        self.results = []
+        self.sends = 0
+        self.elapsed = 0.0
+
+    async def sent(self):
+        self.sends += 1
+        if self.send_latency:
+            await asyncio.sleep(self.send_latency)
+
+    async def run(self):
+        if not self.trace:
+            return
+        base = self.trace[0].at
+        started = time.perf_counter()
+        tasks = []
+        for event in self.trace:
+            due = (event.at - base) / self.speed
+            delay = due - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(self._invoke(event, started + due)))
+        await asyncio.gather(*tasks)
+        self.elapsed = time.perf_counter() - started
+
+    async def _invoke(self, event, due):
+        began = time.perf_counter()
+        guild = ReplayGuild(event.guild_id or self.default_guild_id, self.bot.user)
+        author = ReplayMember(self, event.author_id, event.author, self.administrator)
+        channel = ReplayChannel(self, event.channel_id or guild.id, guild)
+        message = ReplayMessage(self.bot._connection, event.content, author, guild, channel)
+        ctx = await self.bot.get_context(message, cls=ReplayContext)
+        try:
+            await self.bot.invoke(ctx)
+            failed = ctx.command_failed
+        except Exception as e:
+            logger.error(f"Replaying '{event.content}' raised {e!r}")
+            failed = True
+        name = ctx.command.qualified_name if ctx.command else f"{ctx.invoked_with} (unknown)"
+        self.results.append(Result(name, time.perf_counter() - began, max(began - due, 0.0), failed))
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of an already sorted list"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(math.ceil(q / 100 * len(values)) - 1, 0))]
+
+
+def _ms(seconds):
+    return f"{seconds * 1000:8.1f}"
+
+
+def report(replayer, query_log, watchdog=None, top=8):
+    """Plain-text latency, lag and database report for a finished replay"""
+    results = replayer.results
+    latencies = sorted(result.latency for result in results)
+    lags = sorted(result.lag for result in results)
+    lines = [
+        f"Replayed {len(results)} commands at {replayer.speed:g}x in {replayer.elapsed:.1f}s "
+        f"({len(results) / replayer.elapsed if replayer.elapsed else 0:.1f}/s), "
+        f"{sum(result.failed for result in results)} failed, {replayer.sends} messages sent",
+        "",
+        "Latency (ms)  " + "".join(f"{f'p{q}':>9}" for q in PERCENTILES) + "      max",
+        "  all         " + "".join(f"{_ms(percentile(latencies, q))} " for q in PERCENTILES) + _ms(latencies[-1] if latencies else 0),
+        "  start lag   " + "".join(f"{_ms(percentile(lags, q))} " for q in PERCENTILES) + _ms(lags[-1] if lags else 0),
+        "",
+        f"{'Command':<24}{'count':>7}{'failed':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}",
+    ]
+    by_command = {}
+    for result in results:
+        by_command.setdefault(result.command, []).append(result)
+    for command, group in sorted(by_command.items(), key=lambda item: -sum(r.latency for r in item[1])):
+        values = sorted(result.latency for result in group)
+        lines.append(
+            f"{command[:23]:<24}{len(group):>7}{sum(result.failed for result in group):>8}"
+            f"{_ms(percentile(values, 50))} {_ms(percentile(values, 95))} {_ms(percentile(values, 99))} {_ms(values[-1])}"
+        )
+
+    stats = list(query_log.stats.values())
+    db_time = sum(entry.total for entry in stats)
+    lines += [
+        "",
+        f"Database: {sum(entry.count for entry in stats)} statements, {db_time:.2f}s total "
+        f"({db_time / replayer.elapsed * 100 if replayer.elapsed else 0:.0f}% of wall time), "
+        f"{sum(entry.errors for entry in stats)} errors (e.g. database is locked), "
+        f"{sum(entry.slow for entry in stats)} slow",
+        f"Slowest statements (waiting on the write lock shows up as max time):",
+    ]
+    for entry in query_log.top(top, by="max"):
+        lines.append(f"  {entry.max * 1000:8.1f} ms max {entry.mean * 1000:7.2f} ms mean  x{entry.count:<6} {entry.sql[:100]}")
+    if watchdog is not None and watchdog.samples:
+        lines += ["", f"Event loop: max lag {watchdog.max_lag * 1000:.0f} ms, {len(watchdog.stalls)} stalls"]
+        lines += [f"  {label:>9} {count}" for label, count in watchdog.histogram() if count]
+    return "\n".join(lines)
+
+
+def copy_database(source, target):
+    """Snapshot the database with the backup API so the replay never writes to it"""
+    with sqlite3.connect(source) as src, sqlite3.connect(target) as dst:
+        src.backup(dst)
+
+
+async def replay(bot_module, trace, speed, send_latency, administrator, top):
+    bot = bot_module.bot
+    async with bot:
+        # Commands check their author against the bot's own user
+        bot._connection.user = ReplayMember(None, 0, "replay", False)
+        bot.ws = ReplayGateway(send_latency)
+        await bot_module.init_db()
+        await bot_module.guild_configs.load()
+        await bot_module.dm_statuses.load()
+        await bot_module.pending_index.load()
+        await bot_module.load_extensions()
+        bot_module.order_event_log.start()
+        bot_module.query_log.query_log.reset()
+        replayer = Replayer(bot, trace, speed, send_latency, administrator)
+        bot_module.loop_watchdog.start()
+        try:
+            await replayer.run()
+        finally:
+            await bot_module.loop_watchdog.stop()
+            await bot_module.order_event_log.stop()
+            bot.ws = None
+        return report(replayer, bot_module.query_log.query_log, bot_module.loop_watchdog, top)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded command traffic against a copy of the database")
+    parser.add_argument("trace", help="bot.log or a COMMAND_CAPTURE file")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed, e.g. 1, 10 or 100 (default: 1)")
+    parser.add_argument("--db", default=None, help="Database to copy (default: DB_PATH)")
+    parser.add_argument("--prefix", default="s!", help="Prefix for commands read from bot.log")
+    parser.add_argument("--args", action="append", default=[], metavar="COMMAND=ARGS",
+                        help="Arguments for a command read from bot.log, e.g. --args search=\"netflix\"")
+    parser.add_argument("--send-latency-ms", type=float, default=0, help="Simulated time for each Discord send")
+    parser.add_argument("--limit", type=int, default=None, help="Only replay the first N commands")
+    parser.add_argument("--no-admin", action="store_true", help="Replay as members without admin permissions")
+    parser.add_argument("--top", type=int, default=8, help="Statements to list in the database report")
+    args = parser.parse_args(argv)
+
+    try:
+        arguments = dict(item.split("=", 1) for item in args.args)
+    except ValueError:
+        parser.error("--args takes COMMAND=ARGS")
+    trace = load_trace(args.trace, args.prefix, arguments, args.limit)
+    if not trace:
+        print(f"No commands found in {args.trace}")
+        return 1
+
+    # Keep the bot's own logging quiet and out of bot.log
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s - %(message)s')
+    source = args.db or os.getenv('DB_PATH', 'shop_database.db')
+    with tempfile.TemporaryDirectory() as workdir:
+        # Everything the bot writes goes to the temporary directory; a replayed
+        # s!backup must not rotate away real backups
+        os.environ['DB_PATH'] = os.path.join(workdir, "replay.db")
+        os.environ['BACKUP_DIR'] = os.path.join(workdir, "backups")
+        os.environ.pop('REPORTING_SNAPSHOT', None)
+        os.environ.pop('COMMAND_CAPTURE', None)
+        if os.path.exists(source):
+            copy_database(source, os.environ['DB_PATH'])
+        import main as bot_module
+
+        print(f"Replaying {len(trace)} commands spanning {trace[-1].at - trace[0].at:.0f}s "
+              f"at {args.speed:g}x against a copy of {source}", flush=True)
+        print(asyncio.run(replay(
+            bot_module, trace, args.speed, args.send_latency_ms / 1000, not args.no_admin, args.top
+        )))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+import os
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+import aiosqlite
+
+import money
+import backups
+import query_log
+
+logger = logging.getLogger("shop_bot")
+
+
+def readonly_uri(path):
+    """SQLite URI that opens a database file read-only"""
+    return f"file:{os.path.abspath(path)}?mode=ro"
+
+
+class ReportingReplica:
+    """Periodically refreshed read-only copy of the database for heavy reports
+
+    Reporting queries run against a snapshot taken with the online backup
+    API, so long scans never hold locks on the live database that buy or
+    confirm need. Queries run on aiosqlite's worker thread, off the event
+    loop.
+    """
+
+    def __init__(self, db_path, snapshot_path=None, max_age=300):
+        self.db_path = db_path
+        self.snapshot_path = snapshot_path or os.path.splitext(db_path)[0] + "-reporting.db"
+        self.max_age = max_age
+        self.refreshed_at = None
+        self._refresh_lock = asyncio.Lock()
+
+    @property
+    def age(self):
+        return time.monotonic() - self.refreshed_at if self.refreshed_at is not None else None
+
+    def _copy(self):
+        tmp_path = self.snapshot_path + ".tmp"
+        backups.copy_online(self.db_path, tmp_path, backups.DEFAULT_PAGES_PER_STEP, backups.DEFAULT_STEP_PAUSE)
+        # Readers that still have the old snapshot open keep reading it
+        os.replace(tmp_path, self.snapshot_path)
+
+    async def refresh(self):
+        """Take a new snapshot; concurrent callers share one refresh"""
+        if self._refresh_lock.locked():
+            async with self._refresh_lock:
+                return
+        async with self._refresh_lock:
+            started = time.monotonic()
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._copy)
+            self.refreshed_at = time.monotonic()
+            logger.info(f"Refreshed reporting snapshot in {self.refreshed_at - started:.2f}s")
+
+    @asynccontextmanager
+    async def connect(self):
+        """Read-only connection to a snapshot no older than max_age"""
+        age = self.age
+        if age is None or age > self.max_age or not os.path.exists(self.snapshot_path):
+            await self.refresh()
+        async with query_log.connect(readonly_uri(self.snapshot_path), uri=True) as db:
+            await db.execute("PRAGMA query_only = 1")
+            yield db
+
+    async def sales_summary(self, days=None):
+        """Order count, revenue and top items of paid and delivered orders, optionally over the last N days
+
+        Revenue is summed as integer cents in SQLite and returned as Money,
+        so totals are exact however many orders they cover.
+        """
+        where = "WHERE o.status IN ('paid', 'delivered')"
+        params = ()
+        if days:
+            where += " AND o.created_at >= datetime('now', ?)"
+            params = (f"-{int(days)} days",)
+        async with self.connect() as db:
+            async with db.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(o.total_cents), 0) FROM orders o {where}", params
+            ) as cursor:
+                count, revenue = await cursor.fetchone()
+            async with db.execute(
+                f"SELECT i.name, COUNT(*), SUM(o.total_cents) FROM orders o JOIN items i ON i.id = o.item_id {where} "
+                "GROUP BY i.name ORDER BY SUM(o.total_cents) DESC LIMIT 10",
+                params
+            ) as cursor:
+                top_items = [(name, sold, money.usd(cents)) for name, sold, cents in await cursor.fetchall()]
+        return count, money.usd(revenue), top_items
+
+    async def orders(self, status=None, limit=25):
+        """Most recent orders, optionally filtered by status, with their totals as Money"""
+        query = (
+            "SELECT o.id, o.user_id, i.name, o.total_cents, o.status, o.created_at "
+            "FROM orders o LEFT JOIN items i ON i.id = o.item_id"
+        )
+        params = ()
+        if status:
+            query += " WHERE o.status = ?"
+            params = (status,)
+        query += " ORDER BY o.created_at DESC, o.id DESC LIMIT ?"
+        async with self.connect() as db:
+            async with db.execute(query, (*params, limit)) as cursor:
+                return [
+                    (order_id, user_id, name, money.usd(cents), status, created_at)
+                    for order_id, user_id, name, cents, status, created_at in await cursor.fetchall()
+                ]
+
+    async def order_info(self, order_id):
+        """Full details of one order"""
+        async with self.connect() as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute(
+                "SELECT o.*, i.name AS item_name FROM orders o LEFT JOIN items i ON i.id = o.item_id WHERE o.id = ?",
+                (order_id,)
+            ) as cursor:
+                row = await cursor.fetchone()
+        return dict(row) if row else None
@@ -0,0 +1,230 @@
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+
+import query_log
+
+logger = logging.getLogger("shop_bot")
+
+# What to do about runs missed while the bot was down
+SKIP = "skip"    # carry on from now
+ONCE = "once"    # run once straight away, then carry on
+ALL = "all"      # run every missed interval, up to MAX_CATCH_UP times
+CATCH_UP_POLICIES = (SKIP, ONCE, ALL)
+MAX_CATCH_UP = 10
+
+
+async def create_table(db):
+    await db.execute('''
+    CREATE TABLE IF NOT EXISTS schedules (
+        name TEXT PRIMARY KEY,
+        interval_seconds REAL NOT NULL,
+        next_run_at REAL NOT NULL,
+        last_started_at REAL,
+        last_duration REAL,
+        max_duration REAL NOT NULL DEFAULT 0,
+        total_duration REAL NOT NULL DEFAULT 0,
+        runs INTEGER NOT NULL DEFAULT 0,
+        failures INTEGER NOT NULL DEFAULT 0,
+        skipped INTEGER NOT NULL DEFAULT 0,
+        last_error TEXT
+    )
+    ''')
+
+
+class ScheduledJob:
+    """A periodic coroutine and its run history"""
+
+    __slots__ = (
+        "name", "interval", "fn", "jitter", "catch_up", "max_concurrency", "next_run", "running",
+        "last_started", "last_duration", "max_duration", "total_duration", "runs", "failures",
+        "skipped", "last_error", "durations",
+    )
+
+    def __init__(self, name, interval, fn, jitter, catch_up, max_concurrency):
+        self.name = name
+        self.interval = interval
+        self.fn = fn
+        self.jitter = jitter
+        self.catch_up = catch_up
+        self.max_concurrency = max_concurrency
+        self.next_run = None
+        self.running = 0
+        self.last_started = None
+        self.last_duration = None
+        self.max_duration = 0.0
+        self.total_duration = 0.0
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.last_error = None
+        # Recent run durations, newest last
+        self.durations = deque(maxlen=20)
+
+    @property
+    def mean_duration(self):
+        return self.total_duration / self.runs if self.runs else 0.0
+
+    def next_after(self, base):
+        """The next run time after ``base``, jittered so jobs drift apart instead of firing together"""
+        return base + self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+
+class Scheduler:
+    """Runs periodic jobs at persisted, jittered times
+
+    Next-run times are stored in the ``schedules`` table, so a deploy or
+    restart doesn't reset every job's cadence. Jobs that have never run are
+    first scheduled at a random point within one interval, which spreads
+    them out instead of running everything at startup. At most
+    ``max_concurrent`` jobs run at once, and each job has its own limit on
+    overlapping runs; a run that would exceed it is skipped.
+    """
+
+    def __init__(self, db_path, max_concurrent=2):
+        self.db_path = db_path
+        self.jobs = {}
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._wake = asyncio.Event()
+        self._task = None
+        self._running = set()
+
+    def every(self, name, seconds, fn, *, jitter=0.1, catch_up=SKIP, max_concurrency=1):
+        """Register ``async fn()`` to run every ``seconds``"""
+        if catch_up not in CATCH_UP_POLICIES:
+            raise ValueError(f"Unknown catch-up policy '{catch_up}'")
+        self.jobs[name] = ScheduledJob(name, seconds, fn, jitter, catch_up, max_concurrency)
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        if self.running:
+            return
+        await self._load()
+        self._task = asyncio.create_task(self._run(), name="scheduler")
+        logger.info(f"Scheduler started with {len(self.jobs)} jobs")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for task in list(self._running):
+            task.cancel()
+        await asyncio.gather(*self._running, return_exceptions=True)
+
+    async def _load(self):
+        now = time.time()
+        async with query_log.connect(self.db_path) as db:
+            await create_table(db)
+            async with db.execute(
+                "SELECT name, next_run_at, last_started_at, last_duration, max_duration, total_duration, "
+                "runs, failures, skipped, last_error FROM schedules"
+            ) as cursor:
+                saved = {row[0]: row[1:] for row in await cursor.fetchall()}
+
+        for job in self.jobs.values():
+            if job.name not in saved:
+                job.next_run = now + random.uniform(0, job.interval)
+                continue
+            (next_run, job.last_started, job.last_duration, job.max_duration, job.total_duration,
+             job.runs, job.failures, job.skipped, job.last_error) = saved[job.name]
+            # Never wait longer than the current interval, in case it was shortened
+            next_run = min(next_run, now + job.interval)
+            if next_run > now:
+                job.next_run = next_run
+                continue
+            missed = min(int((now - next_run) // job.interval) + 1, MAX_CATCH_UP)
+            if job.catch_up == SKIP:
+                job.next_run = now + random.uniform(0, job.interval)
+                logger.info(f"Skipping {missed} missed runs of {job.name}")
+            else:
+                count = 1 if job.catch_up == ONCE else missed
+                logger.info(f"Catching up {count} missed runs of {job.name}")
+                job.next_run = job.next_after(now)
+                self._launch(job, count)
+        await self._save_all()
+
+    async def _run(self):
+        while True:
+            now = time.time()
+            for job in self.jobs.values():
+                if job.next_run <= now:
+                    job.next_run = job.next_after(job.next_run)
+                    if job.next_run <= now:
+                        # Fell behind (e.g. the loop was blocked); don't fire a burst
+                        job.next_run = job.next_after(now)
+                    self._launch(job)
+            self._wake.clear()
+            delay = min((job.next_run for job in self.jobs.values()), default=now + 60) - time.time()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=max(0.1, min(delay, 60)))
+            except asyncio.TimeoutError:
+                pass
+
+    def _launch(self, job, count=1):
+        if job.running >= job.max_concurrency:
+            job.skipped += 1
+            logger.warning(f"Skipped a run of {job.name}, {job.running} still running")
+            self._spawn(self._save(job))
+            return
+        job.running += 1
+        self._spawn(self._execute(job, count))
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _execute(self, job, count):
+        try:
+            for _ in range(count):
+                async with self._slots:
+                    started = time.monotonic()
+                    job.last_started = time.time()
+                    try:
+                        await job.fn()
+                        job.last_error = None
+                    except Exception as e:
+                        job.failures += 1
+                        job.last_error = str(e)[:500]
+                        logger.error(f"Scheduled job {job.name} failed: {e}")
+                    duration = time.monotonic() - started
+                    job.runs += 1
+                    job.last_duration = duration
+                    job.max_duration = max(job.max_duration, duration)
+                    job.total_duration += duration
+                    job.durations.append(duration)
+                await self._save(job)
+        finally:
+            job.running -= 1
+
+    def run_now(self, name):
+        """Run a job straight away, outside its schedule"""
+        job = self.jobs[name]
+        self._launch(job)
+
+    async def _save(self, job):
+        await self._save_all([job])
+
+    async def _save_all(self, jobs=None):
+        rows = [
+            (job.name, job.interval, job.next_run, job.last_started, job.last_duration, job.max_duration,
+             job.total_duration, job.runs, job.failures, job.skipped, job.last_error)
+            for job in (jobs or self.jobs.values())
+        ]
+        try:
+            async with query_log.connect(self.db_path) as db:
+                await db.executemany(
+                    "INSERT OR REPLACE INTO schedules (name, interval_seconds, next_run_at, last_started_at, "
+                    "last_duration, max_duration, total_duration, runs, failures, skipped, last_error) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+                await db.commit()
+        except Exception as e:
+            logger.error(f"Could not save schedule state: {e}")
@@ -0,0 +1,93 @@
+import re
+import logging
+
+import aiosqlite
+
+import query_log
+
+logger = logging.getLogger("shop_bot")
+
+# Name matches count ten times as much as description matches
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+MAX_TERMS = 8
+
+_TERM = re.compile(r"\w+", re.UNICODE)
+
+_TRIGGERS = (
+    '''
+    CREATE TRIGGER IF NOT EXISTS items_fts_insert AFTER INSERT ON items BEGIN
+        INSERT INTO items_fts (rowid, name, description) VALUES (new.id, new.name, new.description);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS items_fts_delete AFTER DELETE ON items BEGIN
+        INSERT INTO items_fts (items_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS items_fts_update AFTER UPDATE OF name, description ON items BEGIN
+        INSERT INTO items_fts (items_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO items_fts (rowid, name, description) VALUES (new.id, new.name, new.description);
+    END
+    ''',
+)
+
+
+async def create_index(db):
+    """Create the items_fts index and the triggers that keep it in sync with items
+
+    The index is external-content: it stores only the tokens and reads
+    names and descriptions from the items table. It is built from the
+    existing items the first time it is created.
+    """
+    async with db.execute("SELECT 1 FROM sqlite_master WHERE name = 'items_fts'") as cursor:
+        exists = await cursor.fetchone() is not None
+    if exists:
+        return True
+    try:
+        await db.execute('''
+        CREATE VIRTUAL TABLE items_fts USING fts5 (
+            name, description,
+            content='items', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+        ''')
+    except aiosqlite.OperationalError as e:
+        logger.warning(f"Full-text search is unavailable, SQLite has no FTS5: {e}")
+        return False
+    for trigger in _TRIGGERS:
+        await db.execute(trigger)
+    await db.execute("INSERT INTO items_fts (items_fts) VALUES ('rebuild')")
+    logger.info("Built full-text search index over items")
+    return True
+
+
+def match_query(text):
+    """Turn free text into an FTS5 query that matches every term, the last one as a prefix
+
+    Terms are quoted, so FTS5 operators and punctuation typed by users are
+    searched for literally instead of raising syntax errors.
+    """
+    terms = _TERM.findall(text)[:MAX_TERMS]
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+async def search_items(db_path, text, limit=10):
+    """Items matching the text, best first: (id, name, price_cents, stock, name highlight, description snippet)"""
+    query = match_query(text)
+    if query is None:
+        return []
+    async with query_log.connect(db_path) as db:
+        async with db.execute(
+            "SELECT i.id, i.name, i.price_cents, i.stock, "
+            "highlight(items_fts, 0, '**', '**'), snippet(items_fts, 1, '**', '**', '…', 16) "
+            "FROM items_fts JOIN items i ON i.id = items_fts.rowid "
+            "WHERE items_fts MATCH ? ORDER BY bm25(items_fts, ?, ?) LIMIT ?",
+            (query, NAME_WEIGHT, DESCRIPTION_WEIGHT, limit)
+        ) as cursor:
+            return await cursor.fetchall()
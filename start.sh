@@ -1,18 +1,29 @@
 #!/bin/bash
 # Start script for Render
 
+# Listings, environment checks and debug flags only with STARTUP_DIAGNOSTICS=1;
+# each check script is another Python start before the bot's own
+case "$STARTUP_DIAGNOSTICS" in
+  1|true|yes) DIAGNOSTICS=1 ;;
+  *) DIAGNOSTICS= ;;
+esac
+
 # Debug: Print current directory
-echo "Current directory: $(pwd)"
-echo "Listing directory contents:"
-ls -la
+if [ -n "$DIAGNOSTICS" ]; then
+  echo "Current directory: $(pwd)"
+  echo "Listing directory contents:"
+  ls -la
+fi
 
 # Make sure required directories exist
 mkdir -p ./data
 mkdir -p ./cogs
 
 # Debug: Check if cogs directory now exists
-echo "After mkdir, checking cogs directory:"
-ls -la ./cogs || echo "Failed to list cogs directory"
+if [ -n "$DIAGNOSTICS" ]; then
+  echo "After mkdir, checking cogs directory:"
+  ls -la ./cogs || echo "Failed to list cogs directory"
+fi
 
 # If cogs directory is empty, try to copy from src directory
 if [ -d "/opt/render/project/src/cogs" ] && [ ! "$(ls -A ./cogs)" ]; then
@@ -32,23 +43,25 @@ if [ ! -f ".env" ]; then
   echo "LTC_ADDRESS=from_render_env" >> .env
 fi
 
-# Check environment variables
-echo "Environment variables check:"
-echo "DISCORD_TOKEN exists: $(if [ -n \"$DISCORD_TOKEN\" ]; then echo YES; else echo NO; fi)"
-echo "ADMIN_ROLE_ID exists: $(if [ -n \"$ADMIN_ROLE_ID\" ]; then echo YES; else echo NO; fi)"
-echo "LTC_ADDRESS exists: $(if [ -n \"$LTC_ADDRESS\" ]; then echo YES; else echo NO; fi)"
+if [ -n "$DIAGNOSTICS" ]; then
+  # Check environment variables
+  echo "Environment variables check:"
+  echo "DISCORD_TOKEN exists: $(if [ -n \"$DISCORD_TOKEN\" ]; then echo YES; else echo NO; fi)"
+  echo "ADMIN_ROLE_ID exists: $(if [ -n \"$ADMIN_ROLE_ID\" ]; then echo YES; else echo NO; fi)"
+  echo "LTC_ADDRESS exists: $(if [ -n \"$LTC_ADDRESS\" ]; then echo YES; else echo NO; fi)"
 
-# Set debug environment variables
-export DISCORD_DEBUG=1
-export DISCORD_COMMAND_DEBUG=1
+  # Set debug environment variables
+  export DISCORD_DEBUG=1
+  export DISCORD_COMMAND_DEBUG=1
 
-# Run token check script
-echo "Running token check script..."
-python restart_check.py
+  # Run token check script
+  echo "Running token check script..."
+  python restart_check.py
 
-# Run environment check script
-echo "Running environment check script..."
-python check_environment.py
+  # Run environment check script
+  echo "Running environment check script..."
+  python check_environment.py
+fi
 
 # Run the bot with proper error output and debug flags
 echo "Starting bot..."
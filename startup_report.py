@@ -0,0 +1,123 @@
+import os
+import re
+import sys
+import time
+import argparse
+import subprocess
+
+# "import time:       344 |      28184 |   monitor"
+IMPORT_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class ImportTiming:
+    """One line of ``python -X importtime`` output; times are microseconds"""
+
+    __slots__ = ("name", "self_us", "cumulative_us", "depth")
+
+    def __init__(self, name, self_us, cumulative_us, depth):
+        self.name = name
+        self.self_us = self_us
+        self.cumulative_us = cumulative_us
+        self.depth = depth
+
+
+def parse_importtime(text):
+    timings = []
+    for line in text.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            timings.append(ImportTiming(name, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return timings
+
+
+def direct_imports(timings, module):
+    """The modules ``module`` imported itself
+
+    importtime prints a module after everything it imported, so these are
+    the lines one level deeper just before the module's own line.
+    """
+    children = []
+    for timing in timings:
+        if timing.depth == 0:
+            if timing.name == module:
+                return children
+            children = []
+        elif timing.depth == 1:
+            children.append(timing)
+    return []
+
+
+def measure(module="main"):
+    """Import ``module`` in a fresh interpreter; returns (timings, wall seconds, RSS bytes)
+
+    Runs from the repository directory with DB_PATH and the bot's other
+    settings taken from the environment as usual. Importing main does not
+    open the database or write bot.log, so this is safe next to a live bot.
+    """
+    code = f"import {module}, memory; print(memory.rss_bytes())"
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], cwd=HERE, capture_output=True, text=True
+    )
+    wall = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    return parse_importtime(result.stderr), wall, int(result.stdout.split()[-1])
+
+
+def interpreter_baseline():
+    """Wall seconds and RSS of an interpreter that imports nothing of ours"""
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", "import resource; print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)"],
+        capture_output=True, text=True
+    )
+    return time.perf_counter() - started, int(result.stdout) * 1024
+
+
+def report(module="main", runs=3, top=15):
+    """Best of ``runs`` imports: totals, the slowest direct imports and the slowest modules overall"""
+    best = None
+    for _ in range(runs):
+        timings, wall, rss = measure(module)
+        total = next(timing.cumulative_us for timing in reversed(timings) if timing.name == module)
+        if best is None or total < best[0]:
+            best = (total, timings, wall, rss)
+    total, timings, wall, rss = best
+    base_wall, base_rss = interpreter_baseline()
+
+    lines = [
+        f"import {module}: {total / 1000:.1f} ms (best of {runs}), "
+        f"process {wall * 1000:.0f} ms wall, RSS {rss / 1024 / 1024:.1f} MiB",
+        f"bare interpreter: {base_wall * 1000:.0f} ms wall, RSS {base_rss / 1024 / 1024:.1f} MiB",
+        "",
+        f"Direct imports of {module} by cumulative time:",
+    ]
+    direct = direct_imports(timings, module)
+    for timing in sorted(direct, key=lambda timing: timing.cumulative_us, reverse=True)[:top]:
+        lines.append(f"  {timing.cumulative_us / 1000:8.1f} ms  {timing.name}")
+    lines.append("")
+    lines.append("Modules by self time:")
+    for timing in sorted(timings, key=lambda timing: timing.self_us, reverse=True)[:top]:
+        lines.append(f"  {timing.self_us / 1000:8.1f} ms  {timing.name}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure how long importing the bot takes and what it costs")
+    parser.add_argument("--module", default="main", help="Module to import (default: main)")
+    parser.add_argument("--runs", type=int, default=3, help="Imports to take the best of (default: 3)")
+    parser.add_argument("--top", type=int, default=15, help="Modules to list in each table")
+    args = parser.parse_args(argv)
+    try:
+        print(report(args.module, max(args.runs, 1), args.top))
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,8 @@
+import os
 import sqlite3
 
 # Connect to the database
-conn = sqlite3.connect('shop_database.db')
+conn = sqlite3.connect(os.getenv('DB_PATH', 'shop_database.db'))
 cursor = conn.cursor()
 
 # Update the drive link for the Music_Bot product (ID 1)
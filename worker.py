@@ -0,0 +1,147 @@
+import os
+import sys
+import time
+import socket
+import asyncio
+import logging
+
+from dotenv import load_dotenv
+
+import jobs
+import backups
+import query_log
+
+logger = logging.getLogger("shop_bot")
+
+
+async def backup(db_path, payload):
+    backup_dir = payload.get("dir") or backups.default_backup_dir(db_path)
+    path = await backups.run_backup(db_path, backup_dir, payload.get("keep", 14))
+    return {"path": path}
+
+
+# Job kind -> async handler(db_path, payload) returning a JSON-serializable result
+HANDLERS = {
+    "backup": backup,
+}
+
+
+class Worker:
+    """Claims jobs from the jobs table and runs them, a few at a time
+
+    Several workers, in any number of processes, can share one database:
+    claims are atomic and every running job holds a lease that is renewed
+    while it runs, so a crashed worker's jobs are picked up again.
+
+    Given a ``wake`` event, as the bot's in-process worker is, it doesn't
+    poll: when idle it waits for the event or for the next retry or lease
+    expiry to fall due. Separate processes can't be woken and poll every
+    ``poll_interval`` seconds.
+    """
+
+    def __init__(self, db_path, name, concurrency=2, lease=60, poll_interval=2, kinds=None, wake=None):
+        self.db_path = db_path
+        self.name = name
+        self.concurrency = concurrency
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.kinds = kinds or list(HANDLERS)
+        self.wake = wake
+        self._running = set()
+
+    async def run(self):
+        logger.info(f"Job worker {self.name} started ({self.concurrency} slots, kinds: {', '.join(self.kinds)})")
+        while True:
+            # Cleared before claiming so a notify() during the claim isn't lost
+            if self.wake is not None:
+                self.wake.clear()
+            free = self.concurrency - len(self._running)
+            claimed = []
+            timeout = self.poll_interval
+            if free > 0:
+                try:
+                    async with query_log.connect(self.db_path) as db:
+                        claimed = await jobs.claim(db, self.name, free, self.lease, self.kinds)
+                        if not claimed and self.wake is not None:
+                            due = await jobs.next_due(db, self.kinds)
+                            timeout = None if due is None else max(due - time.time(), 0)
+                except Exception as e:
+                    logger.error(f"Claiming jobs failed: {e}")
+            else:
+                # A finishing job sets the wake event
+                timeout = None
+            for job in claimed:
+                task = asyncio.create_task(self._run_job(job))
+                self._running.add(task)
+                task.add_done_callback(self._job_done)
+            if not claimed or len(self._running) >= self.concurrency:
+                await self._idle(timeout)
+
+    async def _idle(self, timeout):
+        if self.wake is None:
+            await asyncio.sleep(self.poll_interval)
+            return
+        try:
+            await asyncio.wait_for(self.wake.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def _job_done(self, task):
+        self._running.discard(task)
+        if self.wake is not None:
+            self.wake.set()
+
+    async def _keep_lease(self, job):
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            async with query_log.connect(self.db_path) as db:
+                if not await jobs.extend_lease(db, job, self.lease):
+                    logger.warning(f"Lost the lease on job #{job.id} ({job.kind})")
+                    return
+
+    async def _run_job(self, job):
+        heartbeat = asyncio.create_task(self._keep_lease(job))
+        try:
+            result = await HANDLERS[job.kind](self.db_path, job.payload)
+        except Exception as e:
+            logger.error(f"Job #{job.id} ({job.kind}) failed on attempt {job.attempts}: {e}")
+            async with query_log.connect(self.db_path) as db:
+                await jobs.fail(db, job, e)
+            return
+        finally:
+            heartbeat.cancel()
+        async with query_log.connect(self.db_path) as db:
+            if not await jobs.complete(db, job, result):
+                logger.warning(f"Result of job #{job.id} ({job.kind}) discarded, its lease was taken over")
+
+
+def main(argv=None):
+    # Only the command line needs argparse; the bot imports this module too
+    import argparse
+    parser = argparse.ArgumentParser(description="Run background jobs queued by the bot")
+    parser.add_argument("--db", default=None, help="Path to the shop database (default: DB_PATH)")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv('WORKER_CONCURRENCY', 2)))
+    parser.add_argument("--lease", type=int, default=60, help="Seconds a claimed job is leased for")
+    parser.add_argument("--name", default="worker", help="Name recorded on claimed jobs")
+    parser.add_argument("--kinds", nargs="*", choices=list(HANDLERS), help="Only run these job kinds")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[logging.FileHandler("bot.log"), logging.StreamHandler()]
+    )
+    db_path = args.db or os.getenv('DB_PATH', 'shop_database.db')
+    worker = Worker(
+        db_path, f"{socket.gethostname()}:{os.getpid()}:{args.name}", args.concurrency, args.lease, kinds=args.kinds
+    )
+    try:
+        asyncio.run(worker.run())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())